@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    marc_backends.py
+# @brief   Compare the speed of the MARC XML parser backends
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+#
+# Usage: marc_backends.py [number of repetitions]
+#
+# Parses each of the MARC XML files in tests/data the given number of times
+# (default: 200) using each of the parser backends available, and prints the
+# number of records per second.  The records of each file are also parsed as
+# a page of 200 records, the most TIND returns at once, because the fixed
+# cost of starting a parser weighs heavily on files holding a few records.
+# Also checks that all the backends extract the same record ids and URLs,
+# and exits with an error if they do not.
+#
+# Typical results: lxml is 30-75% faster on full records, and about 10%
+# slower on records holding only fields 001 and 856 (as fetched in slim
+# mode), where both parse well over 100,000 records per second.
+
+from   glob import glob
+import io
+import os
+import re
+import sys
+from   time import time
+
+# Allow this program to be executed directly from the 'dev/benchmarks' directory.
+sys.path.append(os.path.join(os.path.dirname(__file__), "../.."))
+
+from turf.marcxml import BACKENDS, marc_records
+from turf.turf import _tind_records
+
+
+_PAGE_SIZE = 200
+'''Number of records in a page of search results from TIND, at most.'''
+
+
+def extracted(content, backend):
+    return [(record.id, record.urls)
+            for record in _tind_records(marc_records(io.BytesIO(content), backend))]
+
+
+def as_page(content, size):
+    # Returns a MARC XML document holding 'size' records, made by repeating
+    # the records in 'content'.
+    records = re.findall(rb'<record>.*?</record>', content, re.S)
+    start = content.index(b'<record>')
+    end = content.rindex(b'</record>') + len(b'</record>')
+    repeated = [records[i % len(records)] for i in range(size)]
+    return content[:start] + b'\n'.join(repeated) + content[end:]
+
+
+def timed(content, repetitions):
+    # Prints the records per second for each backend and returns the results.
+    results = {}
+    for backend in BACKENDS:
+        began = time()
+        for i in range(repetitions):
+            results[backend] = extracted(content, backend)
+        rate = len(results[backend]) * repetitions / (time() - began)
+        print('  {:>5}: {:>9.0f} records/s'.format(backend, rate))
+    return results
+
+
+if __name__ == '__main__':
+    repetitions = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    if len(BACKENDS) < 2:
+        print('Only the {} backend is available; install lxml to compare'.format(
+            BACKENDS[0]))
+    data_dir = os.path.join(os.path.dirname(__file__), '../../tests/data')
+    mismatches = 0
+    for file in sorted(glob(os.path.join(data_dir, '*.xml'))):
+        with open(file, 'rb') as f:
+            content = f.read()
+        print(os.path.basename(file))
+        results = timed(content, repetitions)
+        if any(result != results[BACKENDS[0]] for result in results.values()):
+            print('  ERROR: the backends extracted different ids or URLs')
+            mismatches += 1
+        count = len(results[BACKENDS[0]])
+        print('  as a page of {} records:'.format(_PAGE_SIZE))
+        timed(as_page(content, _PAGE_SIZE), max(1, repetitions * count // _PAGE_SIZE))
+    sys.exit(1 if mismatches else 0)
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    marc_memory.py
+# @brief   Measure peak memory use when reading a large MARC XML file
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+#
+# Usage: marc_memory.py [number of records]
+#
+# Writes a synthetic MARC XML dump with the given number of records (default:
+# 200000) to a temporary file, then reads the record ids and URLs from it in
+# two ways, each in a separate process: by parsing the whole file into a tree
+# first (as entries_from_file() used to do), and by streaming the records
+# (as it does now).  For each, prints the time taken and the peak resident
+# set size of the process.
+
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+from   time import time
+
+# Allow this program to be executed directly from the 'dev/benchmarks' directory.
+sys.path.append(os.path.join(os.path.dirname(__file__), "../.."))
+
+_RECORD = '''<record>
+  <controlfield tag="001">{0}</controlfield>
+  <controlfield tag="005">20180329135936.0</controlfield>
+  <datafield tag="245" ind1="1" ind2="0">
+    <subfield code="a">Title of item number {0}</subfield>
+    <subfield code="c">Some Author</subfield>
+  </datafield>
+  <datafield tag="500" ind1=" " ind2=" ">
+    <subfield code="a">A note long enough to be typical of the catalog, item {0}.</subfield>
+  </datafield>
+  <datafield tag="856" ind1="4" ind2="0">
+    <subfield code="u">http://example.org/item/{0}</subfield>
+    <subfield code="z">Online version</subfield>
+  </datafield>
+</record>
+'''
+
+
+def write_dump(file, count):
+    with open(file, 'w') as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<collection xmlns="http://www.loc.gov/MARC21/slim">\n')
+        for i in range(1, count + 1):
+            f.write(_RECORD.format(i))
+        f.write('</collection>\n')
+
+
+def read_dump(file, method):
+    from xml.etree import ElementTree
+    from turf.marcxml import MARC_RECORD, marc_records
+    from turf.turf import _tind_records
+    began = time()
+    with open(file, 'rb') as f:
+        if method == 'tree':
+            elements = ElementTree.parse(f).iter(MARC_RECORD)
+        else:
+            elements = marc_records(f)
+        count = sum(1 for record in _tind_records(elements))
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print('{:>6}: {} records in {:.1f}s, peak RSS {:.0f} MB'.format(
+        method, count, time() - began, peak / 1024))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 3:
+        read_dump(sys.argv[1], sys.argv[2])
+        sys.exit()
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    with tempfile.TemporaryDirectory() as tmpdir:
+        file = os.path.join(tmpdir, 'dump.xml')
+        write_dump(file, count)
+        print('{} records, {:.0f} MB of MARC XML'.format(
+            count, os.path.getsize(file) / 1024 / 1024))
+        for method in ['tree', 'stream']:
+            subprocess.run([sys.executable, __file__, file, method], check = True)
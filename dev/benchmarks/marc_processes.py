@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# =============================================================================
+# @file    marc_processes.py
+# @brief   Measure how parsing a large MARC file scales with processes
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+#
+# Usage: marc_processes.py [number of records [maximum number of processes]]
+#
+# Writes a synthetic MARC XML dump with the given number of records (default:
+# 200000) to a temporary file, together with the same records in binary MARC,
+# then reads the record ids and URLs from each file the way entries_from_file()
+# does, using 1, 2, 4, ... processes up to the number of CPU cores (or the
+# maximum given).  Prints the
+# time taken and the speedup over 1 process, and checks that the records come
+# out the same and in the same order each time.
+
+import os
+import sys
+import tempfile
+from   time import time
+
+# Allow this program to be executed directly from the 'dev/benchmarks' directory.
+sys.path.append(os.path.join(os.path.dirname(__file__), "../.."))
+
+from marc_memory import write_dump
+from turf.marcxml import marc_records
+from turf.turf import _file_records, _tind_records
+
+
+def write_marc21(xml_file, file):
+    # Writes the records in 'xml_file' to 'file' in binary MARC, with only
+    # the fields Turf uses.
+    with open(xml_file, 'rb') as input, open(file, 'wb') as output:
+        for record in _tind_records(marc_records(input)):
+            fields = [('001', record.id.encode() + b'\x1e')]
+            fields += [('856', b'40\x1fu' + url.encode() + b'\x1e') for url in record.urls]
+            directory = b''
+            data = b''
+            for (tag, field) in fields:
+                directory += tag.encode() + b'%04d%05d' % (len(field), len(data))
+                data += field
+            base = 24 + len(directory) + 1
+            leader = b'%05dnam a22%05d a 4500' % (base + len(data) + 1, base)
+            output.write(leader + directory + b'\x1e' + data + b'\x1d')
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    cores = int(sys.argv[2]) if len(sys.argv) > 2 else (os.cpu_count() or 1)
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        xml_file = os.path.join(tmpdir, 'dump.xml')
+        marc21_file = os.path.join(tmpdir, 'dump.mrc')
+        write_dump(xml_file, count)
+        write_marc21(xml_file, marc21_file)
+        print('{} records; up to {} processes on {} CPU cores'.format(
+            count, cores, os.cpu_count()))
+        for file in [xml_file, marc21_file]:
+            print('{} ({:.0f} MB):'.format(os.path.basename(file),
+                                           os.path.getsize(file) / 1024 / 1024))
+            expected = None
+            for processes in counts:
+                began = time()
+                records = [(r.id, r.urls) for r in _file_records(file, processes)]
+                elapsed = time() - began
+                if expected is None:
+                    (expected, base_time) = (records, elapsed)
+                print('  {:>3} processes: {:6.2f}s, speedup {:.2f}{}'.format(
+                    processes, elapsed, base_time / elapsed,
+                    '' if records == expected else ' -- ERROR: different results'))
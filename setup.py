@@ -43,6 +43,7 @@ setup(
     license          = version['__license__'],
     keywords         = "TIND MARC library-catalogues",
     packages         = ['turf'],
+    package_data     = {'turf': ['data/*.json']},
     scripts          = ['bin/turf'],
     install_requires = reqs,
     platforms        = 'any',
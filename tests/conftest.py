@@ -0,0 +1,13 @@
+# =============================================================================
+# @file    conftest.py
+# @brief   Shared setup for the Turf tests
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import os
+import sys
+
+# Allow the tests to be run from the top-level directory or from 'tests'.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
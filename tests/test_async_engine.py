@@ -0,0 +1,88 @@
+# =============================================================================
+# @file    test_async_engine.py
+# @brief   Tests for checking URLs with asyncio
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+from   http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from   threading import Thread
+
+import pytest
+
+import turf.async_engine
+from turf.async_engine import AsyncUrlEngine, _kept, _cookies_for
+from turf.status import MALFORMED_URL, BAD_PORT
+
+
+class Handler(BaseHTTPRequestHandler):
+    # Paths are of the form /set/<host>/<port>, which sets a cookie and
+    # redirects to http://<host>:<port>/end, and /end, which answers 200.
+    cookies_received = []
+
+    def do_GET(self):
+        Handler.cookies_received.append((self.headers['Host'], self.headers['Cookie']))
+        if self.path.startswith('/set/'):
+            (_, _, host, port) = self.path.split('/')
+            self.send_response(302)
+            self.send_header('Set-Cookie', 'session=secret; Path=/')
+            self.send_header('Location', 'http://{}:{}/end'.format(host, port))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def port():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    Thread(target = server.serve_forever, daemon = True).start()
+    Handler.cookies_received = []
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    # Urlup's test of well-formed URLs rejects local addresses.
+    monkeypatch.setattr(turf.async_engine, 'normalized_url', lambda url: url)
+    engine = AsyncUrlEngine()
+    engine.start()
+    yield engine
+    engine.stop()
+
+
+def test_cookie_sent_back_to_same_host(port, engine):
+    url = 'http://127.0.0.1:{0}/set/127.0.0.1/{0}'.format(port)
+    result = engine.checked_url_from_thread(url)
+    assert result.error is None
+    assert Handler.cookies_received[-1][1] == 'session=secret'
+
+
+def test_cookie_not_sent_to_other_host(port, engine):
+    url = 'http://127.0.0.1:{0}/set/localhost/{0}'.format(port)
+    result = engine.checked_url_from_thread(url)
+    assert result.error is None
+    assert Handler.cookies_received[-1] == ('localhost:{}'.format(port), None)
+
+
+def test_cookie_domains():
+    jar = {}
+    _kept(jar, 'www.example.org', 'a=1; Path=/')
+    _kept(jar, 'www.example.org', 'b=2; Domain=.example.org')
+    _kept(jar, 'www.example.org', 'c=3; Domain=other.org')
+    assert _cookies_for(jar, 'www.example.org') == {'a': '1', 'b': '2'}
+    assert _cookies_for(jar, 'cdn.example.org') == {'b': '2'}
+    assert _cookies_for(jar, 'example.org') == {'b': '2'}
+    assert _cookies_for(jar, 'other.org') == {}
+
+
+@pytest.mark.parametrize('url, error', [('http://[bad-link/x', MALFORMED_URL),
+                                        ('http://127.0.0.1:x/', BAD_PORT)])
+def test_malformed_url(engine, url, error):
+    assert engine.checked_url_from_thread(url).error == error
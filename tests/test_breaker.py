@@ -0,0 +1,110 @@
+# =============================================================================
+# @file    test_breaker.py
+# @brief   Tests for skipping hosts that fail to respond
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import pytest
+from   urlup import UrlData
+
+import turf.breaker
+from turf.breaker import CircuitBreaker
+from turf.errors import HostUnavailable
+from turf.status import CONNECT_TIMEOUT
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(turf.breaker, 'time', clock)
+    return clock
+
+
+def url(n):
+    return 'http://a.test/{}'.format(n)
+
+
+def ok(n):
+    return UrlData(url(n), url(n), 200, None)
+
+
+def timeout(n):
+    return UrlData(url(n), None, None, CONNECT_TIMEOUT)
+
+
+def tripped(breaker, first = 0):
+    for n in range(first, first + breaker.failure_limit):
+        breaker.record(url(n), timeout(n), breaker.check(url(n)))
+
+
+def test_host_skipped_after_failures(clock):
+    breaker = CircuitBreaker(failure_limit = 3, cooldown = 10)
+    tripped(breaker)
+    with pytest.raises(HostUnavailable):
+        breaker.check(url(10))
+    assert breaker.skipped == 1
+    breaker.check('http://b.test/1')
+
+
+def test_probe_success_reopens_host(clock):
+    breaker = CircuitBreaker(failure_limit = 3, cooldown = 10)
+    tripped(breaker)
+    clock.now += 11
+    probe = breaker.check(url(10))
+    assert probe is not None
+    with pytest.raises(HostUnavailable):
+        breaker.check(url(11))
+    breaker.record(url(10), ok(10), probe)
+    assert breaker.check(url(12)) is None
+
+
+def test_probe_failure_doubles_wait(clock):
+    breaker = CircuitBreaker(failure_limit = 3, cooldown = 10)
+    tripped(breaker)
+    clock.now += 11
+    breaker.record(url(10), timeout(10), breaker.check(url(10)))
+    clock.now += 11
+    with pytest.raises(HostUnavailable):
+        breaker.check(url(11))
+    clock.now += 10
+    assert breaker.check(url(11)) is not None
+
+
+def test_checks_in_flight_do_not_decide_for_probe(clock):
+    breaker = CircuitBreaker(failure_limit = 3, cooldown = 10)
+    # Checks started while the host was still considered up.
+    in_flight = [(n, breaker.check(url(n))) for n in range(100, 104)]
+    tripped(breaker)
+    clock.now += 11
+    probe = breaker.check(url(10))
+    # A success or failure of an earlier check neither reopens the host nor
+    # makes it skipped for longer, and doesn't let a second probe through.
+    (n, token) = in_flight.pop()
+    breaker.record(url(n), ok(n), token)
+    with pytest.raises(HostUnavailable):
+        breaker.check(url(11))
+    (n, token) = in_flight.pop()
+    breaker.record(url(n), timeout(n), token)
+    with pytest.raises(HostUnavailable):
+        breaker.check(url(12))
+    # The probe alone decides.
+    breaker.record(url(10), ok(10), probe)
+    assert breaker.check(url(13)) is None
+
+
+def test_abandoned_probe_lets_another_through(clock):
+    breaker = CircuitBreaker(failure_limit = 3, cooldown = 10)
+    tripped(breaker)
+    clock.now += 11
+    breaker.record(url(10), None, breaker.check(url(10)))
+    assert breaker.check(url(11)) is not None
@@ -0,0 +1,120 @@
+# =============================================================================
+# @file    test_checkpoint.py
+# @brief   Tests for saving and resuming the progress of a search
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import csv
+import json
+
+from   urlup import UrlData
+
+from turf.checkpoint import Checkpoint
+from turf.data_types import TindData
+from turf.writers import write_csv
+
+
+def record(id):
+    url = 'http://example.org/{}'.format(id)
+    return TindData(str(id), [UrlData(url, url + '/moved', 301, None)])
+
+
+def results(checkpoint, ids, interrupt_at = None):
+    # Mimics the way entries_from_search() reports its progress.
+    try:
+        for (offset, id) in enumerate(ids, checkpoint.offset):
+            if id == interrupt_at:
+                raise KeyboardInterrupt
+            yield record(id)
+            checkpoint.update(offset + 1, str(id))
+    finally:
+        checkpoint.save()
+    yield None
+
+
+def ids_in(csv_file):
+    with open(csv_file, newline = '') as f:
+        return [row[0] for row in csv.reader(f)][1:]
+
+
+def test_resume_after_interruption(tmp_path):
+    output = str(tmp_path / 'out.csv')
+    file = output + '.checkpoint'
+    checkpoint = Checkpoint(file, 'query')
+    write_csv(output, results(checkpoint, [1, 2, 3, 4], interrupt_at = 3),
+              False, False, checkpoint)
+    assert ids_in(output) == ['1', '2']
+
+    checkpoint = Checkpoint.load(file)
+    assert checkpoint.offset == 3
+    assert checkpoint.seen == {'1', '2'}
+    write_csv(output, results(checkpoint, [3, 4]), False, False, checkpoint)
+    assert ids_in(output) == ['1', '2', '3', '4']
+
+    checkpoint = Checkpoint.load(file)
+    assert checkpoint.offset == 5
+    assert [row.id for row in checkpoint.rows] == ['1', '2', '3', '4']
+
+
+def test_unfinished_record_is_not_saved(tmp_path):
+    file = str(tmp_path / 'out.csv.checkpoint')
+    checkpoint = Checkpoint(file, 'query')
+    checkpoint.add_row(record(1))
+    checkpoint.update(2, '1')
+    # Stopped after the row for record 2 was written but before the search
+    # counted the record as done.
+    checkpoint.add_row(record(2))
+    checkpoint.save()
+    checkpoint = Checkpoint.load(file)
+    assert checkpoint.offset == 2
+    assert checkpoint.seen == {'1'}
+    assert [row.id for row in checkpoint.rows] == ['1']
+
+
+def test_save_appends_only_new_entries(tmp_path):
+    file = str(tmp_path / 'out.csv.checkpoint')
+    checkpoint = Checkpoint(file, 'query', stop = 10)
+    for id in range(1, 4):
+        checkpoint.add_row(record(id))
+        checkpoint.update(id + 1, str(id))
+        checkpoint.save()
+    checkpoint = Checkpoint.load(file)
+    for row in checkpoint.take_rows():
+        checkpoint.add_row(row)
+    checkpoint.add_row(record(4))
+    checkpoint.update(5, '4')
+    checkpoint.save()
+    with open(file) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines[0] == {'query': 'query', 'stop': 10}
+    assert [[row['id'] for row in line['rows']] for line in lines[1:]] == \
+        [['1'], ['2'], ['3'], ['4']]
+    assert Checkpoint.load(file).stop == 10
+
+
+def test_incomplete_last_line_is_ignored(tmp_path):
+    file = str(tmp_path / 'out.csv.checkpoint')
+    checkpoint = Checkpoint(file, 'query')
+    checkpoint.add_row(record(1))
+    checkpoint.update(2, '1')
+    checkpoint.save()
+    with open(file, 'a') as f:
+        f.write('{"offset": 3, "seen": ["2"')
+    checkpoint = Checkpoint.load(file)
+    assert checkpoint.offset == 2
+    assert checkpoint.seen == {'1'}
+
+
+def test_rows_not_kept_after_saving(tmp_path):
+    file = str(tmp_path / 'out.csv.checkpoint')
+    checkpoint = Checkpoint(file, 'query')
+    for id in range(1, 101):
+        checkpoint.add_row(record(id))
+        checkpoint.update(id + 1, str(id))
+        if id % 10 == 0:
+            checkpoint.save()
+    assert checkpoint.rows == []
+    assert checkpoint._new_rows == []
+    assert len(Checkpoint.load(file).take_rows()) == 100
@@ -0,0 +1,43 @@
+# =============================================================================
+# @file    test_files.py
+# @brief   Tests for reading records from files
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import pytest
+
+from turf.data_types import ProxyInfo, UIsettings
+from turf.turf import entries_from_file
+
+
+@pytest.fixture
+def records_file(tmp_path):
+    # A MARC XML file with records 1 to 10, without URLs to check.
+    file = str(tmp_path / 'records.xml')
+    with open(file, 'w') as f:
+        f.write('<collection xmlns="http://www.loc.gov/MARC21/slim">'
+                + ''.join('<record><controlfield tag="001">{}</controlfield></record>'
+                          .format(id) for id in range(1, 11))
+                + '</collection>')
+    return file
+
+
+def ids(file, total, start):
+    return [data.id for data in entries_from_file(file, total, start, ProxyInfo(),
+                                                  UIsettings())]
+
+
+@pytest.mark.parametrize('total, start, expected', [
+    (None, None, list(range(1, 11))),
+    (None, 1,    list(range(1, 11))),
+    (None, 4,    list(range(4, 11))),
+    (3,    1,    [1, 2, 3]),
+    (3,    4,    [4, 5, 6]),
+    (30,   8,    [8, 9, 10]),
+    (None, 11,   []),
+    (5,    20,   []),
+])
+def test_start_and_total(records_file, total, start, expected):
+    assert ids(records_file, total, start) == [str(id) for id in expected]
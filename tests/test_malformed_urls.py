@@ -0,0 +1,89 @@
+# =============================================================================
+# @file    test_malformed_urls.py
+# @brief   Tests that malformed URLs in records don't stop a run
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import asyncio
+
+import pytest
+from   urlup import UrlData
+
+from turf.breaker import CircuitBreaker
+from turf.data_types import TindRecord
+from turf.dedup import UrlDeduplicator
+from turf.hosts import HostScheduler
+from turf.redirects import RedirectLearner
+from turf.rewrites import RewriteRules
+from turf.status import MALFORMED_URL
+from turf.timing import CheckTimer
+from turf.turf import _urlup_data, _tind_data, _async_tind_data, canonical_url
+
+
+MALFORMED = ['http://[bad-link/x', 'http://[::1/x', 'https://]/x']
+
+
+@pytest.mark.parametrize('url', MALFORMED)
+def test_host_slot(url):
+    hosts = HostScheduler()
+    with hosts.slot(url):
+        pass
+    async def check():
+        async with hosts.async_slot(url):
+            pass
+    asyncio.run(check())
+    assert hosts.checks == 2
+
+
+@pytest.mark.parametrize('url', MALFORMED)
+def test_canonical_url(url):
+    assert canonical_url(' ' + url + ' ') == url
+    dedup = UrlDeduplicator(canonical_url)
+    result = dedup.result(url, lambda url: UrlData(url, None, None, MALFORMED_URL))
+    assert result.error == MALFORMED_URL
+
+
+@pytest.mark.parametrize('url', MALFORMED)
+def test_breaker(url):
+    breaker = CircuitBreaker(failure_limit = 1)
+    for _ in range(3):
+        breaker.check(url)
+        breaker.record(url, UrlData(url, None, None, MALFORMED_URL))
+    assert breaker.skipped == 0
+
+
+class MalformedEngine():
+    def checked_url_from_thread(self, url):
+        return UrlData(url, None, None, MALFORMED_URL)
+
+
+class AsyncMalformedEngine():
+    async def checked_url(self, url):
+        return UrlData(url, None, None, MALFORMED_URL)
+
+
+def test_record_with_malformed_url():
+    url = MALFORMED[0]
+    results = _urlup_data([url, url], None, HostScheduler(), CircuitBreaker(),
+                          UrlDeduplicator(canonical_url), RedirectLearner(), False,
+                          CheckTimer(), None, MalformedEngine(), None)
+    assert [(data.original, data.error) for data in results] == [(url, MALFORMED_URL)] * 2
+
+
+@pytest.mark.parametrize('engine', ['threads', 'async'])
+@pytest.mark.parametrize('urls, expected', [
+    (['', '  '], []),
+    (['', 'http://a.test/x', ' '], ['http://a.test/x']),
+])
+def test_blank_urls_left_out(engine, urls, expected):
+    record = TindRecord('1', urls)
+    args = (None, HostScheduler(), CircuitBreaker(), UrlDeduplicator(canonical_url),
+            RedirectLearner(), False, CheckTimer(), RewriteRules())
+    if engine == 'threads':
+        # With no engine given, blank URLs would go to Urlup.
+        data = _tind_data(record, *args, engine = MalformedEngine() if expected else None)
+    else:
+        data = asyncio.run(_async_tind_data(record, *args, AsyncMalformedEngine()))
+    assert [url_data.original for url_data in data.url_data] == expected
@@ -0,0 +1,121 @@
+# =============================================================================
+# @file    test_marc21.py
+# @brief   Tests for reading binary MARC (ISO 2709) files
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import glob
+import gzip
+import io
+from   os import path
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from turf.chunks import parsed_in_parallel
+from turf.marc21 import marc21_records, mapped_marc21_records
+from turf.turf import _file_records
+
+
+DATA_DIR = path.join(path.dirname(__file__), 'data')
+
+MARC = '{http://www.loc.gov/MARC21/slim}'
+
+
+def encoded(id, urls, length = None):
+    '''Return the binary MARC form of a record with the given field 001 and
+    fields 856 holding 'urls', plus a field 245 in between.  If 'length' is
+    given, it is put in the leader in place of the real length.'''
+    fields = [(b'001', id.encode())]
+    fields.append((b'245', b'10\x1faA title'))
+    fields += [(b'856', b'40\x1fu' + url.encode() + b'\x1fzLink') for url in urls]
+    directory = b''
+    data = b''
+    for (tag, content) in fields:
+        content += b'\x1e'
+        directory += tag + b'%04d%05d' % (len(content), len(data))
+        data += content
+    directory += b'\x1e'
+    base = 24 + len(directory)
+    total = base + len(data) + 1
+    leader = b'%05dnam a22%05d   4500' % (length or total, base)
+    return leader + directory + data + b'\x1d'
+
+
+def xml_records(file):
+    # Returns (id, urls) for the records in a MARC XML file.
+    records = []
+    for record in ElementTree.parse(file).getroot().iter(MARC + 'record'):
+        id = next((field.text for field in record.iter(MARC + 'controlfield')
+                   if field.get('tag') == '001'), '')
+        urls = [subfield.text for field in record.iter(MARC + 'datafield')
+                if field.get('tag') == '856'
+                for subfield in field.iter(MARC + 'subfield') if subfield.get('code') == 'u']
+        records.append((id, urls))
+    return records
+
+
+@pytest.fixture(params = sorted(glob.glob(path.join(DATA_DIR, '*.xml'))),
+                ids = path.basename)
+def converted(request, tmp_path):
+    # Returns the name of a MARC XML file in tests/data, its records, and
+    # the name of a binary MARC file with the same records.
+    records = xml_records(request.param)
+    file = str(tmp_path / 'records.mrc')
+    with open(file, 'wb') as f:
+        for (id, urls) in records:
+            f.write(encoded(id, urls))
+    return (request.param, records, file)
+
+
+def test_readers_agree(converted):
+    (_, records, file) = converted
+    with open(file, 'rb') as f:
+        assert list(marc21_records(f)) == records
+    assert list(mapped_marc21_records(file)) == records
+    assert list(parsed_in_parallel(file, 'marc21', marc21_records, 2,
+                                   chunk_size = 200)) == records
+
+
+def test_same_as_marc_xml(converted):
+    (xml_file, _, file) = converted
+    as_tuples = lambda file: [(r.id, r.urls) for r in _file_records(file)]
+    assert as_tuples(file) == as_tuples(xml_file)
+    assert as_tuples(file) == [(r.id, r.urls) for r in _file_records(file, 2)]
+
+
+def test_compressed_file(tmp_path):
+    records = [('1', ['http://example.org/a']), ('2', []), ('3', ['http://example.org/c'])]
+    file = str(tmp_path / 'records.mrc.gz')
+    with gzip.open(file, 'wb') as f:
+        for (id, urls) in records:
+            f.write(encoded(id, urls))
+    assert [(r.id, r.urls) for r in _file_records(file)] == records
+
+
+def test_wrong_lengths_and_filler(tmp_path):
+    records = [('1', ['http://example.org/a']), ('2', ['http://example.org/b']),
+               ('3', ['http://example.org/c'])]
+    content = (encoded(*records[0], length = 99999) + b'\r\n'
+               + encoded(*records[1], length = 12) + b'\n'
+               + encoded(*records[2]) + b'\x1a')
+    file = str(tmp_path / 'records.mrc')
+    with open(file, 'wb') as f:
+        f.write(content)
+    assert list(marc21_records(io.BytesIO(content))) == records
+    assert list(mapped_marc21_records(file)) == records
+    assert list(parsed_in_parallel(file, 'marc21', marc21_records, 2,
+                                   chunk_size = 10)) == records
+
+
+def test_incomplete_record(tmp_path):
+    content = encoded('1', ['http://example.org/a'])[:-10]
+    file = str(tmp_path / 'records.mrc')
+    with open(file, 'wb') as f:
+        f.write(content)
+    with pytest.raises(ValueError):
+        list(marc21_records(io.BytesIO(content)))
+    with pytest.raises(ValueError):
+        list(mapped_marc21_records(file))
@@ -0,0 +1,80 @@
+# =============================================================================
+# @file    test_marcxml.py
+# @brief   Tests for parsing MARC XML
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import glob
+import io
+from   os import path
+import xml.etree.ElementTree as ElementTree
+
+import pytest
+
+from turf.marcxml import BACKENDS, marc_records
+from turf.turf import _tind_records
+
+
+DATA_DIR = path.join(path.dirname(__file__), 'data')
+
+FIXTURES = sorted(glob.glob(path.join(DATA_DIR, '*.xml')))
+
+
+def extracted(file, backend):
+    with open(file, 'rb') as f:
+        return [(record.id, record.urls)
+                for record in _tind_records(marc_records(f, backend))]
+
+
+@pytest.mark.parametrize('file', FIXTURES, ids = path.basename)
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_backends_agree(file, backend):
+    records = extracted(file, backend)
+    assert records
+    assert records == extracted(file, 'etree')
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_truncated_input(backend):
+    # Both backends raise the same error, which the Retrier knows to retry.
+    with open(FIXTURES[0], 'rb') as f:
+        content = f.read()
+    with pytest.raises(ElementTree.ParseError):
+        list(marc_records(io.BytesIO(content[:len(content) // 2]), backend))
+
+
+def test_unknown_backend():
+    with pytest.raises(ValueError):
+        marc_records(io.BytesIO(b''), 'expat')
+
+
+class CountingReader():
+    '''File-like object over 'content' that counts the bytes read from it.'''
+
+    def __init__(self, content):
+        self._stream = io.BytesIO(content)
+        self.bytes_read = 0
+
+    def read(self, size = -1):
+        data = self._stream.read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+@pytest.mark.parametrize('backend', BACKENDS)
+def test_records_are_streamed(backend):
+    content = (b'<collection xmlns="http://www.loc.gov/MARC21/slim">'
+               + b''.join(b'<record><controlfield tag="001">%d</controlfield>'
+                          b'<datafield tag="856" ind1="4" ind2="0">'
+                          b'<subfield code="u">http://example.org/%d</subfield>'
+                          b'</datafield></record>\n' % (i, i) for i in range(20000))
+               + b'</collection>')
+    stream = CountingReader(content)
+    records = marc_records(stream, backend)
+    first = next(records)
+    assert first.tag.endswith('record')
+    assert stream.bytes_read < len(content) // 4
+    assert sum(1 for _ in records) == 19999
+    assert stream.bytes_read == len(content)
@@ -0,0 +1,77 @@
+# =============================================================================
+# @file    test_network.py
+# @brief   Tests for the decoding of compressed responses
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import gzip
+import io
+import zlib
+
+import pytest
+
+from turf.network import DecodedResponse, TransferStats
+
+
+BODY = b''.join(b'<record><id>%d</id></record>\n' % i for i in range(20000))
+
+
+def raw_deflated(data):
+    compressor = zlib.compressobj(wbits = -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+ENCODINGS = [(None, lambda data: data),
+             ('gzip', gzip.compress),
+             ('deflate', zlib.compress),
+             ('deflate', raw_deflated),
+             ('GZIP', gzip.compress)]
+
+
+class FakeResponse():
+    def __init__(self, body, encoding):
+        self._body = io.BytesIO(body)
+        self._headers = {'Content-Encoding': encoding} if encoding else {}
+        self.status = 200
+        self.reason = 'OK'
+        self.headers = self._headers
+
+    def getheader(self, name, default = None):
+        return self._headers.get(name, default)
+
+    def read(self, amt = None):
+        return self._body.read(amt)
+
+
+@pytest.mark.parametrize('encoding, encode', ENCODINGS)
+def test_read_all(encoding, encode):
+    stats = TransferStats()
+    wire = encode(BODY)
+    response = DecodedResponse(FakeResponse(wire, encoding), stats)
+    assert response.read() == BODY
+    assert response.read() == b''
+    assert stats.wire_bytes == len(wire)
+    assert stats.content_bytes == len(BODY)
+    assert (stats.compressed_reads > 0) == (encoding is not None)
+
+
+@pytest.mark.parametrize('encoding, encode', ENCODINGS)
+def test_read_in_small_amounts(encoding, encode):
+    response = DecodedResponse(FakeResponse(encode(BODY), encoding), TransferStats())
+    parts = []
+    while True:
+        data = response.read(1000)
+        assert len(data) <= 1000
+        if not data:
+            break
+        parts.append(data)
+    assert b''.join(parts) == BODY
+
+
+def test_corrupt_body():
+    response = DecodedResponse(FakeResponse(b'not compressed at all', 'gzip'),
+                               TransferStats())
+    with pytest.raises(zlib.error):
+        response.read()
@@ -0,0 +1,64 @@
+# =============================================================================
+# @file    test_partitions.py
+# @brief   Tests for fetching searches in ranges of record ids
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+from turf.partitions import PartitionFetcher, Partition, partitioned
+
+
+class Record():
+    def __init__(self, id):
+        self.id = id
+
+
+def server(records, cap = None, repeat_last = False):
+    '''Return a fetch function serving 'records' for every query, returning
+    at most 'cap' records per page whatever the page size asked for.'''
+    def fetch(query, start, size):
+        size = min(size, cap) if cap else size
+        page = records[start - 1 : start - 1 + size]
+        if not page and repeat_last:
+            page = records[-size:]
+        return [Record(id) for id in page]
+    return fetch
+
+
+def fetched_ids(fetch, page_size = 10, start = 1):
+    fetcher = PartitionFetcher(fetch, [Partition(1, 100, 'q')], lambda: page_size,
+                               start)
+    try:
+        return [record.id for (_, page) in fetcher.pages() if page for record in page]
+    finally:
+        fetcher.stop()
+
+
+def test_all_records_of_partition():
+    assert fetched_ids(server(list(range(25)))) == list(range(25))
+
+
+def test_server_capping_page_size():
+    assert fetched_ids(server(list(range(25)), cap = 4)) == list(range(25))
+
+
+def test_pages_smaller_than_requested():
+    # As when pages come from a cache filled with a smaller page size.
+    sizes = iter([10, 3, 10, 10, 10, 10, 10])
+    fetch = server(list(range(25)))
+    assert fetched_ids(lambda q, start, size: fetch(q, start, next(sizes))) \
+        == list(range(25))
+
+
+def test_repeated_last_page_ends_partition():
+    assert fetched_ids(server(list(range(25)), repeat_last = True)) == list(range(25))
+
+
+def test_start_skips_records():
+    assert fetched_ids(server(list(range(25))), start = 8) == list(range(7, 25))
+
+
+def test_partitioned_covers_all_ids():
+    partitions = partitioned('https://example.org/search?p=x', 25, 10)
+    assert [(p.low, p.high) for p in partitions] == [(16, 25), (6, 15), (1, 5)]
@@ -0,0 +1,111 @@
+# =============================================================================
+# @file    test_redirects.py
+# @brief   Tests for learning and predicting redirections
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import json
+
+import pytest
+from   urlup import UrlData
+
+from turf.redirects import RedirectLearner, _split
+from turf.status import CONNECT_TIMEOUT
+
+
+OLD = 'http://old.example.com/doi/'
+NEW = 'https://new.example.org/article/'
+
+
+def moved(id, new = NEW, suffix = '', status = 301):
+    return UrlData(OLD + id, new + id + suffix, status, None)
+
+
+def learner(observed = 3, **kwargs):
+    learner = RedirectLearner(min_support = 3, sample_interval = 100, **kwargs)
+    for n in range(observed):
+        learner.observe(moved('10.1000/{}'.format(100 + n)))
+    return learner
+
+
+@pytest.mark.parametrize('original, final, expected', [
+    (OLD + '10.1000/123', NEW + '10.1000/123',
+     ('old.example.com', 'http://old.example.com/doi', 'https://new.example.org/article', '')),
+    (OLD + 'abc123', NEW + 'abc123?via=old',
+     ('old.example.com', 'http://old.example.com/doi', 'https://new.example.org/article',
+      '?via=old')),
+    ('http://OLD.example.com/x/item42', 'https://new.example.org/item42',
+     ('old.example.com', 'http://OLD.example.com/x', 'https://new.example.org', '')),
+    (OLD + 'abc123', NEW + 'xyz789', None),
+    ('http://old.example.com/a', 'https://new.example.org/a', None),
+    ('/relative/path/123', 'https://new.example.org/path/123', None),
+    ('http://[bad-link/x', 'https://new.example.org/x', None),
+])
+def test_split(original, final, expected):
+    assert _split(original, final) == expected
+
+
+def test_rule_used_once_supported():
+    assert learner(observed = 2).predicted(OLD + '10.1000/999') is None
+    rules = learner(observed = 3)
+    prediction = rules.predicted(OLD + '10.1000/999')
+    assert prediction == UrlData(OLD + '10.1000/999', NEW + '10.1000/999', 301, None)
+    assert rules.predictions == 1
+
+
+def test_rule_not_used_for_other_prefixes():
+    rules = learner()
+    assert rules.predicted('http://old.example.com/books/10.1000/999') is None
+    assert rules.predicted('http://other.example.com/doi/10.1000/999') is None
+
+
+def test_some_urls_sampled():
+    rules = RedirectLearner(min_support = 3, sample_interval = 4)
+    for n in range(3):
+        rules.observe(moved('10.1000/{}'.format(n)))
+    predictions = [rules.predicted(OLD + '10.1000/9{}'.format(n)) for n in range(8)]
+    assert [p is None for p in predictions] == [False, False, False, True] * 2
+
+
+def test_rule_dropped_after_contradiction():
+    rules = learner()
+    assert rules.predicted(OLD + '10.1000/999') is not None
+    # A URL checked anyway went somewhere else.
+    rules.observe(moved('10.1000/998', new = 'https://elsewhere.example.net/'))
+    assert rules.verifications == 1
+    assert rules.predicted(OLD + '10.1000/999') is None
+    assert [rule['failed'] for rule in rules.rules()] == [True]
+
+
+def test_rule_dropped_after_error():
+    rules = learner()
+    rules.observe(UrlData(OLD + '10.1000/998', None, None, CONNECT_TIMEOUT))
+    assert rules.predicted(OLD + '10.1000/999') is None
+
+
+def test_conflicting_rules_not_used():
+    rules = learner()
+    for n in range(3):
+        rules.observe(moved('10.1000/{}'.format(200 + n), suffix = '?v=2'))
+    assert rules.predicted(OLD + '10.1000/999') is None
+
+
+def test_unredirected_and_failed_results_not_learned():
+    rules = RedirectLearner(min_support = 1)
+    rules.observe(UrlData(OLD + 'a123', OLD + 'a123', 200, None))
+    rules.observe(UrlData(OLD + 'b123', None, None, CONNECT_TIMEOUT))
+    rules.observe(None)
+    assert rules.rules() == []
+    assert rules.predicted(OLD + 'c123') is None
+
+
+def test_save(tmp_path):
+    file = str(tmp_path / 'rules.json')
+    learner().save(file)
+    with open(file) as f:
+        saved = json.load(f)
+    assert saved == [{'prefix': 'http://old.example.com/doi',
+                      'new_prefix': 'https://new.example.org/article', 'suffix': '',
+                      'status': 301, 'support': 3, 'predictions': 0, 'failed': False}]
@@ -0,0 +1,86 @@
+# =============================================================================
+# @file    test_rewrites.py
+# @brief   Tests for rewriting final URLs that hide the real destination
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import json
+
+import pytest
+from   urlup import UrlData
+
+from turf.rewrites import RewriteRules, RULES_FILE
+
+
+MAINTENANCE = ('https://ebookcentral.proquest.com/auth/lib/caltech-ebooks/'
+               'maintenance.action?returnURL=')
+
+
+def result(final):
+    return UrlData('http://original.example.org/item', final, 302, None)
+
+
+def rules_in(tmp_path, content):
+    file = str(tmp_path / 'rules.json')
+    with open(file, 'w') as f:
+        f.write(content if isinstance(content, str) else json.dumps(content))
+    return file
+
+
+def test_shipped_rules():
+    rules = RewriteRules.load()
+    with open(RULES_FILE) as f:
+        assert len(rules.hits()) == len(json.load(f))
+    rewritten = rules.rewritten(result(
+        MAINTENANCE + 'https://ebookcentral.proquest.com/lib/caltech-ebooks/detail.action'
+        '?docID=123&amp;query=x'))
+    assert rewritten.final == ('https://ebookcentral.proquest.com/lib/caltech-ebooks/'
+                               'detail.action?docID=123&query=x')
+    assert rewritten.original == 'http://original.example.org/item'
+    assert rules.rewrites == 1
+
+
+@pytest.mark.parametrize('content', [
+    'not json',
+    {'pattern': 'x'},
+    [{'name': 'no pattern'}],
+    [{'pattern': '(unclosed'}],
+    [{'pattern': 'a(b)', 'group': 2}],
+    [{'pattern': 'a(b)', 'group': '1'}],
+    [{'pattern': 'a(b)', 'decode': 'base64'}],
+    ['a(b)'],
+])
+def test_bad_rules_rejected(tmp_path, content):
+    with pytest.raises(ValueError):
+        RewriteRules.load(rules_in(tmp_path, content))
+
+
+def test_rules_for_host_and_subdomains():
+    rules = RewriteRules([{'host': 'example.com', 'pattern': r'https?://[^?]*\?to=(.*)'}])
+    for final in ['https://example.com/go?to=X', 'https://www.Example.com/go?to=X']:
+        assert rules.rewritten(result(final)).final == 'X'
+    for final in ['https://example.org/go?to=X', 'https://notexample.com/go?to=X']:
+        assert rules.rewritten(result(final)).final == final
+    assert rules.recognized('https://a.b.example.com/go?to=X')
+    assert not rules.recognized('https://example.org/go?to=X')
+
+
+def test_first_matching_rule_used():
+    rules = RewriteRules([
+        {'name': 'any', 'host': '*', 'pattern': r'.*\?next=(.*)'},
+        {'name': 'host', 'host': 'example.com', 'pattern': r'.*\?(next)=.*'},
+        {'name': 'url', 'host': 'example.com', 'pattern': r'.*\?to=(.*)', 'decode': 'url'},
+    ])
+    assert rules.rewritten(result('https://example.com/?next=A')).final == 'A'
+    assert rules.rewritten(result('https://example.org/?next=B')).final == 'B'
+    assert rules.rewritten(result('https://example.com/?to=C%2FD')).final == 'C/D'
+    assert rules.hits() == [('any', 2), ('host', 0), ('url', 1)]
+
+
+def test_results_without_match_unchanged():
+    rules = RewriteRules([{'pattern': r'.*\?to=(.*)'}])
+    for data in [result(None), result('https://example.com/plain'), result('http://[bad/x')]:
+        assert rules.rewritten(data) is data
+    assert rules.rewrites == 0
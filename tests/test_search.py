@@ -0,0 +1,67 @@
+# =============================================================================
+# @file    test_search.py
+# @brief   Tests for the handling of failures when searching TIND
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+from os import path
+
+import turf.turf
+from turf.checkpoint import Checkpoint
+from turf.data_types import ProxyInfo, UIsettings, FetchSettings
+from turf.turf import entries_from_search, entries_from_file
+
+
+def failing(*args, **kwargs):
+    raise RuntimeError('no response')
+
+
+def search_results(tmp_path, fetchsettings):
+    checkpoint = Checkpoint(str(tmp_path / 'out.csv.checkpoint'), 'query')
+    results = list(entries_from_search('https://example.org/search?p=x', None, 1,
+                                       ProxyInfo(), UIsettings(), fetchsettings,
+                                       checkpoint))
+    return (results, checkpoint)
+
+
+def test_failed_slim_check_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(turf.turf, '_same_results', failing)
+    (results, checkpoint) = search_results(tmp_path, FetchSettings(slim = True))
+    assert results == [None]
+    assert path.exists(checkpoint.file)
+
+
+def test_failed_highest_recid_is_reported(tmp_path, monkeypatch):
+    monkeypatch.setattr(turf.turf, '_highest_recid', failing)
+    (results, checkpoint) = search_results(tmp_path, FetchSettings(partition_size = 100,
+                                                                   retries = 0))
+    assert results == [None]
+    assert path.exists(checkpoint.file)
+
+
+def test_summaries_after_empty_page(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(turf.turf, '_fetched_page', lambda *args, **kwargs: None)
+    results = list(entries_from_search('https://example.org/search?p=x', None, 1,
+                                       ProxyInfo(), UIsettings(quiet = False)))
+    assert results == [None]
+    output = capsys.readouterr().out
+    assert 'Processed 0 entries' in output
+    assert 'Timed no URL checks' in output
+    assert 'Dereferenced 0 distinct URLs' in output
+
+
+def test_summaries_in_file_mode(tmp_path, capsys):
+    file = str(tmp_path / 'records.xml')
+    with open(file, 'w') as f:
+        f.write('<collection xmlns="http://www.loc.gov/MARC21/slim">'
+                + ''.join('<record><controlfield tag="001">{}</controlfield></record>'
+                          .format(id) for id in range(1, 6))
+                + '</collection>')
+    results = list(entries_from_file(file, None, 1, ProxyInfo(), UIsettings(quiet = False)))
+    assert [data.id for data in results] == ['1', '2', '3', '4', '5']
+    output = capsys.readouterr().out
+    assert 'Processed 5 entries' in output
+    assert 'Timed no URL checks' in output
+    assert 'Dereferenced 0 distinct URLs' in output
@@ -0,0 +1,94 @@
+# =============================================================================
+# @file    test_session.py
+# @brief   Tests for the shared proxy login session
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+import pytest
+import requests
+
+import turf.session
+from turf.data_types import ProxyInfo
+from turf.session import ProxySession
+from turf.status import PROXY_LOGIN_FAILURE
+
+
+PROXY = 'https://proxy.example.edu'
+
+URL = PROXY + '/login?url=https://journal.example.org/article/1'
+
+
+class FakeResponse():
+    def __init__(self, url, status_code = 200, cookies = {'ezproxy': 'abc'}):
+        self.url = url
+        self.status_code = status_code
+        self.cookies = cookies
+
+    def close(self):
+        pass
+
+
+class FakeProxy():
+    '''Stands in for requests.Session.post; 'outcomes' lists what the login
+    attempts give in turn: an exception to raise, or a response.'''
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.attempts = 0
+
+    def __call__(self, url, **kwargs):
+        self.attempts += 1
+        outcome = self.outcomes.pop(0) if len(self.outcomes) > 1 else self.outcomes[0]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+
+@pytest.fixture
+def session(monkeypatch):
+    monkeypatch.setattr(turf.session, 'sleep', lambda seconds: None)
+    session = ProxySession(ProxyInfo('user', 'password', use_keyring = False))
+    monkeypatch.setattr(session._session, 'get', lambda url, **kwargs:
+                        FakeResponse('https://journal.example.org/article/1'))
+    yield session
+    session.close()
+
+
+def failure():
+    return requests.exceptions.ConnectionError('connection reset')
+
+
+def test_login_retried_after_network_error(session, monkeypatch):
+    proxy = FakeProxy([failure(), FakeResponse(PROXY + '/menu', 302)])
+    monkeypatch.setattr(session._session, 'post', proxy)
+    result = session.checked_url(URL)
+    assert result.error is None
+    assert result.final == 'https://journal.example.org/article/1'
+    assert proxy.attempts == 2
+    assert session.logins == 1
+
+
+def test_login_tried_again_after_cooldown(session, monkeypatch):
+    proxy = FakeProxy([failure()])
+    monkeypatch.setattr(session._session, 'post', proxy)
+    assert session.checked_url(URL).error == PROXY_LOGIN_FAILURE
+    attempts = proxy.attempts
+    # Until the cooldown is over, proxied URLs fail without a login attempt.
+    assert session.checked_url(URL).error == PROXY_LOGIN_FAILURE
+    assert proxy.attempts == attempts
+    # After that, logging in is tried again and the network is back.
+    proxy.outcomes = [FakeResponse(PROXY + '/menu', 302)]
+    monkeypatch.setattr(turf.session, 'time',
+                        lambda: session._retry_time + 1)
+    assert session.checked_url(URL).error is None
+    assert session.logins == 1
+
+
+def test_rejected_login_not_tried_again(session, monkeypatch):
+    proxy = FakeProxy([FakeResponse(PROXY + '/login', 200, cookies = {})])
+    monkeypatch.setattr(session._session, 'post', proxy)
+    assert session.checked_url(URL).error == PROXY_LOGIN_FAILURE
+    assert session.checked_url(URL).error == PROXY_LOGIN_FAILURE
+    assert proxy.attempts == 1
@@ -0,0 +1,135 @@
+# =============================================================================
+# @file    test_timing.py
+# @brief   Tests for URL check deadlines and their effect on shared state
+# @author  Michael Hucka <mhucka@caltech.edu>
+# @license Please see the file named LICENSE in the project directory
+# @website https://github.com/caltechlibrary/turf
+# =============================================================================
+
+from   threading import Lock, Thread
+from   time import sleep, time
+
+import pytest
+from   urlup import UrlData
+
+from turf.breaker import CircuitBreaker
+from turf.dedup import UrlDeduplicator
+from turf.errors import RecordDeadline
+from turf.hosts import HostScheduler
+from turf.redirects import RedirectLearner
+from turf.status import DEADLINE_EXCEEDED
+from turf.timing import CheckTimer
+from turf.turf import _urlup_data, canonical_url
+
+
+class FakeEngine():
+    '''Stands in for an AsyncUrlEngine, taking 'delays[url]' seconds per URL.'''
+
+    def __init__(self, delays = {}):
+        self.delays = delays
+        self.calls = []
+        self.active = 0
+        self.most_active = 0
+        self._lock = Lock()
+
+    def checked_url_from_thread(self, url):
+        with self._lock:
+            self.calls.append(url)
+            self.active += 1
+            self.most_active = max(self.most_active, self.active)
+        try:
+            sleep(self.delays.get(url, 0))
+            return UrlData(url, url + '/final', 200, None)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+
+def checked(urls, timer, engine, hosts = None, breaker = None, dedup = None,
+            record_began = None):
+    return _urlup_data(urls, None, hosts or HostScheduler(), breaker or CircuitBreaker(),
+                       dedup or UrlDeduplicator(canonical_url), RedirectLearner(),
+                       False, timer, None, engine, record_began)
+
+
+def test_url_deadline_gives_error_result():
+    timer = CheckTimer(url_deadline = 0.1)
+    engine = FakeEngine({'http://a.test/slow': 1})
+    (result,) = checked(['http://a.test/slow'], timer, engine)
+    assert result.error == DEADLINE_EXCEEDED
+    assert timer.misses == 1
+
+
+def test_record_deadline_raises():
+    timer = CheckTimer(record_deadline = 1)
+    with pytest.raises(RecordDeadline):
+        timer.timed('http://a.test/x', lambda url: None, time() - 5)
+
+
+def test_release_waits_for_abandoned_check():
+    released = []
+    timer = CheckTimer(url_deadline = 0.05)
+    def slow(url):
+        sleep(0.3)
+        return UrlData(url, url, 200, None)
+    result = timer.timed('http://a.test/x', slow, time(), lambda: released.append(time()))
+    assert result.error == DEADLINE_EXCEEDED
+    assert not released
+    sleep(0.5)
+    assert len(released) == 1
+
+
+def test_record_deadline_is_not_shared_with_other_records():
+    timer = CheckTimer(record_deadline = 1)
+    engine = FakeEngine()
+    dedup = UrlDeduplicator(canonical_url)
+    url = 'http://a.test/item'
+    # A record whose time has already run out: the URL is never requested.
+    (late,) = checked([url], timer, engine, dedup = dedup, record_began = time() - 5)
+    assert late.error == DEADLINE_EXCEEDED
+    assert engine.calls == []
+    # Another record citing the same URL still gets it checked.
+    (fresh,) = checked([url], timer, engine, dedup = dedup)
+    assert fresh.error is None and fresh.final == url + '/final'
+    assert engine.calls == [url]
+
+
+def test_record_deadline_does_not_trip_breaker():
+    timer = CheckTimer(record_deadline = 1)
+    engine = FakeEngine()
+    breaker = CircuitBreaker(failure_limit = 2)
+    dedup = UrlDeduplicator(canonical_url)
+    for i in range(10):
+        checked(['http://a.test/{}'.format(i)], timer, engine, breaker = breaker,
+                dedup = dedup, record_began = time() - 5)
+    (result,) = checked(['http://a.test/ok'], timer, engine, breaker = breaker,
+                        dedup = dedup)
+    assert result.error is None
+    assert breaker.skipped == 0
+
+
+def test_url_deadline_counts_against_host():
+    timer = CheckTimer(url_deadline = 0.05)
+    engine = FakeEngine({'http://a.test/{}'.format(i): 0.3 for i in range(3)})
+    breaker = CircuitBreaker(failure_limit = 3)
+    checked(['http://a.test/{}'.format(i) for i in range(3)], timer, engine,
+            breaker = breaker)
+    (result,) = checked(['http://a.test/more'], timer, engine, breaker = breaker)
+    assert breaker.skipped == 1
+
+
+def test_host_slot_held_until_abandoned_check_ends():
+    timer = CheckTimer(url_deadline = 0.05)
+    engine = FakeEngine({'http://a.test/{}'.format(i): 0.3 for i in range(4)})
+    hosts = HostScheduler(host_limit = 1)
+    breaker = CircuitBreaker(failure_limit = 100)
+    threads = [Thread(target = checked, args = (['http://a.test/{}'.format(i)], timer,
+                                                engine, hosts, breaker))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    sleep(0.4)
+    assert len(engine.calls) == 4
+    assert engine.most_active == 1
@@ -15,7 +15,8 @@ a search query on the command line; in that case, the string should be a
 complete search URL as would be typed into a web browser address bar (or more
 practically, copied from the browser address bar after performing some
 exploratory searches in https://caltech.tind.io.  Finally, as another
-alternative, it can read MARC XML input from a file when given the -f option.
+alternative, it can read MARC XML or binary MARC input from a file when given
+the -f option.
 
 Turf is a command-line application.  On Linux and macOS systems, the
 installation _should_ place a new program on your shell's search path, so
@@ -48,7 +49,7 @@ from .__version__ import __author__, __email__
 from .__version__ import __license__, __copyright__
 
 # Main modules.
-from .turf import entries_from_search, entries_from_file
+from .turf import entries_from_search, entries_from_file, file_format
 
 # Supporting modules.
 from .messages import msg, color
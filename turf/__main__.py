@@ -15,8 +15,8 @@ a search query on the command line; in that case, the string should be a
 complete search URL as would be typed into a web browser address bar (or more
 practically, copied from the browser address bar after performing some
 exploratory searches in https://caltech.tind.io.  Finally, as another
-alternative, it can read MARC XML input from a file when given the -f option
-(/f on Windows).
+alternative, it can read MARC XML or binary MARC input from a file when given
+the -f option (/f on Windows).
 
 Authors
 -------
@@ -42,10 +42,12 @@ except:
     pass
 
 import turf
-from turf import entries_from_file, entries_from_search
+from turf import entries_from_file, entries_from_search, file_format
 from turf.messages import msg, color
 from turf.writers import write_results
-from turf.data_types import ProxyInfo, UIsettings
+from turf.data_types import ProxyInfo, UIsettings, FetchSettings, CheckSettings
+from turf.checkpoint import Checkpoint, checkpoint_file
+from turf.rewrites import RewriteRules
 
 
 # Global constants.
@@ -60,23 +62,50 @@ _DEFAULT_SEARCH = 'https://caltech.tind.io/search?ln=en&p=856%3A%25&f=&sf=&so=d'
 
 @plac.annotations(
     all        = ('write all entries, not only those with URLs',        'flag',   'a'),
+    budget     = ('retry failed requests up to B times (default: 50)',  'option', 'b'),
+    cache      = ('reuse pages fetched less than H hours ago',          'option', 'c'),
+    depth      = ('fetch up to D pages of results ahead (default: 2)',  'option', 'd'),
+    engine     = ('check URLs using "threads" or "async" (default: threads)', 'option', 'e'),
     unchanged  = ("write entries with URLs even if they're unchanged",  'flag',   'n'),
     file       = ('read MARC from file F instead of searching tind.io', 'option', 'f'),
+    keep_urls  = ('reuse results of URLs checked in recent runs',       'flag',   'k'),
+    slim       = ('fetch only MARC fields 001 and 856 from tind.io',    'flag',   'l'),
+    pages      = ('vary page size within range G (default: 10-200)',   'option', 'g'),
+    head_first = ('check URLs using HEAD requests where possible',     'flag',   'H'),
+    processes  = ('parse file F using J processes (default: 1)',        'option', 'j'),
+    rewrites   = ('rewrite final URLs using the rules in file I',       'option', 'i'),
+    hedge      = ('make a second request for URLs slow to respond',     'flag',   'A'),
+    record_deadline = ("give up on a record's URLs after Q seconds",   'option', 'D'),
+    predict    = ('predict redirections using rules learned as we go', 'flag',   'm'),
     output     = ('write results to the file R',                        'option', 'o'),
+    host_limit = ('check at most L URLs per host at a time (default: 4)', 'option', 'L'),
     pswd       = ('proxy user password',                                'option', 'p'),
+    partitions = ('fetch ranges of P record ids separately',            'option', 'P'),
     quiet      = ('do not print messages while working',                'flag',   'q'),
+    resume     = ('resume an interrupted search where it stopped',      'flag',   'r'),
+    refresh    = ('ignore cached pages and URL results',                'flag',   'F'),
     start_at   = ("start with Nth record (default: start at 1)",        'option', 's'),
     total      = ('stop after processing M records (default: all)',     'option', 't'),
+    url_deadline = ('give up on a URL after T seconds',                 'option', 'T'),
     user       = ('proxy user name',                                    'option', 'u'),
     no_color   = ('do not color-code terminal output',                  'flag',   'C'),
     reset      = ('reset proxy user name and password'   ,              'flag',   'R'),
+    keep_session = ('keep the proxy login session for later runs',     'flag',   'S'),
     version    = ('print version info and exit',                        'flag',   'V'),
+    wait       = ('vary delay between pages within range Y seconds',   'option', 'y'),
+    workers    = ('check URLs of W records at a time (default: 4)',     'option', 'w'),
     no_keyring = ('do not use a keyring',                               'flag',   'X'),
+    rules      = ('write redirection rules learned to the file Z',     'option', 'z'),
     search     = 'complete search URL (default: none)',
 )
 
 def main(file = 'F', output = 'R', all = False, unchanged = False,
-         start_at = 'N', total = 'M', user  =  'U', pswd  =  'P',
+         start_at = 'N', total = 'M', depth = 'D', pages = 'G', wait = 'Y',
+         cache = 'H', user  =  'U', pswd  =  'P', refresh = False, resume = False,
+         partitions = 'P', budget = 'B', workers = 'W', engine = 'E', slim = False,
+         host_limit = 'L', keep_urls = False, head_first = False, predict = False,
+         rules = 'Z', keep_session = False, url_deadline = 'T',
+         record_deadline = 'Q', hedge = False, rewrites = 'I', processes = 'J',
          quiet = False, no_color = False, no_keyring = False, reset = False,
          version = False, *search):
     '''Look for caltech.tind.io records containing URLs and return updated URLs.
@@ -87,7 +116,13 @@ on the command line, the string should be a complete search URL as would be
 typed into a web browser address bar (or more practically, copied from the
 browser address bar after performing some exploratory searches in
 caltech.tind.io).  If given a file using the -f option (/f on Windows), the
-file should contain MARC XML content.
+file should contain MARC XML content (with a name ending in .xml) or binary
+MARC records in ISO 2709 format (with a name ending in .mrc or .marc).  The
+file may be compressed using gzip or xz, in which case its name should have
+.gz or .xz added at the end, as in "records.mrc.gz".  Reading a large file
+can take a while by itself; the -j option (/j on Windows) makes Turf divide
+an uncompressed file into parts and read them in that many processes at the
+same time.  The records are still processed in the order of the file.
 
 It is best to quote the search string, using double quotes on Windows and
 single quotes on Linux/Unix, to avoid terminal shells interpreting special
@@ -107,7 +142,117 @@ If given the -t option (/t on Windows), it will only fetch and process a
 total of that many results instead of all results.  If given the -s (/s on
 Windows) option, it will start at that entry instead of starting at number 1;
 this is useful if searches are being done in batches or a previous search is
-interrupted and you don't want to restart from 1.
+interrupted and you don't want to restart from 1.  Better still, when doing a
+search, Turf regularly saves its progress in a checkpoint file (named after
+the output file, with ".checkpoint" appended).  If a search is interrupted,
+running the same command again with the -r option (/r on Windows) added will
+resume where it stopped, and the output file will contain the results from
+before the interruption as well as the new ones.
+
+While the records in one page of search results are being processed, the next
+pages are fetched from caltech.tind.io in the background.  The -d option (/d
+on Windows) sets how many pages may be fetched ahead in this way.  The number
+of records requested per page, and the pause between requests, are adjusted
+automatically depending on how quickly and reliably the server responds.  The
+-g option (/g on Windows) sets the range of page sizes to use, as in "50-200",
+and the -y option (/y on Windows) sets the range of pauses in seconds, as in
+"0.5-5".  Giving the same value for both ends of a range turns off the
+adjustment.  The settings finally arrived at are reported at the end.
+
+If fetching a page of results fails in a way that may be temporary (for
+example, a network timeout, an incomplete response, or an HTTP 5xx or 429
+code from the server), Turf waits a while and tries again, waiting longer
+after each failure.  The -b option (/b on Windows) sets the total number of
+such retries allowed over the whole run; once it is used up, a failure stops
+the run as before.  The number of retries made, and their causes, are
+reported at the end.
+
+If given the -c option (/c on Windows), pages of search results are saved in
+a cache on disk, and a later search for the same thing will reuse pages that
+are less than the given number of hours old instead of fetching them again
+from caltech.tind.io.  This is useful when re-running the same search with
+different output options.  Adding the -F option (/F on Windows) forces all
+pages to be fetched again (and the cache updated with the new copies).
+
+Similarly, if given the -k option (/k on Windows), the results of checking
+each URL are kept on disk, and later runs reuse them instead of checking the
+URLs again, as long as they are fresh enough.  Results for URLs that worked
+are reused for 30 days, results for URLs that produced an HTTP error (such as
+404) for 3 days, and other errors (such as timeouts) for 6 hours.  Adding the
+-F option checks all URLs again.
+
+Turf only needs the record identifier (MARC field 001) and the URLs (MARC
+field 856) of each record.  If given the -l option (/l on Windows), it will
+ask caltech.tind.io for only those fields, which makes each page of results
+much smaller.  Before doing so, it compares the first page of results
+obtained this way against the same page of complete records, and if they
+differ, it falls back to fetching complete records.
+
+Paging through a large number of search results forces caltech.tind.io to
+skip over ever more records to reach each new page.  If given the -P option
+(/P on Windows), Turf instead divides the search into ranges of that many
+record identifiers (e.g., 1-5000, 5001-10000, and so on), pages through each
+range from its beginning, and fetches several ranges at the same time.  The
+results are still processed in the usual order.
+
+Dereferencing URLs is slow, because it often involves following a chain of
+redirections across several servers.  Turf therefore works on the URLs of
+several records at the same time, while still reporting and writing the
+results in the original order of the records.  The -w option (/w on Windows)
+sets the number of records worked on at the same time.  By default, Turf
+uses Urlup in a pool of threads for this purpose.  The option "-e async"
+(/e async on Windows) makes it use its own code based on Python's asyncio
+instead, which can check many more URLs at the same time with less memory;
+in that case, the default for -w is 200 records.
+
+Either way, Turf takes care not to overload any one host: at most 4 URLs on
+the same host are checked at the same time (this can be changed using the -L
+option, or /L on Windows).  A few hosts that many of the URLs in the catalog
+point to, such as EBSCOhost and ProQuest, are given tighter limits on the
+number and rate of requests, because they are known to block clients that
+make too many requests.  If several URLs on the same host fail in a row
+because the host does not respond, Turf stops trying that host for a while,
+and reports the error "Host is unavailable" for its URLs in the meantime.
+
+Urlup checks a URL by downloading the whole page (or file) it leads to,
+which wastes time and bandwidth when all that matters is where it leads.
+The -H option (/H on Windows) makes Turf use HEAD requests instead, which
+only return the status and headers, falling back to requests for only the
+first byte of the content on hosts that reject HEAD requests.  This uses
+Turf's own code, as with -e async, for URLs that don't go through a proxy.
+
+When a vendor moves its content, whole families of URLs are redirected the
+same way, such as from an old host name to a new one with the rest of the
+URL unchanged.  Turf learns such rules from the URLs it dereferences.  With
+the -m option (/m on Windows), once a rule is backed by 5 URLs, Turf uses it
+to predict where other URLs in the same family lead instead of dereferencing
+them, except for 1 in 10, which are still dereferenced to make sure the rule
+holds (it is dropped if not).  The -z option (/z on Windows) writes the rules
+learned to a file in JSON format, so that they can be reviewed.
+
+A few slow servers can hold up a whole run.  The -T option (/T on Windows)
+sets the most time, in seconds, that checking one URL may take, including
+connecting, following redirections and reading the responses, and the -D
+option (/D on Windows) sets the most time that checking all the URLs of one
+record may take.  URLs that take longer are reported with the error "Took too
+long to resolve".  With the -A option (/A on Windows), if a URL takes longer
+than 95% of the URLs checked on the same host, Turf makes a second request
+for it and uses whichever answer comes first.  How long URL checks took
+(the median, 95th and 99th percentiles, and maximum) is reported at the end.
+
+Some final URLs are pages that hide the real destination in the URL itself,
+such as a vendor's maintenance page that includes the address of the item in
+a query parameter.  Turf rewrites such URLs to the real destination, using a
+set of rules that come with Turf.  The -i option (/i on Windows) makes it use
+the rules in the given file instead; the file must be in the same JSON format
+as the file "rewrite-rules.json" in Turf's "data" directory.  The number of
+URLs rewritten is reported at the end.
+
+Many records in the catalog cite the same URLs.  Turf dereferences each
+distinct URL only once per run and reuses the result for every record that
+cites it.  URLs that differ only in ways that cannot change where they lead
+(such as the case of the host name, HTML character entities, or needless
+percent-encoding) count as the same URL for this purpose.
 
 If given an output file using the -o option (/o on Windows), the results will
 be written to that file.  The format of the file will be deduced from the file
@@ -130,9 +275,15 @@ insecure on multiuser computer systems.
 To reset the user name and password (e.g., if a mistake was made the last time
 and the wrong credentials were stored in the keyring/keychain system), add the
 -R (or /R on Windows) command-line argument to a command.  The next time
-Urlup needs to use a proxy login, it will query for the user name and password
+Turf needs to use a proxy login, it will query for the user name and password
 again even if an entry already exists in the keyring or keychain.
 
+Turf logs in to the proxy only once per run, and uses the same proxy session
+for all URLs that go through the proxy; if the session expires during a run,
+Turf logs in again.  With the -S option (/S on Windows), the session is saved
+on disk at the end of a run, and used again by the next run for as long as
+the proxy accepts it.
+
 This program will print information to the terminal as it processes URLs,
 unless the option -q (or /q on Windows) is given to make it more quiet.
 '''
@@ -149,10 +300,38 @@ unless the option -q (or /q on Windows) is given to make it more quiet.
         file = None
     if output == 'R':
         output = None
+    if rules == 'Z':
+        rules = None
+    if url_deadline == 'T':
+        url_deadline = None
+    if record_deadline == 'Q':
+        record_deadline = None
+    if rewrites == 'I':
+        rewrites = None
+    if processes == 'J':
+        processes = 1
     if start_at and start_at == 'N':
         start_at = 1
     if total and total == 'M':
         total = None
+    if depth == 'D':
+        depth = 2
+    if pages == 'G':
+        pages = '10-200'
+    if wait == 'Y':
+        wait = '0.1-10'
+    if cache == 'H':
+        cache = None
+    if partitions == 'P':
+        partitions = None
+    if budget == 'B':
+        budget = 50
+    if engine == 'E':
+        engine = 'threads'
+    if host_limit == 'L':
+        host_limit = 4
+    if workers == 'W':
+        workers = 4 if engine == 'threads' else 200
     if user == 'U':
         user = None
     if pswd == 'P':
@@ -165,15 +344,31 @@ unless the option -q (or /q on Windows) is given to make it more quiet.
     if file and search:
         raise SystemExit(color('Cannot use a file and search string simultaneously',
                                'error', colorize))
-    if file and not file.endswith('.xml'):
-        raise SystemExit(color('"{}" does not appear to be an XML file'
-                               .format(file), 'error', colorize))
+    if file and resume:
+        raise SystemExit(color('Cannot resume reading a file', 'error', colorize))
+    if file and not file_format(file)[0]:
+        raise SystemExit(color('"{}" does not appear to be a MARC XML (.xml) or '
+                               'binary MARC (.mrc) file'.format(file), 'error', colorize))
     if search:
         if any(item.startswith(('-', '/')) for item in search):
             raise SystemExit(color('Command not recognized: {}'.format(search),
                                    'error', colorize))
         else:
             search = search[0]  # Compensate for how plac provides arg value.
+    checkpoint = None
+    if resume:
+        checkpoint = Checkpoint.load(checkpoint_file(search or _DEFAULT_SEARCH, output))
+        if not checkpoint:
+            raise SystemExit(color('Found no saved progress to resume from',
+                                   'error', colorize))
+        if search and search != checkpoint.query:
+            raise SystemExit(color('The saved progress is for a different search',
+                                   'error', colorize))
+        search = checkpoint.query
+        start_at = checkpoint.offset
+        total = (checkpoint.stop - start_at) if checkpoint.stop else None
+        if not quiet:
+            msg('Resuming search at record {}'.format(start_at), 'info', colorize)
     if not search:
         search = _DEFAULT_SEARCH
         msg('No search term provided -- will use default:', 'info', colorize)
@@ -199,6 +394,66 @@ unless the option -q (or /q on Windows) is given to make it more quiet.
             msg('"{}" has no name extension; defaulting to xlsx'.format(output),
                 'warn', colorize)
     start_at = int(start_at)
+    depth = int(depth)
+    if depth < 1:
+        raise SystemExit(color('The prefetch depth must be at least 1',
+                               'error', colorize))
+    page_sizes = bounds(pages, int)
+    if not page_sizes or page_sizes[0] < 1:
+        raise SystemExit(color('Cannot understand page size range "{}"'
+                               .format(pages), 'error', colorize))
+    delays = bounds(wait, float)
+    if not delays or delays[0] < 0:
+        raise SystemExit(color('Cannot understand delay range "{}"'
+                               .format(wait), 'error', colorize))
+    if cache:
+        cache = float(cache) * 60 * 60
+    if refresh and cache is None and not keep_urls:
+        raise SystemExit(color('Option -F only makes sense with -c or -k',
+                               'error', colorize))
+    if engine not in ['threads', 'async']:
+        raise SystemExit(color('Unrecognized URL checking engine "{}"'.format(engine),
+                               'error', colorize))
+    workers = int(workers)
+    if workers < 1:
+        raise SystemExit(color('The number of workers must be at least 1',
+                               'error', colorize))
+    host_limit = int(host_limit)
+    if host_limit < 1:
+        raise SystemExit(color('The per-host limit must be at least 1',
+                               'error', colorize))
+    if url_deadline:
+        url_deadline = float(url_deadline)
+        if url_deadline <= 0:
+            raise SystemExit(color('The URL deadline must be more than 0 seconds',
+                                   'error', colorize))
+    if record_deadline:
+        record_deadline = float(record_deadline)
+        if record_deadline <= 0:
+            raise SystemExit(color('The record deadline must be more than 0 seconds',
+                                   'error', colorize))
+    processes = int(processes)
+    if processes < 1:
+        raise SystemExit(color('The number of processes must be at least 1',
+                               'error', colorize))
+    if processes > 1 and not file:
+        raise SystemExit(color('Option -j only makes sense with -f', 'error', colorize))
+    if rewrites:
+        if not path.exists(rewrites):
+            raise SystemExit(color('Cannot find file "{}"'.format(rewrites),
+                                   'error', colorize))
+        try:
+            RewriteRules.load(rewrites)
+        except ValueError as err:
+            raise SystemExit(color(str(err), 'error', colorize))
+    budget = int(budget)
+    if budget < 0:
+        raise SystemExit(color('The retry budget cannot be negative', 'error', colorize))
+    if partitions:
+        partitions = int(partitions)
+        if partitions < 1:
+            raise SystemExit(color('The partition size must be at least 1',
+                                   'error', colorize))
 
     # General sanity checks.
     if not network_available():
@@ -206,7 +461,21 @@ unless the option -q (or /q on Windows) is given to make it more quiet.
 
     # Let's do this thing.
     uisettings = UIsettings(colorize = colorize, quiet = quiet)
-    proxyinfo = ProxyInfo(user, pswd, use_keyring, reset)
+    proxyinfo = ProxyInfo(user, pswd, use_keyring, reset, keep_session)
+    fetchsettings = FetchSettings(prefetch = depth, page_sizes = page_sizes,
+                                  delays = delays, cache_ttl = cache,
+                                  refresh = refresh, slim = slim,
+                                  partition_size = partitions, retries = budget)
+    checksettings = CheckSettings(workers = workers, engine = engine,
+                                  host_limit = host_limit, url_cache = keep_urls,
+                                  refresh = refresh, head_first = head_first,
+                                  predict = predict, rules_file = rules,
+                                  url_deadline = url_deadline,
+                                  record_deadline = record_deadline, hedge = hedge,
+                                  rewrite_file = rewrites)
+    if not file and not checkpoint:
+        checkpoint = Checkpoint(checkpoint_file(search, output), search, start_at,
+                                (start_at + total) if total else None)
     results = []
     try:
         if file:
@@ -219,17 +488,20 @@ unless the option -q (or /q on Windows) is given to make it more quiet.
                 raise SystemExit(color('Cannot find file "{}"'.format(file),
                                        'error', colorize))
             if not quiet:
-                msg('Reading MARC XML from {}'.format(input), 'info', colorize)
-            results = entries_from_file(input, total, start_at, proxyinfo, uisettings)
+                msg('Reading MARC records from {}'.format(input), 'info', colorize)
+            results = entries_from_file(input, total, start_at, proxyinfo, uisettings,
+                                        checksettings, processes)
         else:
-            results = entries_from_search(search, total, start_at, proxyinfo, uisettings)
+            results = entries_from_search(search, total, start_at, proxyinfo,
+                                          uisettings, fetchsettings, checkpoint,
+                                          checksettings)
     except Exception as e:
         msg('Exception encountered: {}'.format(e), 'error', colorize)
     finally:
         if not results:
             msg('No results returned.', 'warn', colorize)
         elif output:
-            write_results(output, results, unchanged, all)
+            write_results(output, results, unchanged, all, checkpoint)
         else:
             print_results(results)
         if not quiet:
@@ -260,6 +532,18 @@ def print_results(results):
         pass
 
 
+def bounds(text, kind):
+    '''Parse a range of the form "low-high" (or a single value) and return a
+    tuple of (low, high) converted using 'kind', or None if it can't.'''
+    try:
+        (low, _, high) = text.partition('-')
+        low = kind(low)
+        high = kind(high) if high else low
+        return (low, high) if low <= high else None
+    except ValueError:
+        return None
+
+
 def network_available():
     '''Return True if it appears we have a network connection, False if not'''
     try:
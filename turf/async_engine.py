@@ -0,0 +1,429 @@
+'''
+async_engine.py: checking URLs with asyncio in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import asyncio
+import os
+import socket
+import ssl
+import sys
+from   threading import Thread
+from   time import time
+from   urllib.parse import urlsplit, urljoin, quote
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+from urlup.urlup import normalized_url
+
+import turf
+from turf.checker import UrlChecker
+from turf.status import url_data, MALFORMED_URL, CONNECT_TIMEOUT, UNKNOWN_HOST
+from turf.status import UNKNOWN_PROTOCOL, BAD_PORT, UNRESOLVABLE_URL
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('async_engine: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_DEFAULT_CONCURRENCY = 200
+'''Default number of records whose URLs are checked at the same time.'''
+
+_NETWORK_TIMEOUT = 15
+'''How long to wait on a network connection attempt or a response.'''
+
+_MAX_REDIRECTS = 30
+'''Most redirections we follow from one URL (the same limit as Requests).'''
+
+_MAX_ATTEMPTS = 3
+'''Number of times we try a URL if something unexpected goes wrong.'''
+
+_RETRY_DELAY = 2
+'''Seconds to wait before trying a URL again.  It doubles after each try.'''
+
+_MAX_HEADER_LINES = 200
+'''Upper limit on the number of header lines we accept in a response.'''
+
+_SAFE_CHARACTERS = "/%:@!$&'()*+,;=-._~?"
+'''Characters left alone when quoting the path of a URL for a request.'''
+
+_HEAD_UNSUPPORTED = [405, 501]
+'''Status codes with which a server says it doesn't do HEAD requests.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class AsyncUrlEngine():
+    '''Follow the redirections of URLs using asyncio, without threads.
+
+    An event loop is run in a background thread; use checked_url() from
+    coroutines running in that loop, and submit() to run coroutines in it
+    from other threads.  Only the status line and headers of each response
+    are read, and the connection is closed right after, so a check in
+    progress uses very little memory and thousands can be in flight at once.
+    The results are UrlData named tuples like those produced by Urlup.  The
+    'headers' are sent with every request, and the 'cookies' (a dict) to
+    every host.  Cookies set by servers along a chain of redirections are
+    only sent to the hosts they were set for.
+
+    If 'head_first' is True, HEAD requests are used where possible, so that
+    servers don't even start sending the content.  If a server fails a HEAD
+    request, the same URL is tried with a GET asking for only the first byte
+    of the content, and if that works, GET is used for that host from then
+    on.  Once HEAD has worked on a host, it is trusted there, except for
+    status codes that mean the server doesn't do HEAD requests at all.
+    '''
+
+    def __init__(self, headers = {}, cookies = {}, timeout = _NETWORK_TIMEOUT,
+                 head_first = False):
+        self.headers = headers
+        self.cookies = cookies
+        self.timeout = timeout
+        self.head_first = head_first
+        self.requests = 0
+        self.head_requests = 0
+        self.loop = asyncio.new_event_loop()
+        self._ssl = ssl.create_default_context()
+        self._thread = None
+        # Method known to work on each host (keyed by host and port).
+        self._methods = {}
+
+
+    def start(self):
+        '''Start running the event loop in a background thread.'''
+        if self._thread is None:
+            self._thread = Thread(target = self.loop.run_forever, daemon = True)
+            self._thread.start()
+
+
+    def stop(self):
+        '''Stop the event loop, abandoning any checks in progress.'''
+        if self._thread is not None:
+            self.submit(self._cancel_all()).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self._thread.join()
+            self._thread = None
+            self.loop.close()
+
+
+    def submit(self, coroutine):
+        '''Schedule 'coroutine' in the event loop and return a
+        concurrent.futures.Future object for its result.'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+
+    def checked_url_from_thread(self, url):
+        '''Like checked_url(), but for use from threads other than the one
+        running the event loop.  Waits for the result and returns it.'''
+        return self.submit(self.checked_url(url)).result()
+
+
+    def summary(self):
+        '''Return a short text summary of the requests made.'''
+        text = 'Made {} requests to check URLs'.format(self.requests)
+        if self.head_first:
+            get_hosts = sum(1 for method in self._methods.values() if method == 'GET')
+            text += ' ({} with HEAD); {} of {} host{} needed GET'.format(
+                self.head_requests, get_hosts, len(self._methods),
+                '' if len(self._methods) == 1 else 's')
+        return text
+
+
+    async def checked_url(self, url):
+        '''Return a UrlData named tuple for 'url'.'''
+        url = url.strip()
+        failures = 0
+        delay = _RETRY_DELAY
+        while True:
+            try:
+                return await self._analysis(url)
+            except Exception as err:
+                failures += 1
+                if __debug__: log('{}: {}', url, err)
+                if failures >= _MAX_ATTEMPTS:
+                    return UrlData(url, None, None, UNRESOLVABLE_URL)
+                await asyncio.sleep(delay)
+                delay *= 2
+
+
+    async def _cancel_all(self):
+        tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions = True)
+
+
+    async def _analysis(self, url):
+        # Use the same test as Urlup for what is a well-formed URL.
+        try:
+            current = normalized_url(url)
+        except ValueError:
+            current = None
+        if not current:
+            return UrlData(url, None, None, MALFORMED_URL)
+        first_code = None
+        # Cookies set along the way, in dicts keyed by domain (see _kept()).
+        jar = {}
+        for _ in range(_MAX_REDIRECTS + 1):
+            try:
+                parts = urlsplit(current)
+            except ValueError:
+                return UrlData(url, None, None, MALFORMED_URL)
+            if parts.scheme not in ['http', 'https']:
+                return UrlData(url, None, None, UNKNOWN_PROTOCOL)
+            if not parts.hostname:
+                return UrlData(url, None, None, MALFORMED_URL)
+            try:
+                port = parts.port
+            except ValueError:
+                return UrlData(url, None, None, BAD_PORT)
+            host = parts.hostname.lower()
+            cookies = dict(self.cookies)
+            cookies.update(_cookies_for(jar, host))
+            try:
+                (code, headers) = await self._step(parts, port, cookies)
+            except socket.gaierror:
+                return UrlData(url, None, None, UNKNOWN_HOST)
+            except asyncio.TimeoutError:
+                if first_code is None:
+                    return UrlData(url, None, None, CONNECT_TIMEOUT)
+                raise
+            if code == 202 and first_code is None:
+                # Code 202 = Accepted, "received but not yet acted upon."
+                # Like Urlup, pause, try again, but report the first code.
+                await asyncio.sleep(1)
+                result = await self._analysis(url)
+                return UrlData(url, result.final, code, None)
+            if first_code is None:
+                first_code = code
+            for value in headers.get('set-cookie', []):
+                _kept(jar, host, value)
+            location = headers.get('location')
+            if code in [301, 302, 303, 307, 308] and location:
+                current = urljoin(current, location[-1].strip())
+                continue
+            return url_data(url, current, first_code)
+        if __debug__: log('too many redirections for {}', url)
+        return UrlData(url, None, None, UNRESOLVABLE_URL)
+
+
+    async def _step(self, parts, port, cookies):
+        # Returns the status code and headers for one URL in a chain of
+        # redirections, using HEAD if we can.
+        if not self.head_first:
+            return await self._response(parts, port, cookies)
+        host = (parts.hostname.lower(), port)
+        method = self._methods.get(host)
+        if method != 'GET':
+            (code, headers) = await self._response(parts, port, cookies, 'HEAD')
+            if code < 400:
+                self._methods[host] = 'HEAD'
+                return (code, headers)
+            if method == 'HEAD' and code not in _HEAD_UNSUPPORTED:
+                return (code, headers)
+            if __debug__: log('HEAD got {} from {}; trying GET', code, parts.hostname)
+        (code, headers) = await self._response(parts, port, cookies, 'GET', True)
+        if code < 400 and method is None:
+            self._methods[host] = 'GET'
+        return (code, headers)
+
+
+    async def _response(self, parts, port, cookies, method = 'GET', ranged = False):
+        # Returns the status code and a dict of lists of header values,
+        # keyed by lower-case header names.  If 'ranged' is True, only the
+        # first byte of the content is requested; a server that can't do
+        # that for this URL is asked again without the range.
+        https = (parts.scheme == 'https')
+        host = parts.hostname.encode('idna').decode('ascii')
+        port = port or (443 if https else 80)
+        (reader, writer) = await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl = self._ssl if https else None),
+            self.timeout)
+        try:
+            path = quote(parts.path or '/', safe = _SAFE_CHARACTERS)
+            if parts.query:
+                path += '?' + quote(parts.query, safe = _SAFE_CHARACTERS)
+            lines = ['{} {} HTTP/1.1'.format(method, path),
+                     'Host: {}'.format(host if parts.port is None
+                                       else '{}:{}'.format(host, parts.port)),
+                     'Accept: */*',
+                     'Connection: close']
+            if ranged:
+                lines.append('Range: bytes=0-0')
+            lines += ['{}: {}'.format(name, value) for (name, value) in self.headers.items()]
+            if cookies:
+                lines.append('Cookie: ' + '; '.join('{}={}'.format(name, value)
+                                                    for (name, value) in cookies.items()))
+            writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+            self.requests += 1
+            if method == 'HEAD':
+                self.head_requests += 1
+            (code, headers) = await asyncio.wait_for(self._status_and_headers(reader),
+                                                     self.timeout)
+        finally:
+            writer.close()
+        if ranged and code == 416:
+            return await self._response(parts, port, cookies, method)
+        if ranged and code == 206:
+            # Partial content is what we asked for; the URL works.
+            code = 200
+        return (code, headers)
+
+
+    async def _status_and_headers(self, reader):
+        status_line = (await reader.readline()).decode('latin-1')
+        (version, code, *_) = status_line.split(None, 2) + ['']
+        if not version.startswith('HTTP/'):
+            raise ValueError('bad status line: {!r}'.format(status_line))
+        headers = {}
+        for _ in range(_MAX_HEADER_LINES):
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            (name, _, value) = line.partition(':')
+            headers.setdefault(name.strip().lower(), []).append(value.strip())
+        return (int(code), headers)
+
+
+class AsyncUrlChecker(UrlChecker):
+    '''UrlChecker that runs coroutine functions in an AsyncUrlEngine's event
+    loop instead of running functions in threads.  'workers' is the number
+    of items whose coroutines may be in progress at the same time.  The
+    engine is stopped when map() finishes.'''
+
+    def __init__(self, engine, workers = _DEFAULT_CONCURRENCY):
+        super().__init__(workers)
+        # Coroutines waiting on the network cost next to nothing, so there's
+        # no need to take up more items than can be worked on at once.
+        self.window = self.workers
+        self.engine = engine
+
+
+    def summary(self):
+        '''Return a short text summary of the work done.'''
+        text = 'Checked URLs of {} records, up to {} at a time, with asyncio'.format(
+            self.count, self.workers)
+        if self.elapsed_time > 0:
+            text += ' ({:.1f}s of work done in {:.1f}s)'.format(
+                self.work_time, self.elapsed_time)
+        return text
+
+
+    def _start(self):
+        self.engine.start()
+
+
+    def _submit(self, function, item):
+        return self.engine.submit(self._timed(function, item))
+
+
+    def _finish(self):
+        self.engine.stop()
+
+
+    async def _timed(self, function, item):
+        began = time()
+        cancelled = False
+        try:
+            return await function(item)
+        except asyncio.CancelledError:
+            # Abandoned because the caller stopped early; doesn't count.
+            cancelled = True
+            raise
+        finally:
+            # Only the event loop thread gets here, so no lock is needed.
+            if not cancelled:
+                self.count += 1
+                self.work_time += time() - began
+
+
+class ThreadedEngineChecker(UrlChecker):
+    '''UrlChecker whose threads hand some of their URLs to an AsyncUrlEngine
+    using checked_url_from_thread().  The engine is started and stopped
+    along with the pool of threads.'''
+
+    def __init__(self, engine, workers = 4):
+        super().__init__(workers)
+        self.engine = engine
+
+
+    def _start(self):
+        super()._start()
+        self.engine.start()
+
+
+    def _finish(self):
+        super()._finish()
+        self.engine.stop()
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _kept(jar, host, header):
+    # Stores the cookie from the Set-Cookie header value 'header', sent by
+    # 'host', in 'jar'.  The keys of 'jar' are host names for cookies to be
+    # sent only to that host, and domain names starting with '.' for cookies
+    # given a Domain attribute, which are also sent to its subdomains.  Like
+    # browsers, we ignore cookies for domains that 'host' is not part of.
+    (pair, *attributes) = header.split(';')
+    (name, _, value) = pair.partition('=')
+    domain = host
+    for attribute in attributes:
+        (key, _, setting) = attribute.partition('=')
+        setting = setting.strip().lstrip('.').lower()
+        if key.strip().lower() == 'domain' and setting:
+            domain = '.' + setting
+    if not _matches(host, domain):
+        if __debug__: log('ignoring cookie for {} from {}', domain, host)
+        return
+    jar.setdefault(domain, {})[name.strip()] = value.strip()
+
+
+def _cookies_for(jar, host):
+    # Returns a dict of the cookies in 'jar' (see _kept()) to send to 'host'.
+    cookies = {}
+    for (domain, values) in jar.items():
+        if _matches(host, domain):
+            cookies.update(values)
+    return cookies
+
+
+def _matches(host, domain):
+    if domain.startswith('.'):
+        return host == domain[1:] or host.endswith(domain)
+    return host == domain
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,183 @@
+'''
+breaker.py: not waiting on hosts that are down when checking URLs in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import os
+import sys
+from   threading import Lock
+from   time import time
+from   urllib.parse import urlsplit
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+from turf.errors import HostUnavailable
+from turf.status import CONNECT_TIMEOUT, UNKNOWN_HOST, UNRESOLVABLE_URL
+from turf.status import DEADLINE_EXCEEDED
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('breaker: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_FAILURE_LIMIT = 5
+'''Number of failures in a row after which a host is considered down.'''
+
+_COOLDOWN = 300
+'''Seconds to wait before trying a host again after it is considered down.
+The wait doubles each time the host is tried and still fails.'''
+
+_MAX_COOLDOWN = 3600
+'''Upper limit on the time to wait before trying a host again.'''
+
+_HOST_FAILURES = [CONNECT_TIMEOUT, UNKNOWN_HOST, UNRESOLVABLE_URL, DEADLINE_EXCEEDED,
+                  None]
+'''Errors (in results without an HTTP status code) that say nothing about a
+URL in particular, and thus count against its host.  None is what Urlup
+reports when it gives up after its own retries.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class CircuitBreaker():
+    '''Keep track of hosts that fail to respond, to avoid waiting on them.
+
+    Before a URL is dereferenced, call check() on it; it raises
+    HostUnavailable if the URL's host has failed 'failure_limit' times in a
+    row, until 'cooldown' seconds have passed.  After that, one URL is let
+    through to probe the host while the others still get HostUnavailable;
+    if the probe fails, the host is skipped for twice as long as before (up
+    to 'max_cooldown' seconds), and if it works, the host is used normally
+    again.  The outcome of each URL let through must be given to record(),
+    together with the value check() returned for it, which identifies the
+    probe.  While a host is skipped, only the probe's outcome counts; checks
+    that were already under way when the host went down are ignored.
+    '''
+
+    def __init__(self, failure_limit = _FAILURE_LIMIT, cooldown = _COOLDOWN,
+                 max_cooldown = _MAX_COOLDOWN):
+        self.failure_limit = failure_limit
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.skipped = 0
+        self._hosts = {}
+        self._down = set()
+        self._lock = Lock()
+
+
+    def check(self, url):
+        '''Raise HostUnavailable if the host of 'url' should not be tried.
+        Otherwise, return a value to give to record() with the result: a
+        token if this check is the probe of a skipped host, or else None.'''
+        state = self._state(url)
+        if state is None:
+            return None
+        with self._lock:
+            if state.reopen_time is None:
+                return None
+            if time() >= state.reopen_time and state.probe is None:
+                if __debug__: log('probing {}', state.host)
+                state.probe = object()
+                return state.probe
+            self.skipped += 1
+        raise HostUnavailable(state.host)
+
+
+    def record(self, url, data, probe = None):
+        '''Record the UrlData result 'data' obtained for 'url', where 'probe'
+        is the value check() returned for it.  If 'data' is None, the attempt
+        is taken to have been abandoned.'''
+        state = self._state(url)
+        if state is None:
+            return
+        with self._lock:
+            was_probe = probe is not None and probe is state.probe
+            if was_probe:
+                state.probe = None
+            elif state.reopen_time is not None:
+                # Under way before the host went down; the probe decides.
+                return
+            if data is None:
+                return
+            if data and (data.status is not None or data.error not in _HOST_FAILURES):
+                if state.reopen_time is not None:
+                    if __debug__: log('{} is back', state.host)
+                state.failures = 0
+                state.reopen_time = None
+                state.wait = self.cooldown
+                return
+            state.failures += 1
+            if was_probe or (state.reopen_time is None
+                             and state.failures >= self.failure_limit):
+                if was_probe:
+                    state.wait = min(state.wait * 2, self.max_cooldown)
+                if __debug__: log('{} failed {} times; skipping it for {}s',
+                                  state.host, state.failures, state.wait)
+                state.reopen_time = time() + state.wait
+                self._down.add(state.host)
+
+
+    def summary(self):
+        '''Return a short text summary of the hosts skipped.'''
+        return 'Skipped {} URL checks on {} unavailable host{}'.format(
+            self.skipped, len(self._down), '' if len(self._down) == 1 else 's')
+
+
+    def _state(self, url):
+        # Returns the _HostState for the host of 'url', or None if it has
+        # no usable host name.
+        try:
+            host = (urlsplit(url.strip()).hostname or '').lower()
+        except ValueError:
+            return None
+        if not host:
+            return None
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = _HostState(host, self.cooldown)
+            return self._hosts[host]
+
+
+class _HostState():
+    def __init__(self, host, wait):
+        self.host = host
+        self.wait = wait
+        self.failures = 0
+        # Time after which the host may be probed, or None if it's usable.
+        self.reopen_time = None
+        # Token identifying the check probing the host, if there is one.
+        self.probe = None
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,144 @@
+'''
+checker.py: checking the URLs of many records at the same time in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   collections import deque
+from   concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+from   threading import Lock
+from   time import time
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('checker: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_DEFAULT_WORKERS = 4
+'''Default number of records whose URLs are checked at the same time.'''
+
+_LOOKAHEAD = 4
+'''Number of records taken up per worker thread ahead of the one whose
+results are due next.  A slow record thus doesn't leave the other threads
+idle, while the number of results waiting to be used stays bounded.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class UrlChecker():
+    '''Apply a slow function, such as one that dereferences the URLs of a
+    record, to a series of items using a pool of 'workers' threads.
+
+    The items are taken from the iterable given to map() a few at a time, as
+    threads become free, so the iterable can be a generator that itself waits
+    on the network.  The results come out in the same order as the items,
+    regardless of which ones finish first.  Subclasses can do the work in
+    some other way by overriding _start(), _submit() and _finish().
+    '''
+
+    def __init__(self, workers = _DEFAULT_WORKERS):
+        self.workers = max(1, workers)
+        self.window = self.workers * _LOOKAHEAD
+        self.count = 0
+        self.work_time = 0
+        self.elapsed_time = 0
+        self._lock = Lock()
+
+
+    def map(self, function, items):
+        '''Yield tuples of (item, result) for each of 'items', in order,
+        where 'result' is the result of calling 'function' on 'item'.  An
+        exception raised by 'function' is reraised here when the result it
+        failed to produce would have been yielded.'''
+        began = time()
+        pending = deque()
+        items = iter(items)
+        self._start()
+        try:
+            for item in items:
+                pending.append((item, self._submit(function, item)))
+                if len(pending) >= self.window:
+                    (item, future) = pending.popleft()
+                    yield (item, future.result())
+            while pending:
+                (item, future) = pending.popleft()
+                yield (item, future.result())
+        finally:
+            # If the caller stopped early, don't start on the rest.  Threads
+            # already running are left to finish in the background.
+            for (_, future) in pending:
+                future.cancel()
+            self._finish()
+            self.elapsed_time += time() - began
+            if __debug__: log(self.summary())
+
+
+    def summary(self):
+        '''Return a short text summary of the work done.'''
+        text = 'Checked URLs of {} records using {} thread{}'.format(
+            self.count, self.workers, '' if self.workers == 1 else 's')
+        if self.elapsed_time > 0:
+            text += ' ({:.1f}s of work done in {:.1f}s)'.format(
+                self.work_time, self.elapsed_time)
+        return text
+
+
+    def _start(self):
+        self._executor = ThreadPoolExecutor(max_workers = self.workers)
+
+
+    def _submit(self, function, item):
+        # Must return a concurrent.futures.Future object.
+        return self._executor.submit(self._timed, function, item)
+
+
+    def _finish(self):
+        self._executor.shutdown(wait = False)
+
+
+    def _timed(self, function, item):
+        began = time()
+        try:
+            return function(item)
+        finally:
+            with self._lock:
+                self.count += 1
+                self.work_time += time() - began
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,187 @@
+'''
+checkpoint.py: saving and restoring the progress of a search in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   hashlib import sha1
+import json
+import os
+from   os import path
+import sys
+from   time import time
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+
+import turf
+from turf.data_types import TindData
+from turf.page_cache import cache_dir
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('checkpoint: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_SAVE_INTERVAL = 30
+'''Minimum number of seconds between successive saves of a checkpoint.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class Checkpoint():
+    '''Record of the progress of a search, saved to a file now and then so
+    that an interrupted run can be resumed where it left off.
+
+    The record holds the search query, the number of the next record to be
+    processed ('offset'), the number of the record to stop at ('stop', or None
+    for no limit), the ids of the records seen so far, and the results that
+    have already been written to the output file, if any.  The latter are
+    needed because XLSX files are only written out at the end of a run, so
+    a resumed run writes the output file again from the start.  Only the
+    rows loaded from the file are kept in memory ('rows'); rows written
+    during a run are held only until they have been saved.
+
+    The file holds one JSON object per line.  The first gives the query and
+    the stopping point; each of the others gives the offset at the time it
+    was saved and the ids and rows added since the line before it.  Saving
+    thus only appends what is new, however long the run has been going.
+    '''
+
+    def __init__(self, file, query, offset = 1, stop = None):
+        self.file = file
+        self.query = query
+        self.offset = offset
+        self.stop = stop
+        self.seen = set()
+        self.rows = []
+        self._new_ids = []
+        self._new_rows = []
+        self._saved_row_ids = set()
+        self._started = False
+        self._last_saved = time()
+
+
+    @classmethod
+    def load(cls, file):
+        '''Read the checkpoint saved in 'file' and return a new Checkpoint
+        object, or None if the file does not exist.'''
+        if not path.exists(file):
+            return None
+        if __debug__: log('reading {}', file)
+        with open(file, 'r') as f:
+            header = json.loads(f.readline())
+            checkpoint = cls(file, header['query'], stop = header['stop'])
+            for line in f:
+                try:
+                    content = json.loads(line)
+                except ValueError:
+                    # The run was stopped while this line was being written.
+                    if __debug__: log('ignoring incomplete last line')
+                    break
+                checkpoint.offset = content['offset']
+                checkpoint.seen.update(content['seen'])
+                checkpoint.rows += [TindData(row['id'], [UrlData(*u) for u in row['url_data']])
+                                    for row in content['rows']]
+        checkpoint._saved_row_ids = set(row.id for row in checkpoint.rows)
+        checkpoint._started = True
+        return checkpoint
+
+
+    def update(self, offset, id):
+        '''Note that the record with the given 'id' has been processed and
+        its results written out, and that 'offset' is the number of the next
+        record.  Save the checkpoint if it hasn't been saved in a while.'''
+        self.offset = offset
+        if id not in self.seen:
+            self.seen.add(id)
+            self._new_ids.append(id)
+        if time() - self._last_saved > _SAVE_INTERVAL:
+            self.save()
+
+
+    def add_row(self, data):
+        '''Note that the TindData object 'data' has been written out.'''
+        if data.id not in self._saved_row_ids:
+            self._new_rows.append(data)
+
+
+    def take_rows(self):
+        '''Return the rows loaded from the checkpoint file, and forget them.
+        A writer resuming an output file must write these out again first.'''
+        (rows, self.rows) = (self.rows, [])
+        return rows
+
+
+    def save(self):
+        '''Add what is new since the last save to the checkpoint file.'''
+        if __debug__: log('saving checkpoint at offset {}', self.offset)
+        # A row is only saved once update() has been called for its record.
+        # Until then, the record will be processed again if the run is resumed.
+        rows = [row for row in self._new_rows if row.id in self.seen]
+        content = {'offset' : self.offset,
+                   'seen'   : self._new_ids,
+                   'rows'   : [{'id': row.id, 'url_data': [list(u) for u in row.url_data]}
+                               for row in rows]}
+        with open(self.file, 'a' if self._started else 'w') as f:
+            if not self._started:
+                f.write(json.dumps({'query': self.query, 'stop': self.stop}) + '\n')
+            f.write(json.dumps(content) + '\n')
+        self._started = True
+        self._saved_row_ids.update(row.id for row in rows)
+        self._new_ids = []
+        self._new_rows = [row for row in self._new_rows if row.id not in self.seen]
+        self._last_saved = time()
+
+
+    def remove(self):
+        '''Delete the checkpoint file, if there is one.'''
+        if path.exists(self.file):
+            if __debug__: log('removing {}', self.file)
+            os.remove(self.file)
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def checkpoint_file(query, output = None):
+    '''Return the path of the checkpoint file for a run that searches for
+    'query' and writes its results to the file 'output'.'''
+    if output:
+        return output + '.checkpoint'
+    dir = path.join(cache_dir(), 'checkpoints')
+    os.makedirs(dir, exist_ok = True)
+    return path.join(dir, sha1(query.encode()).hexdigest() + '.json')
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
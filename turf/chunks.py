@@ -0,0 +1,190 @@
+'''
+chunks.py: parsing large MARC files in several processes at once.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   collections import deque
+from   concurrent.futures import ProcessPoolExecutor
+import io
+import mmap
+import os
+import re
+import sys
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('chunks: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_CHUNK_SIZE = 16 * 1024 * 1024
+'''Approximate number of bytes of input parsed by a process at a time.'''
+
+_CHUNKS_AHEAD = 2
+'''Number of chunks per process that may be parsed ahead of the one whose
+results are being used, which bounds the memory used for results.'''
+
+_RECORD_END_TAG = re.compile(rb'</(?:[\w.-]+:)?record\s*>')
+'''End tag of a record element in MARC XML, with or without a prefix.'''
+
+_MARC21_RECORD_END = b'\x1d'
+'''Byte that ends each record in binary MARC.'''
+
+
+# Main functions.
+# .............................................................................
+
+def parsed_in_parallel(file, kind, parse, processes, chunk_size = _CHUNK_SIZE):
+    '''Generator producing the items that the function 'parse' produces for
+    each part of the uncompressed file 'file', in the order of the file.
+    The file contains MARC records in the format 'kind' ("xml" or "marc21",
+    as returned by turf.file_format()), and is divided at record boundaries
+    into parts of about 'chunk_size' bytes, which are given to 'parse' in
+    'processes' separate processes.  'parse' is called with a binary
+    file-like object containing a complete document (for MARC XML, the
+    records are wrapped in the same root element as in the file), and must
+    return an iterable of picklable items.  If the file cannot be divided,
+    'parse' is called on the whole file in this process.'''
+    ranges = _chunk_ranges(file, kind, chunk_size)
+    if ranges is None or len(ranges) < 2 or processes < 2:
+        if __debug__: log('parsing {} in one process', file)
+        with open(file, 'rb') as f:
+            yield from parse(f)
+        return
+    if __debug__: log('parsing {} in {} chunks using {} processes', file,
+                      len(ranges), processes)
+    executor = ProcessPoolExecutor(max_workers = processes)
+    pending = deque()
+    try:
+        for (start, end, header, footer) in ranges:
+            pending.append(executor.submit(_parsed, parse, file, start, end,
+                                           header, footer))
+            if len(pending) > processes * _CHUNKS_AHEAD:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+    finally:
+        # If the caller stopped early, don't parse the rest.
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _parsed(parse, file, start, end, header, footer):
+    # Runs in a separate process.  Returns a list of the items produced by
+    # 'parse' for the bytes from 'start' to 'end' in 'file'.
+    with open(file, 'rb') as f:
+        f.seek(start)
+        content = f.read(end - start)
+    return list(parse(io.BytesIO(header + content + footer)))
+
+
+def _chunk_ranges(file, kind, chunk_size):
+    # Returns a list of tuples of (start, end, header, footer) for the parts
+    # of 'file', where 'header' and 'footer' are what must be added to the
+    # bytes from 'start' to 'end' to make a complete document.  Returns None
+    # if the file can't be divided.
+    with open(file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return None
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            if kind == 'marc21':
+                (header, start, end, footer) = (b'', 0, len(data), b'')
+                next_boundary = lambda position: _marc21_boundary(data, position, end)
+            else:
+                layout = _xml_layout(data)
+                if not layout:
+                    return None
+                (header, start, end, footer) = layout
+                next_boundary = lambda position: _xml_boundary(data, position, end)
+            ranges = []
+            while start < end:
+                boundary = next_boundary(start + chunk_size)
+                ranges.append((start, boundary, header, footer))
+                start = boundary
+            return ranges
+
+
+def _marc21_boundary(data, position, end):
+    # Returns the position just after the first record end at or after
+    # 'position', or 'end' if there is none.
+    if position >= end:
+        return end
+    found = data.find(_MARC21_RECORD_END, position, end)
+    return end if found < 0 else found + 1
+
+
+def _xml_boundary(data, position, end):
+    # Like _marc21_boundary(), for the end tags of records in MARC XML.
+    if position >= end:
+        return end
+    found = _RECORD_END_TAG.search(data, position, end)
+    return end if found is None else found.end()
+
+
+def _xml_layout(data):
+    # Returns a tuple of (header, start, end, footer), where 'header' is
+    # everything up to the end of the start tag of the root element, 'start'
+    # and 'end' are the positions where the content of the root element
+    # starts and ends, and 'footer' is the root element's end tag.  Returns
+    # None if the root element is a single record, or isn't found.
+    position = 0
+    while True:
+        position = data.find(b'<', position)
+        if position < 0:
+            return None
+        if data[position:position + 4] == b'<!--':
+            position = data.find(b'-->', position)
+        elif data[position:position + 2] in [b'<?', b'<!']:
+            position = data.find(b'>', position)
+        else:
+            break
+        if position < 0:
+            return None
+    start = data.find(b'>', position) + 1
+    name = re.match(rb'<([^\s/>]+)', data[position:start])
+    if not start or not name or name.group(1).split(b':')[-1] == b'record':
+        return None
+    footer = b'</' + name.group(1) + b'>'
+    end = data.rfind(footer)
+    if end < start:
+        return None
+    return (bytes(data[:start]), start, end, footer)
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
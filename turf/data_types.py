@@ -27,19 +27,34 @@ class TindData():
         self.url_data = url_data
 
 
+class TindRecord():
+    '''Class object to store the id and original URLs found in an entry.'''
+
+    id = None
+    urls = None
+
+    def __init__(self, id = None, urls = None):
+        self.id = id
+        self.urls = urls
+
+
 class ProxyInfo():
-    '''Class object to store data for proxy logins.'''
+    '''Class object to store data for proxy logins.  If keep_session is True,
+    the proxy login session is kept on disk for use in later runs.'''
 
     user = None
     password = None
     use_keyring = True
     reset = False
+    keep_session = False
 
-    def __init__(self, user = None, pswd = None, use_keyring = True, reset = False):
+    def __init__(self, user = None, pswd = None, use_keyring = True, reset = False,
+                 keep_session = False):
         self.user = user
         self.password = pswd
         self.use_keyring = use_keyring
         self.reset = reset
+        self.keep_session = keep_session
 
 
 class UIsettings():
@@ -51,3 +66,85 @@ class UIsettings():
     def __init__(self, colorize = False, quiet = True):
         self.colorize = colorize
         self.quiet = quiet
+
+
+class CheckSettings():
+    '''Class object to store settings for checking the URLs of records.
+    The URLs of up to 'workers' records are checked at the same time.  The
+    'engine' is either 'threads' (to use Urlup in a pool of threads) or
+    'async' (to use Turf's own asyncio-based code).  At most 'host_limit'
+    URLs on the same host are checked at the same time, except on hosts
+    with limits of their own (see hosts.py).  If url_cache is True, results
+    are kept on disk and reused while they're fresh, unless refresh is True.
+    If head_first is True, URLs are checked using HEAD requests where the
+    servers allow it (see async_engine.py).  If predict is True, URLs are
+    not dereferenced if rules learned from other URLs say where they lead
+    (see redirects.py).  If rules_file is given, the rules are written to
+    it in JSON format.  A URL check is given up on after url_deadline
+    seconds, and checks for a record that go past record_deadline seconds
+    from the start of the record are too; either can be None for no limit.
+    If hedge is True, a second request is made for URLs that are slow to
+    answer compared to others on the same host (see timing.py).  The final
+    URLs are rewritten using the rules in rewrite_file, or if it is None,
+    the rules shipped with Turf (see rewrites.py).'''
+
+    workers = 4
+    engine = 'threads'
+    host_limit = 4
+    url_cache = False
+    refresh = False
+    head_first = False
+    predict = False
+    rules_file = None
+    url_deadline = None
+    record_deadline = None
+    hedge = False
+    rewrite_file = None
+
+    def __init__(self, workers = 4, engine = 'threads', host_limit = 4,
+                 url_cache = False, refresh = False, head_first = False,
+                 predict = False, rules_file = None, url_deadline = None,
+                 record_deadline = None, hedge = False, rewrite_file = None):
+        self.workers = workers
+        self.engine = engine
+        self.host_limit = host_limit
+        self.url_cache = url_cache
+        self.refresh = refresh
+        self.head_first = head_first
+        self.predict = predict
+        self.rules_file = rules_file
+        self.url_deadline = url_deadline
+        self.record_deadline = record_deadline
+        self.hedge = hedge
+        self.rewrite_file = rewrite_file
+
+
+class FetchSettings():
+    '''Class object to store settings for fetching records from TIND.
+    The page sizes and delays are (minimum, maximum) tuples.  Pages are
+    cached on disk only if cache_ttl (in seconds) is not None.  If slim is
+    True, only the MARC fields that Turf uses are requested from TIND.  If
+    partition_size is not None, the search is split into ranges of that many
+    record ids, which are fetched separately.  Up to 'retries' failed
+    requests are retried over the course of a run.'''
+
+    prefetch = 2
+    page_sizes = (10, 200)
+    delays = (0.1, 10)
+    cache_ttl = None
+    refresh = False
+    slim = False
+    partition_size = None
+    retries = 50
+
+    def __init__(self, prefetch = 2, page_sizes = (10, 200), delays = (0.1, 10),
+                 cache_ttl = None, refresh = False, slim = False,
+                 partition_size = None, retries = 50):
+        self.prefetch = prefetch
+        self.page_sizes = page_sizes
+        self.delays = delays
+        self.cache_ttl = cache_ttl
+        self.refresh = refresh
+        self.slim = slim
+        self.partition_size = partition_size
+        self.retries = retries
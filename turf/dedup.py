@@ -0,0 +1,133 @@
+'''
+dedup.py: dereferencing each distinct URL only once per run of Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import asyncio
+from   concurrent.futures import Future
+import os
+import sys
+from   threading import Lock
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+
+import turf
+
+
+# Class definitions.
+# .............................................................................
+
+class UrlDeduplicator():
+    '''Share the results of dereferencing URLs among all the records that
+    cite the same URL.
+
+    URLs are considered the same if the function 'key' returns the same
+    value for them.  The first request for a URL does the work; requests for
+    the same URL made while that is still in progress wait for it, and later
+    ones get the result right away.  Either way, the UrlData returned refers
+    to the URL asked about.  Results are kept for the life of the object.
+    '''
+
+    def __init__(self, key = lambda url: url):
+        self._key = key
+        self._results = {}
+        self._lock = Lock()
+        self.requests = 0
+
+
+    def result(self, url, check):
+        '''Return the UrlData result for 'url', calling the function 'check'
+        on 'url' to get it if no request for the same URL has been made.'''
+        (future, owner) = self._future(url)
+        if owner:
+            self._settle(future, url, check)
+        return _fanned_out(future.result(), url)
+
+
+    async def async_result(self, url, check):
+        '''Like result(), but for use in coroutines; 'check' must be a
+        coroutine function.'''
+        (future, owner) = self._future(url)
+        if owner:
+            try:
+                future.set_result(await check(url))
+            except BaseException as err:
+                self._forget(url, future, err)
+                raise
+        return _fanned_out(await asyncio.wrap_future(future), url)
+
+
+    def summary(self):
+        '''Return a short text summary of the deduplication done.'''
+        distinct = len(self._results)
+        ratio = self.requests / distinct if distinct else 1
+        return 'Dereferenced {} distinct URLs for {} URLs in records ({:.2f} uses each)'.format(
+            distinct, self.requests, ratio)
+
+
+    def _future(self, url):
+        # Returns the Future object for 'url', and True if it's new.
+        key = self._key(url)
+        with self._lock:
+            self.requests += 1
+            if key in self._results:
+                return (self._results[key], False)
+            future = self._results[key] = Future()
+            return (future, True)
+
+
+    def _settle(self, future, url, check):
+        try:
+            future.set_result(check(url))
+        except BaseException as err:
+            self._forget(url, future, err)
+            raise
+
+
+    def _forget(self, url, future, err):
+        # Requests already waiting get the exception, but the next request
+        # for the same URL will try again.
+        with self._lock:
+            self._results.pop(self._key(url), None)
+        if isinstance(err, Exception):
+            future.set_exception(err)
+        else:
+            future.cancel()
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _fanned_out(data, url):
+    # Returns a version of 'data' that refers to 'url'.  An unchanged URL
+    # stays unchanged even if it's written a little differently.
+    url = url.strip()
+    if not data or data.original == url:
+        return data
+    final = url if data.final == data.original else data.final
+    return UrlData(url, final, data.status, data.error)
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,42 @@
+'''
+errors.py: exceptions defined by Turf
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+class ServerError(Exception):
+    '''The server returned an HTTP status code we cannot proceed with.  If
+    the server said how long to wait before trying again, the number of
+    seconds is in 'retry_after'.'''
+
+    def __init__(self, status, message = None, retry_after = None):
+        self.status = status
+        self.retry_after = retry_after
+        super().__init__(message or 'Server returned code {} -- unable to continue'
+                         .format(status))
+
+
+class RecordDeadline(Exception):
+    '''The time allowed for checking the URLs of a record ran out before the
+    check of 'url' was done.'''
+    def __init__(self, url):
+        self.url = url
+        super().__init__('Ran out of time before checking {}'.format(url))
+
+
+class HostUnavailable(Exception):
+    '''A host has failed too often lately to be worth trying right now.'''
+
+    def __init__(self, host):
+        self.host = host
+        super().__init__('{} is unavailable'.format(host))
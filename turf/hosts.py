@@ -0,0 +1,189 @@
+'''
+hosts.py: limiting how hard Turf hits any one host when checking URLs.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import asyncio
+from   contextlib import contextmanager, asynccontextmanager
+import os
+import sys
+from   threading import Lock, Semaphore
+from   time import time, sleep
+from   urllib.parse import urlsplit
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('hosts: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_DEFAULT_HOST_LIMIT = 4
+'''Default number of URLs on the same host that are checked at the same time,
+for hosts not listed in _VENDOR_LIMITS.'''
+
+_VENDOR_LIMITS = {
+    # Domain                          Concurrency  Requests/sec  Burst
+    'ebscohost.com'                : (2,           1.0,          2),
+    'ebookcentral.proquest.com'    : (2,           1.0,          2),
+    'proquest.com'                 : (4,           2.0,          4),
+    'clsproxy.library.caltech.edu' : (2,           1.0,          2),
+}
+'''Limits for the hosts that a large share of our URLs point to, and that are
+known to throttle or block clients that make too many requests.  Every host
+in a listed domain shares the domain's limits.  The concurrency is the most
+URLs checked at the same time, and the rate and burst size define a token
+bucket that spaces out the start of the checks.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class HostScheduler():
+    '''Make URL checks take turns on busy hosts.
+
+    Before a URL is checked, a slot must be obtained for its host using
+    slot() (from threads) or async_slot() (from coroutines).  The number of
+    slots for each host is limited, and for the hosts in 'limits' (a dict
+    of the form of _VENDOR_LIMITS), slots are also handed out no faster than
+    the given rate.  Other hosts get 'host_limit' slots each, without a rate
+    limit; the overall number of checks is then limited only by the number
+    of workers doing them.
+    '''
+
+    def __init__(self, host_limit = _DEFAULT_HOST_LIMIT, limits = _VENDOR_LIMITS):
+        self.host_limit = host_limit
+        self.limits = limits
+        self._groups = {}
+        self._lock = Lock()
+        self.checks = 0
+        self.wait_time = 0
+
+
+    @contextmanager
+    def slot(self, url):
+        '''Context manager that waits for the host of 'url' to be free.'''
+        group = self._group(url)
+        began = time()
+        group.semaphore.acquire()
+        try:
+            delay = group.bucket.reserve() if group.bucket else 0
+            if delay > 0:
+                sleep(delay)
+            self._count(time() - began)
+            yield
+        finally:
+            group.semaphore.release()
+
+
+    @asynccontextmanager
+    async def async_slot(self, url):
+        '''Like slot(), but for use with "async with" in coroutines.'''
+        group = self._group(url)
+        if group.async_semaphore is None:
+            group.async_semaphore = asyncio.Semaphore(group.concurrency)
+        began = time()
+        async with group.async_semaphore:
+            delay = group.bucket.reserve() if group.bucket else 0
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._count(time() - began)
+            yield
+
+
+    def summary(self):
+        '''Return a short text summary of the waiting done.'''
+        return 'Spread {} URL checks over {} host{}; {:.1f}s spent waiting for busy hosts'.format(
+            self.checks, len(self._groups), '' if len(self._groups) == 1 else 's',
+            self.wait_time)
+
+
+    def _group(self, url):
+        # URLs without a usable host name share the group of host ''.
+        try:
+            host = (urlsplit(url.strip()).hostname or '').lower()
+        except ValueError:
+            host = ''
+        domain = next((domain for domain in self.limits
+                       if host == domain or host.endswith('.' + domain)), None)
+        with self._lock:
+            key = domain or host
+            if key not in self._groups:
+                if domain:
+                    (concurrency, rate, burst) = self.limits[domain]
+                    self._groups[key] = _HostGroup(concurrency, TokenBucket(rate, burst))
+                else:
+                    self._groups[key] = _HostGroup(self.host_limit, None)
+            return self._groups[key]
+
+
+    def _count(self, waited):
+        with self._lock:
+            self.checks += 1
+            self.wait_time += waited
+
+
+class TokenBucket():
+    '''Token bucket holding up to 'burst' tokens, refilled at 'rate' tokens
+    per second.  Each call to reserve() takes a token, even if there is none
+    yet, and returns how long the caller must wait before the token is
+    actually there.'''
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time()
+        self._lock = Lock()
+
+
+    def reserve(self):
+        with self._lock:
+            now = time()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class _HostGroup():
+    def __init__(self, concurrency, bucket):
+        self.concurrency = concurrency
+        self.bucket = bucket
+        self.semaphore = Semaphore(concurrency)
+        # Created when first needed, in the event loop where it is used.
+        self.async_semaphore = None
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,171 @@
+'''
+marc21.py: reading record ids and URLs from binary MARC 21 (ISO 2709) files.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import mmap
+import os
+import sys
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('marc21: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_LEADER_LENGTH = 24
+'''Length of the leader at the start of every record.'''
+
+_ENTRY_LENGTH = 12
+'''Length of an entry in the directory that follows the leader: a 3-byte tag,
+a 4-byte field length and a 5-byte offset from the start of the data.'''
+
+_FIELD_END = b'\x1e'
+'''Byte that ends the directory and each field.'''
+
+_RECORD_END = b'\x1d'
+'''Byte that ends each record.'''
+
+_SUBFIELD_START = b'\x1f'
+'''Byte that starts each subfield, followed by the subfield code.'''
+
+_FILLER = b'\r\n\x1a \t'
+'''Bytes that some programs write between or after records.'''
+
+_CHUNK_SIZE = 64 * 1024
+'''Number of bytes read from a stream at a time.'''
+
+
+# Main functions.
+# .............................................................................
+
+def marc21_records(stream):
+    '''Generator producing tuples of (id, urls) for the records read from the
+    binary file-like object 'stream', where 'id' is the content of field 001
+    and 'urls' is the list of URLs in subfield u of fields 856.  The stream
+    is read in chunks and split at the record terminators, which (unlike
+    the lengths in the leaders) are reliable even in exports of records too
+    long for the format.  Use this for input that cannot be memory-mapped,
+    such as compressed files.'''
+    position = 0
+    rest = b''
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        records = (rest + chunk).split(_RECORD_END)
+        rest = records.pop()
+        for record in records:
+            record += _RECORD_END
+            stripped = record.lstrip(_FILLER)
+            position += len(record) - len(stripped)
+            yield _id_and_urls(stripped, 0, len(stripped), position)
+            position += len(stripped)
+        if not chunk:
+            if rest.strip(_FILLER):
+                raise ValueError('Incomplete MARC record at byte {}'.format(position))
+            return
+
+
+def mapped_marc21_records(file):
+    '''Like marc21_records(), but for the uncompressed file named 'file',
+    which is memory-mapped.  Only the leader and directory of each record
+    are examined, and the directory is used to go straight to fields 001
+    and 856, so that the rest of the record is never decoded (or, in the
+    case of large records, even read from disk).'''
+    with open(file, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+            position = 0
+            size = len(data)
+            while position < size:
+                if data[position] in _FILLER:
+                    position += 1
+                    continue
+                end = position + _length(data[position:position + 5], position)
+                if (end <= position + _LEADER_LENGTH or end > size
+                    or data[end - 1:end] != _RECORD_END):
+                    # The length is wrong, as it is in some exports of records
+                    # too long for the 5 digits it has.
+                    end = data.find(_RECORD_END, position)
+                    if end < 0:
+                        raise ValueError('Incomplete MARC record at byte {}'.format(position))
+                    end += 1
+                yield _id_and_urls(data, position, end, position)
+                position = end
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _length(head, position):
+    # Returns the record length given in the first 5 bytes of a leader.
+    try:
+        return int(head[:5])
+    except ValueError:
+        raise ValueError('Not a MARC record at byte {}'.format(position))
+
+
+def _id_and_urls(data, start, end, position):
+    # Returns (id, urls) for the record occupying data[start:end], using the
+    # directory to find the fields.  'position' is only used in messages.
+    leader = bytes(data[start:start + _LEADER_LENGTH])
+    try:
+        base = start + int(leader[12:17])
+    except ValueError:
+        raise ValueError('Bad MARC leader at byte {}'.format(position))
+    id = ''
+    urls = []
+    entry = start + _LEADER_LENGTH
+    while entry + _ENTRY_LENGTH < base:
+        tag = bytes(data[entry:entry + 3])
+        if tag == b'001' or tag == b'856':
+            try:
+                field_length = int(data[entry + 3:entry + 7])
+                field_start = base + int(data[entry + 7:entry + 12])
+            except ValueError:
+                raise ValueError('Bad MARC directory at byte {}'.format(position))
+            field = bytes(data[field_start:min(field_start + field_length, end)])
+            field = field.rstrip(_FIELD_END).decode('utf-8', errors = 'replace')
+            if tag == b'001':
+                id = field.strip()
+            else:
+                for subfield in field.split(_SUBFIELD_START.decode())[1:]:
+                    if subfield[:1] == 'u':
+                        urls.append(subfield[1:].strip())
+        entry += _ENTRY_LENGTH
+    return (id, urls)
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,132 @@
+'''
+marcxml.py: incremental parsing of MARC XML content for Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import os
+import sys
+from   xml.etree import ElementTree
+
+try:
+    from lxml import etree as lxml_etree
+except ImportError:
+    lxml_etree = None
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('marcxml: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+MARC_RECORD = '{http://www.loc.gov/MARC21/slim}record'
+'''Fully-qualified tag of a record element in MARC XML.'''
+
+_CHUNK_SIZE = 64 * 1024
+'''Number of bytes read from the input at a time.'''
+
+BACKENDS = ['lxml', 'etree'] if lxml_etree is not None else ['etree']
+'''Parsers available for MARC XML, in order of preference: lxml if it is
+installed, and the ElementTree module of the Python standard library.  lxml
+is faster on full records; on records holding only fields 001 and 856 (as
+in slim mode), it is a little slower, but both are then so fast that the
+difference doesn't matter.  See dev/benchmarks/marc_backends.py.'''
+
+
+# Main functions.
+# .............................................................................
+
+def marc_records(stream, backend = None):
+    '''Generator producing the MARC record elements found in the file-like
+    object 'stream', each one as soon as its closing tag has been read.  The
+    stream is read in chunks rather than all at once.  After the caller is
+    done with an element and asks for the next one, the element is cleared
+    and detached from the tree, so memory use does not grow with the number
+    of records.  The elements are parsed using 'backend', one of BACKENDS,
+    or by default the first of them.  Either way, they can be used through
+    the ElementTree API (tag, attrib, text and iteration over children).'''
+    backend = backend or BACKENDS[0]
+    if backend not in BACKENDS:
+        raise ValueError('Unavailable XML parser backend "{}"'.format(backend))
+    if __debug__: log('parsing MARC XML using {}', backend)
+    if backend == 'lxml':
+        return _lxml_records(stream)
+    return _etree_records(stream)
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _lxml_records(stream):
+    # Only the ends of records are reported.  Each record is deleted from
+    # its parent together with anything before it, such as whitespace.
+    # Syntax errors are reported as they are by ElementTree, so that callers
+    # (such as the Retrier) can treat both backends the same way.
+    try:
+        for (_, elem) in lxml_etree.iterparse(stream, events = ('end',),
+                                              tag = MARC_RECORD,
+                                              resolve_entities = False,
+                                              huge_tree = True):
+            yield elem
+            elem.clear()
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except lxml_etree.XMLSyntaxError as err:
+        raise ElementTree.ParseError(str(err))
+
+
+def _etree_records(stream):
+    parser = ElementTree.XMLPullParser(events = ('start', 'end'))
+    parents = []
+    while True:
+        chunk = stream.read(_CHUNK_SIZE)
+        if chunk:
+            parser.feed(chunk)
+        else:
+            parser.close()
+        for (event, elem) in parser.read_events():
+            if event == 'start':
+                parents.append(elem)
+                continue
+            parents.pop()
+            if elem.tag == MARC_RECORD:
+                yield elem
+                elem.clear()
+                if parents:
+                    parents[-1].remove(elem)
+        if not chunk:
+            return
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
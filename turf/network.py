@@ -0,0 +1,325 @@
+'''
+network.py: network communication utilities for Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   contextlib import contextmanager
+import http.client
+import os
+import sys
+from   threading import Lock
+from   urllib.parse import urlsplit
+import zlib
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('network: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_NETWORK_TIMEOUT = 15
+'''How long to wait on a network connection attempt.'''
+
+_STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected,
+                            http.client.CannotSendRequest,
+                            http.client.BadStatusLine,
+                            BrokenPipeError,
+                            ConnectionResetError,
+                            ConnectionAbortedError)
+'''Errors that indicate a kept-alive socket was closed by the server while it
+was sitting idle in the pool.  When one of these happens on a reused
+connection, the request is sent again on a fresh connection.'''
+
+_CHUNK_SIZE = 64 * 1024
+'''Number of bytes read from the network at a time when decompressing.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class ConnectionPool():
+    '''Pool of persistent HTTP/HTTPS connections, keyed by scheme and netloc.
+
+    Connections are kept open after a response has been read completely, and
+    handed out again for the next request to the same scheme and host.  This
+    avoids paying for a new TCP connection and TLS handshake for every page
+    fetched from caltech.tind.io.  Use the method response() as a context
+    manager; the connection is returned to the pool when the block exits.
+    '''
+
+    def __init__(self, timeout = _NETWORK_TIMEOUT):
+        self._timeout = timeout
+        self._idle = {}
+        self._lock = Lock()
+        self.transfer = TransferStats()
+        # One entry per key, each a list with one count per physical
+        # connection opened: the number of requests sent on it after the
+        # first one.  Connections still open are counted in close().
+        self.reuse_counts = {}
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    @contextmanager
+    def response(self, url, headers = {}, method = 'GET', compressed = False):
+        '''Send a request for 'url' and yield the HTTPResponse object.  The
+        caller should read the response body inside the "with" block.  If
+        'compressed' is True, ask the server for a gzip or deflate encoded
+        body; what is yielded is then a DecodedResponse, whose read() method
+        decompresses the body as it is read from the network.'''
+        parts = urlsplit(url)
+        key = (parts.scheme, parts.netloc)
+        if compressed:
+            headers = dict(headers, **{'Accept-Encoding': 'gzip, deflate'})
+        conn = self._checkout(key)
+        try:
+            conn, response = self._sent(conn, key, url, headers, method)
+        except:
+            self._retire(conn, key)
+            raise
+        try:
+            if compressed:
+                yield DecodedResponse(response, self.transfer)
+            else:
+                yield response
+        except:
+            self._retire(conn, key)
+            raise
+        if response.isclosed() and not response.will_close:
+            self._checkin(conn, key)
+        else:
+            # The body was not fully consumed or the server asked to close
+            # the connection; either way the socket can't be used again.
+            self._retire(conn, key)
+
+
+    def close(self):
+        '''Close every idle connection in the pool.'''
+        with self._lock:
+            idle = [(key, conn) for key, conns in self._idle.items() for conn in conns]
+            self._idle = {}
+        for key, conn in idle:
+            self._retire(conn, key)
+        if __debug__:
+            for (scheme, netloc), counts in self.reuse_counts.items():
+                log('{} connections to {}://{} reused {} times',
+                    len(counts), scheme, netloc, sum(counts))
+
+
+    def summary(self):
+        '''Return a short text summary of connection use.'''
+        counts = [n for per_key in self.reuse_counts.values() for n in per_key]
+        requests = sum(counts) + len(counts)
+        return 'Made {} request{} over {} connection{}'.format(
+            requests, '' if requests == 1 else 's',
+            len(counts), '' if len(counts) == 1 else 's')
+
+
+    def _checkout(self, key):
+        with self._lock:
+            if self._idle.get(key):
+                return self._idle[key].pop()
+        return self._new_connection(key)
+
+
+    def _checkin(self, conn, key):
+        with self._lock:
+            self._idle.setdefault(key, []).append(conn)
+
+
+    def _retire(self, conn, key):
+        conn.close()
+        if conn._turf_uses > 0:
+            with self._lock:
+                self.reuse_counts.setdefault(key, []).append(conn._turf_uses - 1)
+            conn._turf_uses = 0
+
+
+    def _new_connection(self, key):
+        (scheme, netloc) = key
+        if __debug__: log('opening new connection to {}://{}', scheme, netloc)
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection(netloc, timeout = self._timeout)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout = self._timeout)
+        conn._turf_uses = 0
+        return conn
+
+
+    def _sent(self, conn, key, url, headers, method):
+        # Returns the connection actually used, which will be a new one if
+        # the one we were given turned out to be stale.
+        reused = conn._turf_uses > 0
+        try:
+            conn._turf_uses += 1
+            conn.request(method, url, headers = headers)
+            return (conn, conn.getresponse())
+        except _STALE_CONNECTION_ERRORS as err:
+            if not reused:
+                raise
+            # The server closed the socket while it was idle.  Start over.
+            if __debug__: log('stale connection to {}: {}', key[1], err)
+            conn._turf_uses -= 1
+            self._retire(conn, key)
+            conn = self._new_connection(key)
+            conn._turf_uses += 1
+            try:
+                conn.request(method, url, headers = headers)
+                return (conn, conn.getresponse())
+            except:
+                self._retire(conn, key)
+                raise
+
+
+class DecodedResponse():
+    '''Wrapper around an HTTPResponse that undoes any gzip or deflate
+    content encoding while the body is being read.
+
+    The body is decompressed a chunk at a time, with the output of each step
+    limited to what the caller asked for, so that neither the compressed nor
+    the decompressed body has to be held in memory in full.  The numbers of
+    bytes received and produced are added to the TransferStats object given.
+    '''
+
+    def __init__(self, response, stats):
+        self._response = response
+        self._stats = stats
+        encoding = (response.getheader('Content-Encoding') or '').lower()
+        if encoding == 'gzip':
+            self._decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif encoding == 'deflate':
+            self._decoder = zlib.decompressobj()
+        else:
+            self._decoder = None
+        # Some servers send raw deflate data without the zlib wrapper.  We
+        # can only tell by trying, on the first chunk.
+        self._maybe_raw = (encoding == 'deflate')
+        self._pending = b''
+        self._eof = False
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.headers
+
+
+    def getheader(self, name, default = None):
+        return self._response.getheader(name, default)
+
+
+    def read(self, amt = None):
+        if amt is None:
+            return b''.join(iter(lambda: self.read(_CHUNK_SIZE), b''))
+        if self._decoder is None:
+            data = self._response.read(amt)
+            self._stats.add(len(data), len(data), False)
+            return data
+        while not self._eof:
+            if self._pending:
+                # Input held back on an earlier call because of 'amt'.
+                (raw, self._pending) = (self._pending, b'')
+            else:
+                raw = self._response.read(_CHUNK_SIZE)
+                if not raw:
+                    self._eof = True
+                    data = self._decoder.flush()
+                    self._stats.add(0, len(data), True)
+                    return data
+                self._stats.add(len(raw), 0, True)
+            data = self._decompressed(raw, amt)
+            if data:
+                return data
+        return b''
+
+
+    def _decompressed(self, raw, amt):
+        try:
+            data = self._decoder.decompress(raw, amt)
+        except zlib.error:
+            if not self._maybe_raw:
+                raise
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._decoder.decompress(raw, amt)
+        self._maybe_raw = False
+        self._pending = self._decoder.unconsumed_tail
+        self._stats.add(0, len(data), True)
+        return data
+
+
+class TransferStats():
+    '''Running totals of bytes received over the network and bytes of
+    content obtained from them after decompression.'''
+
+    def __init__(self):
+        self._lock = Lock()
+        self.wire_bytes = 0
+        self.content_bytes = 0
+        self.compressed_reads = 0
+
+
+    def add(self, wire_bytes, content_bytes, compressed):
+        with self._lock:
+            self.wire_bytes += wire_bytes
+            self.content_bytes += content_bytes
+            if compressed:
+                self.compressed_reads += 1
+
+
+    def summary(self):
+        '''Return a short text summary of the bytes transferred.'''
+        text = 'Received {} for {} of content'.format(
+            _size(self.wire_bytes), _size(self.content_bytes))
+        if self.content_bytes > self.wire_bytes:
+            saved = 100 * (1 - self.wire_bytes / self.content_bytes)
+            text += ' ({:.0f}% saved by compression)'.format(saved)
+        return text
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _size(num_bytes):
+    for unit in ['bytes', 'kB', 'MB']:
+        if num_bytes < 1000:
+            return '{:.0f} {}'.format(num_bytes, unit)
+        num_bytes /= 1000
+    return '{:.1f} GB'.format(num_bytes)
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,158 @@
+'''
+pacing.py: adaptive control of page size and request rate for Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import os
+import sys
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('pacing: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_TARGET_LATENCY = 5
+'''Response time (in seconds) for one page that we consider acceptable.  If
+responses come back much faster, we ask for bigger pages more often; if they
+come back slower, we ask for smaller pages less often.'''
+
+_SMOOTHING = 0.3
+'''Weight given to the latest observation in the moving average of latency.'''
+
+_GROWTH = 1.25
+'''Factor by which the page size grows (and the delay shrinks) when things
+are going well.'''
+
+_BACKOFF = 2
+'''Factor by which the page size shrinks (and the delay grows) after errors.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class AdaptivePacer():
+    '''Choose the page size and the delay between requests for fetching
+    records, based on how the server has been responding.
+
+    Call record() after every request.  The attributes 'page_size' and
+    'delay' are then adjusted, always staying within the bounds given at
+    initialization.  Page sizes grow and delays shrink while responses are
+    fast and error-free; slow responses, HTTP 5xx and 429 codes, network
+    errors and empty pages make it back off.
+    '''
+
+    def __init__(self, page_size, delay, size_bounds, delay_bounds):
+        (self.min_size, self.max_size) = size_bounds
+        (self.min_delay, self.max_delay) = delay_bounds
+        self.page_size = self._clamped_size(page_size)
+        self.delay = self._clamped_delay(delay)
+        self.latency = None
+        self.requests = 0
+        self.cached = 0
+        self._used_network = False
+        self.errors = 0
+        self.server_errors = 0
+        self.empty_pages = 0
+
+
+    def record(self, latency, status = 200, error = False, records = None):
+        '''Record the outcome of one request.  'latency' is the time (in
+        seconds) the request took, 'status' is the HTTP status code, 'error'
+        is True if the request failed without a status code (e.g., because of
+        a timeout), and 'records' is the number of records received.'''
+        self.requests += 1
+        self._used_network = True
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = _SMOOTHING * latency + (1 - _SMOOTHING) * self.latency
+        if error or status == 429 or status >= 500:
+            if error:
+                self.errors += 1
+            else:
+                self.server_errors += 1
+            self._slow_down(self.page_size / _BACKOFF, self.delay * _BACKOFF)
+        elif records == 0:
+            # Could be the end of the results, or the server having trouble.
+            # Either way, asking for more right away won't help.
+            self.empty_pages += 1
+            self._slow_down(self.page_size, self.delay * _BACKOFF)
+        elif self.latency > _TARGET_LATENCY:
+            self._slow_down(self.page_size / _GROWTH, self.delay * _GROWTH)
+        elif self.latency < _TARGET_LATENCY / 2:
+            self.page_size = self._clamped_size(max(self.page_size + 1,
+                                                    self.page_size * _GROWTH))
+            self.delay = self._clamped_delay(self.delay / _GROWTH)
+        if __debug__: log('latency {:.2f}s => page size {}, delay {:.2f}s',
+                          self.latency, self.page_size, self.delay)
+
+
+    def record_cached(self):
+        '''Record that a page was obtained without contacting the server.'''
+        self.cached += 1
+        self._used_network = False
+
+
+    def pause(self):
+        '''Return the number of seconds to wait before the next request.
+        There's no need to wait if the last page didn't come from the server.'''
+        return self.delay if self._used_network else 0
+
+
+    def summary(self):
+        '''Return a short text summary of the settings arrived at.'''
+        text = 'Settled on pages of {} records with {:.2f}s between requests'.format(
+            self.page_size, self.delay)
+        if self.errors or self.server_errors or self.empty_pages:
+            text += ' ({} network errors, {} server errors, {} empty pages)'.format(
+                self.errors, self.server_errors, self.empty_pages)
+        return text
+
+
+    def _slow_down(self, page_size, delay):
+        self.page_size = self._clamped_size(page_size)
+        self.delay = self._clamped_delay(delay)
+
+
+    def _clamped_size(self, size):
+        return int(min(self.max_size, max(self.min_size, size)))
+
+
+    def _clamped_delay(self, delay):
+        return min(self.max_delay, max(self.min_delay, delay))
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
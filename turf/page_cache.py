@@ -0,0 +1,195 @@
+'''
+page_cache.py: on-disk cache of pages of search results for Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   contextlib import contextmanager
+import gzip
+from   hashlib import sha1
+import os
+from   os import path
+import sys
+from   threading import Lock, get_ident
+from   time import time
+from   urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('page_cache: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_MAX_BYTES = 1024 * 1024 * 1024
+'''Default upper limit on the total size of the files in the cache.'''
+
+_IGNORED_PARAMETERS = ['rg']
+'''Query parameters left out of cache keys.  The page size varies from run to
+run (see pacing.py), but a page cached with a different size still holds the
+right records for its starting position, so it's good enough.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class PageCache():
+    '''Cache of the MARC XML content of pages of search results.
+
+    Pages are stored as gzip-compressed files in directory 'dir', named after
+    a hash of the normalized search URL (with the parameters in a fixed order
+    and without the page size).  Entries older than 'ttl' seconds are ignored
+    and replaced.  When the files add up to more than 'max_bytes', the least
+    recently used ones are deleted.  If 'refresh' is True, nothing is read
+    from the cache, but pages fetched during the run are still stored.  The
+    query parameters left out of the cache keys can be changed by passing a
+    list of names as 'ignored'.
+    '''
+
+    def __init__(self, dir = None, ttl = 24*60*60, max_bytes = _MAX_BYTES,
+                 refresh = False, ignored = _IGNORED_PARAMETERS):
+        self.dir = dir or path.join(cache_dir(), 'pages')
+        self.ignored = ignored
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+        os.makedirs(self.dir, exist_ok = True)
+        self._total_bytes = sum(entry.stat().st_size for entry in self._entries())
+
+
+    def get(self, url):
+        '''Return an open binary file of the cached content for 'url', or
+        None if there is no fresh entry for it.'''
+        file = self._file(url)
+        try:
+            # We keep the time of storage in mtime, and of last use in atime.
+            stored = path.getmtime(file)
+        except OSError:
+            stored = None
+        if self.refresh or stored is None or time() - stored > self.ttl:
+            with self._lock:
+                self.misses += 1
+            return None
+        if __debug__: log('using cached copy of {}', url)
+        os.utime(file, (time(), stored))
+        with self._lock:
+            self.hits += 1
+        return gzip.open(file, 'rb')
+
+
+    @contextmanager
+    def storing(self, url):
+        '''Context manager yielding a binary file object to which the content
+        for 'url' should be written.  The entry is added to the cache only if
+        the block completes without an exception.'''
+        file = self._file(url)
+        temp = file + '.{}.tmp'.format(get_ident())
+        try:
+            with gzip.open(temp, 'wb') as out:
+                yield out
+            os.replace(temp, file)
+        finally:
+            if path.exists(temp):
+                os.remove(temp)
+        with self._lock:
+            self._total_bytes += path.getsize(file)
+        self._evict()
+
+
+    def summary(self):
+        '''Return a short text summary of how the cache was used.'''
+        return 'Used cached pages {} times out of {}'.format(
+            self.hits, self.hits + self.misses)
+
+
+    def _file(self, url):
+        return path.join(self.dir, sha1(_normalized(url, self.ignored).encode()).hexdigest() + '.xml.gz')
+
+
+    def _entries(self):
+        return [entry for entry in os.scandir(self.dir)
+                if entry.is_file() and entry.name.endswith('.xml.gz')]
+
+
+    def _evict(self):
+        with self._lock:
+            if self._total_bytes <= self.max_bytes:
+                return
+            entries = sorted(self._entries(), key = lambda entry: entry.stat().st_atime)
+            for entry in entries:
+                if self._total_bytes <= self.max_bytes:
+                    break
+                if __debug__: log('evicting {}', entry.name)
+                self._total_bytes -= entry.stat().st_size
+                os.remove(entry.path)
+
+
+class CopyingReader():
+    '''File-like object that reads from 'stream' and writes a copy of
+    everything it reads to 'sink'.'''
+
+    def __init__(self, stream, sink):
+        self._stream = stream
+        self._sink = sink
+
+
+    def read(self, amt = None):
+        data = self._stream.read(amt)
+        self._sink.write(data)
+        return data
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def cache_dir():
+    '''Return the directory where Turf keeps its cached data.'''
+    if sys.platform.startswith('win'):
+        base = os.environ.get('LOCALAPPDATA', path.expanduser('~'))
+    else:
+        base = os.environ.get('XDG_CACHE_HOME', path.expanduser('~/.cache'))
+    return path.join(base, 'turf')
+
+
+def _normalized(url, ignored = _IGNORED_PARAMETERS):
+    parts = urlsplit(url)
+    params = sorted((name, value) for (name, value) in parse_qsl(parts.query)
+                    if name not in ignored)
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path,
+                       urlencode(params), ''))
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,218 @@
+'''
+partitions.py: splitting a search into ranges of record ids for Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   concurrent.futures import ThreadPoolExecutor
+import os
+import sys
+from   threading import Event, Lock
+from   time import time
+from   urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('partitions: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_DEFAULT_WORKERS = 4
+'''Default number of partitions fetched at the same time.'''
+
+_DEFAULT_DEPTH = 2
+'''Default number of fetched partitions allowed to wait beyond those being
+worked on by the caller.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class Partition():
+    '''A search restricted to the record ids from 'low' to 'high' inclusive.
+    'query' is the URL of the restricted search.'''
+
+    def __init__(self, low, high, query):
+        self.low = low
+        self.high = high
+        self.query = query
+
+
+    def __repr__(self):
+        return 'Partition({}->{})'.format(self.low, self.high)
+
+
+class PartitionFetcher():
+    '''Fetch the pages of results of a list of partitions, several at a time.
+
+    The function 'fetch' is called with a query, a starting record number
+    within the query's results, and a page size, and must return a page of
+    results or None.  A partition is finished when a page comes back with no
+    records that haven't been seen before, so no partition is ever paged
+    through very deeply.  (A short page is not enough: the server may return
+    fewer records than asked for, and a cached page may have been fetched
+    with a smaller page size.)  The function 'page_size' is called
+    before each request to get the number of records to ask for.  Up to
+    'workers' partitions are fetched in parallel, and up to 'depth' more may
+    be waiting for the caller.  The caller iterates over pages() and must
+    call stop() when done.  This is a drop-in replacement for PagePrefetcher.
+    '''
+
+    def __init__(self, fetch, partitions, page_size, start = 1,
+                 workers = _DEFAULT_WORKERS, depth = _DEFAULT_DEPTH, delay = 0):
+        self._fetch = fetch
+        self._partitions = partitions
+        self._page_size = page_size
+        self._start = start
+        self._workers = max(1, workers)
+        self._depth = max(0, depth)
+        self._delay = delay if callable(delay) else (lambda: delay)
+        self._stopped = Event()
+        self._executor = None
+        self._lock = Lock()
+        # Statistics about the time spent, to gauge the benefit of fetching
+        # partitions in parallel.
+        self.partitions_fetched = 0
+        self.pages_fetched = 0
+        self.fetch_time = 0
+        self.wait_time = 0
+
+
+    def pages(self):
+        '''Yield tuples of (start, page) in order, where 'start' is the number
+        of the first record of 'page' counting across all the partitions, and
+        finish with a page of None once all the partitions are done.  Records
+        numbered below the 'start' given to the constructor are skipped.
+        Exceptions raised by the fetch function are reraised here.'''
+        self._executor = ThreadPoolExecutor(max_workers = self._workers)
+        remaining = iter(self._partitions)
+        in_flight = []
+        def submit_more():
+            while len(in_flight) < self._workers + self._depth:
+                partition = next(remaining, None)
+                if partition is None:
+                    return
+                in_flight.append(self._executor.submit(self._fetched, partition))
+        submit_more()
+        current = 1
+        while in_flight and not self._stopped.is_set():
+            waiting_since = time()
+            pages = in_flight.pop(0).result()
+            self.wait_time += time() - waiting_since
+            submit_more()
+            for page in pages:
+                if current + len(page) > self._start:
+                    skip = max(0, self._start - current)
+                    yield (current + skip, page[skip:])
+                current += len(page)
+        if not self._stopped.is_set():
+            yield (current, None)
+
+
+    def stop(self):
+        '''Tell the worker threads to stop and wait for them to exit.'''
+        self._stopped.set()
+        if self._executor:
+            self._executor.shutdown(wait = True)
+        if __debug__: log('stopped after fetching {} partitions', self.partitions_fetched)
+
+
+    def summary(self):
+        '''Return a short text summary of the time spent fetching pages.'''
+        return ('Fetched {} pages from {} partitions in {:.1f}s; {:.1f}s spent waiting for them'
+                .format(self.pages_fetched, self.partitions_fetched,
+                        self.fetch_time, self.wait_time))
+
+
+    def _fetched(self, partition):
+        # Returns the list of pages of the partition.
+        pages = []
+        ids = set()
+        start = 1
+        while not self._stopped.is_set():
+            size = self._page_size()
+            fetch_began = time()
+            page = self._fetch(partition.query, start, size)
+            with self._lock:
+                self.fetch_time += time() - fetch_began
+                self.pages_fetched += 1
+            # The server may repeat its last page when asked for records past
+            # the end, so records we've already got also mean we're done.
+            new = [record for record in (page or []) if record.id not in ids]
+            if not new:
+                break
+            pages.append(new)
+            ids.update(record.id for record in new)
+            start += len(new)
+            # Be nice to the server.
+            if self._stopped.wait(self._delay()):
+                break
+        if __debug__: log('{} done: {} records', partition, len(ids))
+        with self._lock:
+            self.partitions_fetched += 1
+        return pages
+
+
+# Main functions.
+# .............................................................................
+
+def partitioned(query, highest, size):
+    '''Return a list of Partition objects that together cover the results of
+    the search 'query', given the highest record id in the database and the
+    number of record ids in each partition.  The partitions are in order of
+    decreasing record ids, which is the order TIND uses by default.'''
+    partitions = []
+    high = highest
+    while high > 0:
+        low = max(1, high - size + 1)
+        partitions.append(Partition(low, high, recid_query(query, low, high)))
+        high = low - 1
+    if __debug__: log('{} partitions of {} record ids', len(partitions), size)
+    return partitions
+
+
+def recid_query(query, low, high):
+    '''Return a version of the search 'query' restricted to the record ids
+    from 'low' to 'high' inclusive, and starting at the first record.'''
+    parts = urlsplit(query)
+    params = parse_qsl(parts.query, keep_blank_values = True)
+    pattern = next((value for (name, value) in params if name == 'p'), '').strip()
+    recids = 'recid:{}->{}'.format(low, high)
+    pattern = '({}) and {}'.format(pattern, recids) if pattern else recids
+    params = [(name, value) for (name, value) in params if name not in ('p', 'jrec')]
+    params.append(('p', pattern))
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(params), ''))
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
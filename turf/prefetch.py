@@ -0,0 +1,155 @@
+'''
+prefetch.py: background fetching of pages of search results for Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import os
+from   queue import Queue, Empty, Full
+import sys
+from   threading import Thread, Event
+from   time import time
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('prefetch: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_DEFAULT_DEPTH = 2
+'''Default number of fetched pages allowed to wait in the queue.'''
+
+_POLL_INTERVAL = 0.2
+'''How often (in seconds) a blocked thread checks whether it should stop.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class PagePrefetcher():
+    '''Fetch successive pages of results in a background thread.
+
+    The function 'fetch' is called with a starting record number and must
+    return a page of results, or None if there are no more.  The function
+    'length' is called on each page to find out how many records it holds,
+    which determines the starting record number of the next page.  Up to
+    'depth' pages are fetched ahead of the caller and kept in a queue.  The
+    caller iterates over pages() and must call stop() when done, because the
+    end of the results may only become apparent to the caller.  The pause
+    between requests, 'delay', can be a number of seconds or a function that
+    returns the number of seconds to wait before the next request.
+    '''
+
+    def __init__(self, fetch, length, start, depth = _DEFAULT_DEPTH, delay = 0):
+        self._fetch = fetch
+        self._length = length
+        self._start = start
+        self._delay = delay if callable(delay) else (lambda: delay)
+        self._queue = Queue(maxsize = max(1, depth))
+        self._stopped = Event()
+        self._thread = Thread(target = self._run, daemon = True)
+        # Statistics about the time spent, to gauge the benefit of prefetching.
+        self.pages_fetched = 0
+        self.fetch_time = 0
+        self.wait_time = 0
+
+
+    def pages(self):
+        '''Yield tuples of (start, page) in order, ending with a page of None
+        if the fetch function signals the end of the results.  Exceptions
+        raised by the fetch function are reraised here.'''
+        if not self._thread.is_alive() and not self._stopped.is_set():
+            if __debug__: log('starting prefetch thread at {}', self._start)
+            self._thread.start()
+        while not self._stopped.is_set():
+            waiting_since = time()
+            try:
+                item = self._queue.get(timeout = _POLL_INTERVAL)
+            except Empty:
+                self.wait_time += time() - waiting_since
+                continue
+            self.wait_time += time() - waiting_since
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            if item[1] is None:
+                return
+
+
+    def stop(self):
+        '''Tell the background thread to stop and wait for it to exit.'''
+        self._stopped.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        if __debug__: log('stopped after fetching {} pages', self.pages_fetched)
+
+
+    def summary(self):
+        '''Return a short text summary of the time spent fetching pages.'''
+        return ('Fetched {} pages in {:.1f}s; {:.1f}s spent waiting for them'
+                .format(self.pages_fetched, self.fetch_time, self.wait_time))
+
+
+    def _run(self):
+        start = self._start
+        while not self._stopped.is_set():
+            fetch_began = time()
+            try:
+                page = self._fetch(start)
+            except Exception as err:
+                if __debug__: log('fetch of page at {} failed: {}', start, err)
+                self._put(err)
+                return
+            self.fetch_time += time() - fetch_began
+            self.pages_fetched += 1
+            if not self._put((start, page)) or page is None:
+                return
+            start += self._length(page)
+            # Be nice to the server.
+            if self._stopped.wait(self._delay()):
+                return
+
+
+    def _put(self, item):
+        # Returns False if we were told to stop while waiting for room.
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout = _POLL_INTERVAL)
+                return True
+            except Full:
+                continue
+        return False
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,234 @@
+'''
+redirects.py: learning how whole families of URLs are redirected in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import json
+import os
+import sys
+from   threading import Lock
+from   urllib.parse import urlsplit
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('redirects: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_MIN_SUPPORT = 5
+'''Number of different URLs that must have been redirected the same way
+before a rule is used to predict where other URLs lead.'''
+
+_SAMPLE_INTERVAL = 10
+'''One in this many URLs covered by a rule is dereferenced anyway, to make
+sure the rule still holds.  A rule is dropped the first time it doesn't.'''
+
+_MIN_TAIL = 3
+'''Shortest end part of a URL that is taken to identify the item it leads to.
+Shorter ones are too likely to turn up in the new URL by chance.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class RedirectLearner():
+    '''Learn rules for how families of URLs are redirected, and use them to
+    predict where other URLs in the same families lead.
+
+    When a vendor moves its content, all the URLs of a kind usually change
+    the same way: a URL made of a prefix (such as the vendor's old address)
+    and a part identifying an item is redirected to a new prefix, followed
+    by the same identifying part, sometimes followed by a fixed suffix.
+    Each result given to observe() adds support for such a rule.  Once a
+    rule has 'min_support' URLs to back it, predicted() uses it for other
+    URLs with the same prefix, except for one in 'sample_interval' of them,
+    which must be dereferenced and given to observe() to check the rule.
+    '''
+
+    def __init__(self, min_support = _MIN_SUPPORT, sample_interval = _SAMPLE_INTERVAL):
+        self.min_support = min_support
+        self.sample_interval = sample_interval
+        self.predictions = 0
+        self.verifications = 0
+        # Dict of dicts of _Rule objects, keyed by host and by prefix.
+        self._rules = {}
+        self._lock = Lock()
+
+
+    def predicted(self, url):
+        '''Return a UrlData named tuple predicted for 'url', or None if no
+        rule applies, or if this URL should be dereferenced to check one.'''
+        url = url.strip()
+        with self._lock:
+            rule = self._rule_for(url)
+            if not rule:
+                return None
+            rule.uses += 1
+            if rule.uses % self.sample_interval == 0:
+                return None
+            rule.predictions += 1
+            self.predictions += 1
+            return UrlData(url, rule.final(url), rule.status, None)
+
+
+    def observe(self, data):
+        '''Learn from the UrlData result 'data' obtained by dereferencing
+        its original URL.'''
+        if not data:
+            return
+        with self._lock:
+            rule = self._rule_for(data.original)
+            if rule:
+                self.verifications += 1
+                if data.error or (data.final, data.status) != (rule.final(data.original),
+                                                              rule.status):
+                    if __debug__: log('dropping rule for {}: {} => {}', rule.prefix,
+                                      data.original, data.final)
+                    rule.failed = True
+            if data.error or not data.final or data.final == data.original:
+                return
+            found = _split(data.original, data.final)
+            if not found:
+                return
+            (host, prefix, new_prefix, suffix) = found
+            rules = self._rules.setdefault(host, {}).setdefault(prefix, {})
+            key = (new_prefix, suffix, data.status)
+            if key not in rules:
+                rules[key] = _Rule(prefix, new_prefix, suffix, data.status)
+            rules[key].support += 1
+
+
+    def rules(self):
+        '''Return a list of dicts describing the rules backed by more than
+        one URL, most strongly supported first.'''
+        with self._lock:
+            rules = [rule for prefixes in self._rules.values()
+                     for variants in prefixes.values()
+                     for rule in variants.values() if rule.support > 1]
+        rules.sort(key = lambda rule: (-rule.support, rule.prefix))
+        return [{'prefix'      : rule.prefix,
+                 'new_prefix'  : rule.new_prefix,
+                 'suffix'      : rule.suffix,
+                 'status'      : rule.status,
+                 'support'     : rule.support,
+                 'predictions' : rule.predictions,
+                 'failed'      : rule.failed} for rule in rules]
+
+
+    def save(self, file):
+        '''Write the rules returned by rules() to 'file', in JSON format.'''
+        if __debug__: log('writing rules to {}', file)
+        with open(file, 'w') as f:
+            json.dump(self.rules(), f, indent = 2)
+            f.write('\n')
+
+
+    def summary(self):
+        '''Return a short text summary of the rules learned and used.'''
+        with self._lock:
+            rules = [rule for prefixes in self._rules.values()
+                     for variants in prefixes.values()
+                     for rule in variants.values() if rule.support >= self.min_support]
+        return 'Learned {} redirection rule{} ({} dropped); predicted {} URLs and verified {}'.format(
+            len(rules), '' if len(rules) == 1 else 's',
+            sum(1 for rule in rules if rule.failed), self.predictions, self.verifications)
+
+
+    def _rule_for(self, url):
+        # Returns the rule to use for 'url', or None.  If more than one rule
+        # has the longest matching prefix, the URLs in that family are not
+        # all redirected the same way, so there is no rule to use.
+        try:
+            host = (urlsplit(url).hostname or '').lower()
+        except ValueError:
+            return None
+        prefixes = self._rules.get(host)
+        if not prefixes:
+            return None
+        length = len(url) - _MIN_TAIL
+        while length > 0 and url[:length] not in prefixes:
+            length -= 1
+        if length == 0:
+            return None
+        variants = prefixes[url[:length]].values()
+        supported = [rule for rule in variants if rule.support >= self.min_support]
+        if len(supported) != 1 or supported[0].failed:
+            return None
+        return supported[0]
+
+
+class _Rule():
+    def __init__(self, prefix, new_prefix, suffix, status):
+        self.prefix = prefix
+        self.new_prefix = new_prefix
+        self.suffix = suffix
+        self.status = status
+        self.support = 0
+        self.uses = 0
+        self.predictions = 0
+        self.failed = False
+
+
+    def final(self, url):
+        return self.new_prefix + url[len(self.prefix):] + self.suffix
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _split(original, final):
+    # Returns a tuple of (host, prefix, new prefix, suffix) such that
+    # 'original' is prefix + tail and 'final' is new prefix + tail + suffix,
+    # for the longest tail (within the path and query of 'original') that
+    # appears in 'final'.  Returns None if there is no such tail.
+    try:
+        parts = urlsplit(original)
+    except ValueError:
+        return None
+    if not parts.hostname:
+        return None
+    start = original.find(parts.netloc) + len(parts.netloc)
+    for length in range(len(original) - start, _MIN_TAIL - 1, -1):
+        tail = original[-length:]
+        position = final.rfind(tail)
+        if position >= 0:
+            return (parts.hostname.lower(), original[:-length], final[:position],
+                    final[position + length:])
+    return None
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
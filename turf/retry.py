@@ -0,0 +1,172 @@
+'''
+retry.py: retrying failed requests for pages of results in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import http.client
+import os
+from   random import uniform
+import socket
+import sys
+from   threading import Event, Lock
+from   xml.etree.ElementTree import ParseError
+import zlib
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+import turf
+from turf.errors import ServerError
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('retry: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_DEFAULT_BUDGET = 50
+'''Default total number of retries allowed over a whole run.'''
+
+_MAX_ATTEMPTS = 6
+'''Maximum number of times any one request is tried.'''
+
+_BASE_DELAY = 1
+'''Delay (in seconds) before the first retry.  It doubles with each attempt.'''
+
+_MAX_DELAY = 60
+'''Upper limit on the delay before any one retry.'''
+
+_RETRYABLE_ERRORS = (socket.timeout,
+                     TimeoutError,
+                     ConnectionError,
+                     http.client.HTTPException,
+                     ParseError,
+                     zlib.error,
+                     EOFError)
+'''Errors that are likely to go away if the request is tried again: network
+timeouts and failures, and bodies that were cut off before the end.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class Retrier():
+    '''Call functions again when they fail for reasons that may be transient.
+
+    Failures classified as retryable by retryable() are retried after a delay
+    that grows exponentially with each attempt, with random jitter so that
+    parallel requests don't all come back at the same moment.  A request is
+    tried at most 'attempts' times, and no more than 'budget' retries are made
+    over the lifetime of the object; after that, the error is raised as usual.
+    Retries are counted by cause (an HTTP status code or the name of the
+    exception), for the summary.
+    '''
+
+    def __init__(self, budget = _DEFAULT_BUDGET, attempts = _MAX_ATTEMPTS,
+                 base_delay = _BASE_DELAY, max_delay = _MAX_DELAY):
+        self.budget = budget
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retries = 0
+        self.causes = {}
+        self._cancelled = Event()
+        self._lock = Lock()
+
+
+    def call(self, function, *args, **kwargs):
+        '''Call 'function' with the arguments given and return its result,
+        retrying it if it fails with a retryable error.'''
+        attempt = 1
+        while True:
+            try:
+                return function(*args, **kwargs)
+            except Exception as err:
+                if (attempt >= self.attempts or not retryable(err)
+                        or self._cancelled.is_set() or not self._spend(err)):
+                    raise
+                delay = self._delay(attempt, err)
+                if __debug__: log('attempt {} failed ({}); retrying in {:.1f}s',
+                                  attempt, err, delay)
+                if self._cancelled.wait(delay):
+                    raise
+                attempt += 1
+
+
+    def cancel(self):
+        '''Stop any retries in progress or to come.'''
+        self._cancelled.set()
+
+
+    def summary(self):
+        '''Return a short text summary of the retries made.'''
+        if not self.retries:
+            return 'Made no retries'
+        causes = ', '.join('{} x {}'.format(cause, count)
+                           for (cause, count) in sorted(self.causes.items()))
+        return 'Made {} retr{} ({})'.format(
+            self.retries, 'y' if self.retries == 1 else 'ies', causes)
+
+
+    def _spend(self, err):
+        # Returns False if the budget is used up.
+        with self._lock:
+            if self.retries >= self.budget:
+                if __debug__: log('retry budget of {} used up', self.budget)
+                return False
+            self.retries += 1
+            cause = str(err.status) if isinstance(err, ServerError) else type(err).__name__
+            self.causes[cause] = self.causes.get(cause, 0) + 1
+            return True
+
+
+    def _delay(self, attempt, err):
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        # "Full jitter": anywhere between nothing and the exponential delay,
+        # but never sooner than the server asked us to wait.
+        delay = uniform(0, delay)
+        if isinstance(err, ServerError) and err.retry_after:
+            delay = max(delay, min(self.max_delay, err.retry_after))
+        return delay
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def retryable(err):
+    '''Return True if the exception 'err' indicates a failure that may go
+    away if the request is tried again.  HTTP 429 and 5xx responses are
+    retryable; redirections and other 4xx responses are not.'''
+    if isinstance(err, ServerError):
+        return err.status == 429 or err.status >= 500
+    return isinstance(err, _RETRYABLE_ERRORS)
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,219 @@
+'''
+rewrites.py: rewriting final URLs that are known to hide the real destination.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   functools import lru_cache
+import json
+import os
+from   os import path
+import re
+import sys
+from   threading import Lock
+from   urllib.parse import unquote, urlsplit
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+
+import turf
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('rewrites: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+RULES_FILE = path.join(path.dirname(path.abspath(__file__)), 'data', 'rewrite-rules.json')
+'''The rewrite rules shipped with Turf.'''
+
+htmlCodes = (
+    (r'&amp;', '&'),
+    (r'&#39;', "'"),
+    (r'&quot;', '"'),
+    (r'&gt;', '>'),
+    (r'&lt;', '<'),
+    (r'%2B', '+'),
+    (r'%2C', ','),
+    (r'%2F', '/'),
+    (r'%20', ' '),
+    (r'%3A', ':'),
+    (r'%3D', '='),
+    (r'%3F', '?'),
+)
+'''HTML character entities and percent-encoded characters undone by
+decoded_html().'''
+
+
+# Class definitions.
+# .............................................................................
+
+class RewriteRules():
+    '''Rewrite the final URLs of UrlData results that lead to pages known to
+    hide the real destination in the URL, such as a vendor's maintenance
+    page with the address of the item in a query parameter.
+
+    Each rule is a dict with the following keys: 'name', a description of
+    the rule; 'host', the host name (or domain) of the final URLs the rule
+    applies to, or "*" for any host; 'pattern', a regular expression that
+    must match the beginning of the final URL; 'group', the number of the
+    group in the pattern that holds the real destination (default: 1); and
+    'decode', the decoding to apply to it, one of "html" (see decoded_html()),
+    "url" (undo all percent-encoding) or "none" (the default).  The patterns
+    are compiled once, and each URL is only tested against the rules for
+    its host and the domains above it (and the rules for any host), in the
+    order they were given.  The first rule that matches is used.  The
+    number of URLs rewritten by each rule is counted.
+    '''
+
+    def __init__(self, rules = []):
+        self.rewrites = 0
+        self._rules = [_Rule(spec, index) for (index, spec) in enumerate(rules)]
+        # Rules by host or domain, and rules for any host.
+        self._by_host = {}
+        self._any_host = []
+        for rule in self._rules:
+            if rule.host == '*':
+                self._any_host.append(rule)
+            else:
+                self._by_host.setdefault(rule.host, []).append(rule)
+        self._lock = Lock()
+
+
+    @classmethod
+    def load(cls, file = None):
+        '''Read the rules from the JSON file 'file' (by default, RULES_FILE)
+        and return a new RewriteRules object.  Raises ValueError if the file
+        content is not a list of valid rules.'''
+        file = file or RULES_FILE
+        if __debug__: log('reading rules from {}', file)
+        with open(file, 'r') as f:
+            try:
+                content = json.load(f)
+            except json.JSONDecodeError as err:
+                raise ValueError('{} is not valid JSON: {}'.format(file, err))
+        if not isinstance(content, list):
+            raise ValueError('{} does not contain a list of rules'.format(file))
+        return cls(content)
+
+
+    def rewritten(self, url_data):
+        '''Return 'url_data', with its final URL replaced by the destination
+        extracted from it by the first rule that matches it, if any.'''
+        if not url_data.final:
+            return url_data
+        for rule in self._candidates(url_data.final):
+            content_match = rule.regexp.match(url_data.final)
+            if content_match:
+                with self._lock:
+                    rule.hits += 1
+                    self.rewrites += 1
+                destination = rule.decode(content_match.group(rule.group))
+                return UrlData(url_data.original, destination,
+                               url_data.status, url_data.error)
+        return url_data
+
+
+    def recognized(self, url):
+        '''Return True if a rule would rewrite the URL 'url'.'''
+        return any(rule.regexp.match(url) for rule in self._candidates(url))
+
+
+    def hits(self):
+        '''Return a list of tuples of (rule name, number of URLs rewritten),
+        in the order the rules were given.'''
+        with self._lock:
+            return [(rule.name, rule.hits) for rule in self._rules]
+
+
+    def summary(self):
+        '''Return a short text summary of the rewriting done.'''
+        used = sum(1 for (_, hits) in self.hits() if hits > 0)
+        return 'Rewrote {} final URL{} using {} of {} rewrite rule{}'.format(
+            self.rewrites, '' if self.rewrites == 1 else 's', used,
+            len(self._rules), '' if len(self._rules) == 1 else 's')
+
+
+    def _candidates(self, url):
+        # Returns the rules that may apply to 'url', in the order given.
+        try:
+            host = (urlsplit(url).hostname or '').lower()
+        except ValueError:
+            return []
+        rules = []
+        while host:
+            rules += self._by_host.get(host, [])
+            host = host.partition('.')[2]
+        if not rules:
+            return self._any_host
+        return sorted(rules + self._any_host, key = lambda rule: rule.index)
+
+
+class _Rule():
+    def __init__(self, spec, index):
+        try:
+            self.name = spec.get('name', 'rule {}'.format(index + 1))
+            self.host = spec.get('host', '*').lower()
+            self.regexp = re.compile(spec['pattern'])
+            self.group = spec.get('group', 1)
+            self.decode = _DECODERS[spec.get('decode', 'none')]
+        except (AttributeError, KeyError, TypeError, re.error):
+            raise ValueError('Bad rewrite rule {}: {}'.format(index + 1, spec))
+        if not isinstance(self.group, int) or not 0 <= self.group <= self.regexp.groups:
+            raise ValueError('Bad group number in rewrite rule {}: {}'.format(
+                index + 1, spec))
+        self.index = index
+        self.hits = 0
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def decoded_html(s):
+    for code in htmlCodes:
+        s = s.replace(code[0], code[1])
+    return s
+
+
+@lru_cache(maxsize = None)
+def shipped_rules():
+    '''Return a RewriteRules object for the rules shipped with Turf.'''
+    return RewriteRules.load()
+
+
+_DECODERS = {
+    'html' : decoded_html,
+    'url'  : unquote,
+    'none' : lambda s: s,
+}
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
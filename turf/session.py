@@ -0,0 +1,283 @@
+'''
+session.py: one proxy login session shared by all URL checks in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import getpass
+from   http.cookiejar import LWPCookieJar, LoadError
+import os
+from   os import path
+import requests
+import sys
+from   threading import Lock
+from   time import sleep, time
+from   urllib.parse import urlsplit
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+from urlup.credentials import get_credentials, save_credentials, obtain_credentials
+from urlup.urlup import normalized_url
+
+import turf
+from turf.page_cache import cache_dir
+from turf.status import url_data, MALFORMED_URL, CONNECT_TIMEOUT, UNRESOLVABLE_URL
+from turf.status import PROXY_LOGIN_FAILURE
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('session: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_KEYRING = 'org.caltechlibrary.urlup'
+'''Keyring entry holding the proxy credentials.  It's the one Urlup uses, so
+that credentials stored by either program work for both.'''
+
+_NETWORK_TIMEOUT = 10
+'''How long to wait on a network connection attempt or a response.'''
+
+_MAX_ATTEMPTS = 3
+'''Number of times we try a URL if something unexpected goes wrong.'''
+
+_RETRY_DELAY = 2
+'''Seconds to wait before trying a URL again.  It doubles after each try.'''
+
+_LOGIN_COOLDOWN = 60
+'''Seconds during which proxied URLs are not tried after all the attempts to
+log in to the proxy failed because of network errors.  After that, logging
+in is tried again.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class ProxySession():
+    '''Dereference URLs that go through an EZproxy server, logging in to the
+    proxy only once for all of them.
+
+    The credentials are obtained (from 'proxyinfo', the keyring, or the
+    user, as Urlup does) when the first proxied URL is checked, and the
+    cookies from logging in are kept in a cookie jar shared by all checks,
+    together with the 'cookies' (a dict) to be sent to every host.  The
+    'headers' are sent with every request.  If a check ends up on the
+    proxy's login page, the session has expired; Turf then logs in again
+    and repeats the check.  A login that fails because of a network error
+    is tried again a few times, and if it still fails, again after a while;
+    a login rejected by the proxy is not tried again.  If given a 'file' name, the cookie jar is read
+    from that file, if it exists, and written to it by close(), so that
+    the next run can use the same session.  The object can be used from
+    several threads.
+    '''
+
+    def __init__(self, proxyinfo, headers = {}, cookies = {}, file = None):
+        self.proxyinfo = proxyinfo
+        self.file = file
+        self.requests = 0
+        self.logins = 0
+        self._credentials = None
+        self._failed = False
+        # Time before which we don't try logging in again, or None.
+        self._retry_time = None
+        self._lock = Lock()
+        # Number of logins to each proxy host done in this session.
+        self._generation = {}
+        self._session = requests.Session()
+        self._session.headers.update(headers)
+        self._session.cookies = LWPCookieJar()
+        if file and path.exists(file):
+            try:
+                self._session.cookies.load(file, ignore_discard = True)
+                if __debug__: log('loaded cookies from {}', file)
+            except (LoadError, OSError) as err:
+                if __debug__: log('ignoring {}: {}', file, err)
+        requests.utils.add_dict_to_cookiejar(self._session.cookies, cookies)
+
+
+    def checked_url(self, url):
+        '''Return a UrlData named tuple for the proxied URL 'url'.'''
+        url = url.strip()
+        delay = _RETRY_DELAY
+        for attempt in range(1, _MAX_ATTEMPTS + 1):
+            try:
+                return self._analysis(url)
+            except requests.exceptions.ConnectTimeout:
+                return UrlData(url, None, None, CONNECT_TIMEOUT)
+            except _LoginFailure as err:
+                if __debug__: log('proxy login failed: {}', err)
+                return UrlData(url, None, None, PROXY_LOGIN_FAILURE)
+            except Exception as err:
+                if __debug__: log('{}: {}', url, err)
+                if attempt < _MAX_ATTEMPTS:
+                    sleep(delay)
+                    delay *= 2
+        return UrlData(url, None, None, UNRESOLVABLE_URL)
+
+
+    def close(self):
+        '''Save the cookie jar, if given a file name, and close connections.'''
+        self._session.close()
+        if self.file and self.logins > 0:
+            if __debug__: log('saving cookies to {}', self.file)
+            os.makedirs(path.dirname(path.abspath(self.file)), exist_ok = True)
+            self._session.cookies.save(self.file, ignore_discard = True)
+            os.chmod(self.file, 0o600)
+
+
+    def summary(self):
+        '''Return a short text summary of the proxy session.'''
+        return 'Logged in to the proxy {} time{} for {} requests through it'.format(
+            self.logins, '' if self.logins == 1 else 's', self.requests)
+
+
+    def _analysis(self, url):
+        start = normalized_url(url)
+        if not start:
+            return UrlData(url, None, None, MALFORMED_URL)
+        proxy = _proxy_host(start)
+        generation = self._generation.get(proxy, 0)
+        if generation == 0 and not self._has_cookies(proxy):
+            generation = self._login(proxy, generation)
+        (code, final) = self._response(start)
+        if _login_page(final, proxy):
+            if __debug__: log('session for {} has expired', proxy)
+            self._login(proxy, generation)
+            (code, final) = self._response(start)
+            if _login_page(final, proxy):
+                raise _LoginFailure('still sent to the login page after logging in')
+        if code == 202:
+            # Code 202 = Accepted, "received but not yet acted upon."
+            # Like Urlup, pause, try again, but report the first code.
+            sleep(1)
+            (_, final) = self._response(start)
+        return url_data(url, final, code)
+
+
+    def _response(self, url):
+        # Returns the status code and the URL at the end of the redirections.
+        # Only the headers of the last response are read.
+        with self._lock:
+            self.requests += 1
+        response = self._session.get(url, timeout = _NETWORK_TIMEOUT, stream = True)
+        response.close()
+        return (response.status_code, response.url)
+
+
+    def _login(self, proxy, generation):
+        # Logs in to 'proxy', unless another thread did since 'generation'
+        # was current.  Returns the new generation.
+        with self._lock:
+            if self._generation.get(proxy, 0) != generation:
+                return self._generation[proxy]
+            if self._failed:
+                raise _LoginFailure('an earlier login was rejected')
+            if self._retry_time and time() < self._retry_time:
+                raise _LoginFailure('an earlier login failed; will try again later')
+            (user, pswd) = self._user_and_password()
+            delay = _RETRY_DELAY
+            for attempt in range(1, _MAX_ATTEMPTS + 1):
+                if __debug__: log('logging in to {} as {}', proxy, user)
+                try:
+                    response = self._session.post(proxy + '/login',
+                                                  data = {'user': user, 'pass': pswd},
+                                                  allow_redirects = False,
+                                                  timeout = _NETWORK_TIMEOUT)
+                    break
+                except requests.exceptions.RequestException as err:
+                    if __debug__: log('login attempt {} failed: {}', attempt, err)
+                    if attempt == _MAX_ATTEMPTS:
+                        self._retry_time = time() + _LOGIN_COOLDOWN
+                        raise _LoginFailure(str(err))
+                    sleep(delay)
+                    delay *= 2
+            self._retry_time = None
+            self.logins += 1
+            # Like Urlup, take the lack of cookies to mean the login failed.
+            if not response.cookies or not 200 <= response.status_code <= 400:
+                self._failed = True
+                raise _LoginFailure('login rejected with code {}'.format(
+                    response.status_code))
+            self._generation[proxy] = generation + 1
+            return generation + 1
+
+
+    def _user_and_password(self):
+        # Returns the proxy credentials, asking for them only the first time.
+        if self._credentials:
+            return self._credentials
+        info = self.proxyinfo
+        (user, pswd) = (info.user, info.password)
+        if not user or not pswd or info.reset:
+            if info.use_keyring and not info.reset:
+                (user, pswd, _, _) = obtain_credentials(_KEYRING, 'Proxy login',
+                                                        user, pswd)
+            else:
+                user = input('Proxy login: ')
+                pswd = getpass.getpass('Password for "{}": '.format(user))
+        if info.use_keyring:
+            (s_user, s_pswd, _, _) = get_credentials(_KEYRING)
+            if (s_user, s_pswd) != (user, pswd):
+                if __debug__: log('saving credentials to keyring')
+                save_credentials(_KEYRING, user, pswd)
+        info.reset = False
+        self._credentials = (user, pswd)
+        return self._credentials
+
+
+    def _has_cookies(self, proxy):
+        host = urlsplit(proxy).hostname
+        return any(cookie.domain and host.endswith(cookie.domain.lstrip('.'))
+                   for cookie in self._session.cookies)
+
+
+class _LoginFailure(Exception):
+    pass
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def session_file():
+    '''Return the file where the proxy session is kept between runs.'''
+    return path.join(cache_dir(), 'proxy-session.txt')
+
+
+def _proxy_host(url):
+    # Returns the scheme and host part of a proxied URL.
+    parts = urlsplit(url)
+    return '{}://{}'.format(parts.scheme, parts.netloc)
+
+
+def _login_page(url, proxy):
+    return url.startswith(proxy + '/login')
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
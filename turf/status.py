@@ -0,0 +1,89 @@
+'''
+status.py: interpretation of the outcomes of dereferencing URLs in Turf.
+
+The messages and the grouping of HTTP status codes follow those of Urlup, so
+that results obtained by Turf's own URL checking code can't be told apart
+from results obtained through Urlup.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import os
+import sys
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+
+import turf
+
+
+# Global constants.
+# .............................................................................
+
+# Messages for failures that don't come with an HTTP status code.
+
+MALFORMED_URL      = 'Malformed URL'
+CONNECT_TIMEOUT    = 'Timed out trying to connect'
+UNKNOWN_HOST       = 'Cannot resolve host name'
+UNKNOWN_PROTOCOL   = 'Unsupported network protocol'
+BAD_PORT           = 'Bad port'
+UNRESOLVABLE_URL   = 'Unable to resolve URL'
+HOST_UNAVAILABLE   = 'Host is unavailable -- not tried after repeated failures'
+PROXY_LOGIN_FAILURE = 'Proxy login failure'
+DEADLINE_EXCEEDED  = 'Took too long to resolve'
+
+
+# Main functions.
+# .............................................................................
+
+def status_error(code):
+    '''Return the error message for HTTP status code 'code', or None if the
+    code indicates success (which includes redirection).'''
+    if 200 <= code < 400:
+        return None
+    elif code in [401, 402, 403, 407, 451, 511]:
+        return 'Access is forbidden or requires authentication'
+    elif code in [404, 410]:
+        return 'No content found at this location'
+    elif code in [405, 406, 409, 411, 412, 414, 417, 428, 431, 505, 510]:
+        return 'Server returned code {} -- please report this'.format(code)
+    elif code in [415, 416]:
+        return 'Server rejected the request'
+    elif code == 429:
+        return 'Server blocking further requests due to rate limits'
+    elif code == 503:
+        return 'Server is unavailable -- try again later'
+    elif code in [500, 501, 502, 506, 507, 508]:
+        return 'Internal server error'
+    else:
+        return UNRESOLVABLE_URL
+
+
+def url_data(url, final, code):
+    '''Return a UrlData named tuple for the URL 'url', given the URL at the
+    end of any redirections and the first HTTP status code received.'''
+    error = status_error(code)
+    return UrlData(url, None if error else final, code, error)
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -0,0 +1,313 @@
+'''
+timing.py: deadlines, hedged requests and latency statistics for URL checks.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+from   array import array
+import asyncio
+from   collections import deque
+from   concurrent.futures import Future, as_completed, TimeoutError
+import os
+import sys
+from   threading import Lock, Thread
+from   time import time
+from   urllib.parse import urlsplit
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+
+import turf
+from turf.errors import RecordDeadline
+from turf.status import DEADLINE_EXCEEDED
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('timing: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_HOST_SAMPLES = 100
+'''Number of recent check times kept for each host to estimate its p95.'''
+
+_MIN_SAMPLES = 20
+'''Number of check times needed for a host before any check on it is hedged.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class CheckTimer():
+    '''Put time limits on URL checks and keep statistics about how long
+    they take.
+
+    A check given to timed() (from threads) or async_timed() (from
+    coroutines) is given up on after 'url_deadline' seconds, and the result
+    says so; this counts against the URL's host like any other timeout.  If
+    'record_deadline' seconds from the time the record was started pass
+    first, RecordDeadline is raised instead, because that says nothing about
+    the URL and the result must not be used for other records.  Either
+    deadline can be None for no limit.  In the threads engine, a check given
+    up on keeps running in the background until it ends, but its result is
+    not used.
+
+    If 'hedge' is True, hedged() and async_hedged() start a second copy of
+    an attempt to check a URL once the first has taken longer than 95% of
+    recent checks on the same host, and use whichever finishes first.
+    '''
+
+    def __init__(self, url_deadline = None, record_deadline = None, hedge = False):
+        self.url_deadline = url_deadline
+        self.record_deadline = record_deadline
+        self.hedge = hedge
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.misses = 0
+        self.record_misses = 0
+        self._times = array('d')
+        self._host_times = {}
+        self._lock = Lock()
+
+
+    def out_of_time(self, record_began):
+        '''Return True if the time allowed for the record started at the
+        time 'record_began' has run out.'''
+        (timeout, for_record) = self._limit(record_began)
+        return for_record and timeout <= 0
+
+
+    def timed(self, url, check, record_began, release = None):
+        '''Return the result of calling the function 'check' on 'url', or a
+        UrlData result with an error if it takes longer than the URL deadline.
+        Raises RecordDeadline if the time allowed for the record started at
+        'record_began' runs out first.  If given, the function 'release' is
+        called once 'check' has returned, even if it was given up on; the
+        caller can use it to hold on to resources until the check is over.'''
+        (timeout, for_record) = self._limit(record_began)
+        if for_record and timeout <= 0:
+            if release:
+                release()
+            raise self._out_of_time(url)
+        began = time()
+        if timeout is None:
+            try:
+                result = check(url)
+            finally:
+                if release:
+                    release()
+        else:
+            try:
+                result = _started(check, url, release).result(timeout = timeout)
+            except TimeoutError:
+                if for_record:
+                    raise self._out_of_time(url)
+                result = self._missed(url, timeout)
+        self._note(url, time() - began)
+        return result
+
+
+    async def async_timed(self, url, check, record_began):
+        '''Like timed(), but for use in coroutines; 'check' must be a
+        coroutine function.  A check given up on is cancelled.'''
+        (timeout, for_record) = self._limit(record_began)
+        if for_record and timeout <= 0:
+            raise self._out_of_time(url)
+        began = time()
+        try:
+            result = await asyncio.wait_for(check(url), timeout)
+        except asyncio.TimeoutError:
+            if for_record:
+                raise self._out_of_time(url)
+            result = self._missed(url, timeout)
+        self._note(url, time() - began)
+        return result
+
+
+    def hedged(self, url, attempt):
+        '''Return the result of calling the function 'attempt' on 'url',
+        hedging if that takes too long.'''
+        delay = self._hedge_delay(url)
+        if delay is None:
+            return attempt(url)
+        first = _started(attempt, url)
+        try:
+            return first.result(timeout = delay)
+        except TimeoutError:
+            pass
+        second = _started(attempt, url)
+        self._count_hedge(url, delay)
+        for future in as_completed([first, second]):
+            if future.exception() is None:
+                if future is second:
+                    self._count_win()
+                return future.result()
+        return first.result()
+
+
+    async def async_hedged(self, url, attempt):
+        '''Like hedged(), but for use in coroutines; 'attempt' must be a
+        coroutine function.'''
+        delay = self._hedge_delay(url)
+        if delay is None:
+            return await attempt(url)
+        first = asyncio.ensure_future(attempt(url))
+        (done, _) = await asyncio.wait([first], timeout = delay)
+        if done:
+            return first.result()
+        second = asyncio.ensure_future(attempt(url))
+        self._count_hedge(url, delay)
+        try:
+            for next_done in asyncio.as_completed([first, second]):
+                try:
+                    result = await next_done
+                except Exception:
+                    continue
+                if second.done() and not first.done():
+                    self._count_win()
+                return result
+            return first.result()
+        finally:
+            first.cancel()
+            second.cancel()
+
+
+    def summary(self):
+        '''Return a short text summary of how long checks took.'''
+        with self._lock:
+            times = sorted(self._times)
+        if not times:
+            return 'Timed no URL checks'
+        text = 'URL checks took {:.2f}s (median), {:.2f}s (p95), {:.2f}s (p99), {:.2f}s (max)'.format(
+            _percentile(times, 50), _percentile(times, 95), _percentile(times, 99),
+            times[-1])
+        if self.url_deadline:
+            text += '; gave up on {} for taking too long'.format(self.misses)
+        if self.record_deadline:
+            text += '; {} left unchecked when their record ran out of time'.format(
+                self.record_misses)
+        if self.hedge:
+            text += '; hedged {} (second request won {})'.format(self.hedges, self.hedge_wins)
+        return text
+
+
+    def _limit(self, record_began):
+        # Returns how long the next check of a record started at the time
+        # 'record_began' may take (None for no limit), and True if that is
+        # set by the record deadline rather than the URL deadline.
+        if self.record_deadline:
+            left = self.record_deadline - (time() - record_began)
+            if not self.url_deadline or left < self.url_deadline:
+                return (max(0, left), True)
+        return (self.url_deadline, False)
+
+
+    def _out_of_time(self, url):
+        if __debug__: log('record ran out of time before {} was done', url)
+        with self._lock:
+            self.record_misses += 1
+        return RecordDeadline(url)
+
+
+    def _missed(self, url, timeout):
+        if __debug__: log('gave up on {} after {:.1f}s', url, timeout)
+        with self._lock:
+            self.misses += 1
+        return UrlData(url.strip(), None, None, DEADLINE_EXCEEDED)
+
+
+    def _note(self, url, duration):
+        host = _host(url)
+        with self._lock:
+            self._times.append(duration)
+            if host not in self._host_times:
+                self._host_times[host] = deque(maxlen = _HOST_SAMPLES)
+            self._host_times[host].append(duration)
+
+
+    def _hedge_delay(self, url):
+        # Returns the time after which a check of 'url' should be hedged, or
+        # None if it shouldn't be.
+        if not self.hedge:
+            return None
+        with self._lock:
+            times = self._host_times.get(_host(url))
+            if not times or len(times) < _MIN_SAMPLES:
+                return None
+            return _percentile(sorted(times), 95)
+
+
+    def _count_hedge(self, url, delay):
+        if __debug__: log('hedging {} after {:.2f}s', url, delay)
+        with self._lock:
+            self.hedges += 1
+
+
+    def _count_win(self):
+        with self._lock:
+            self.hedge_wins += 1
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _started(function, url, release = None):
+    # Calls 'function' on 'url' in a new daemon thread and returns a
+    # concurrent.futures.Future object for the result.  A thread that is
+    # given up on can thus be left to finish without holding anything up.
+    # If given, 'release' is called in the thread when 'function' returns.
+    future = Future()
+    def run():
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(function(url))
+            except BaseException as err:
+                future.set_exception(err)
+        finally:
+            if release:
+                release()
+    Thread(target = run, daemon = True).start()
+    return future
+
+
+def _host(url):
+    try:
+        return (urlsplit(url.strip()).hostname or '').lower()
+    except ValueError:
+        return ''
+
+
+def _percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -13,18 +13,22 @@ Copyright (c) 2018 by the California Institute of Technology.  This code is
 open-source software.  Please see the file "LICENSE" for more information.
 '''
 
+import asyncio
+import gzip
 from   collections import namedtuple
+from   contextlib import ExitStack
+from   functools import partial
 import http.client
 from   http.client import responses as http_responses
-from   itertools import zip_longest
+from   itertools import islice, zip_longest
+import lzma
 import os
 import plac
 import re
 import sys
 from   time import time, sleep
-from   urllib.parse import urlsplit
+from   urllib.parse import urlsplit, urlunsplit
 import urllib.request
-from   xml.etree import ElementTree
 
 try:
     thisdir = os.path.dirname(os.path.abspath(__file__))
@@ -36,7 +40,29 @@ from urlup import updated_urls, UrlData
 
 import turf
 from turf.messages import color, msg
-from turf.data_types import TindData, ProxyInfo, UIsettings
+from turf.async_engine import AsyncUrlEngine, AsyncUrlChecker, ThreadedEngineChecker
+from turf.checker import UrlChecker
+from turf.chunks import parsed_in_parallel
+from turf.data_types import TindData, TindRecord, ProxyInfo, UIsettings, FetchSettings
+from turf.data_types import CheckSettings
+from turf.breaker import CircuitBreaker
+from turf.dedup import UrlDeduplicator
+from turf.errors import ServerError, HostUnavailable, RecordDeadline
+from turf.hosts import HostScheduler
+from turf.marc21 import marc21_records, mapped_marc21_records
+from turf.marcxml import MARC_RECORD, marc_records
+from turf.network import ConnectionPool
+from turf.pacing import AdaptivePacer
+from turf.page_cache import PageCache, CopyingReader
+from turf.partitions import PartitionFetcher, partitioned
+from turf.prefetch import PagePrefetcher
+from turf.redirects import RedirectLearner
+from turf.retry import Retrier
+from turf.rewrites import htmlCodes, decoded_html, shipped_rules, RewriteRules
+from turf.session import ProxySession, session_file
+from turf.timing import CheckTimer
+from turf.status import HOST_UNAVAILABLE, DEADLINE_EXCEEDED
+from turf.url_cache import UrlCache
 
 # NOTE: to turn on debugging, make sure python -O was *not* used to start
 # python, then set the logging level to DEBUG *before* loading this module.
@@ -53,9 +79,14 @@ if __debug__:
 # .............................................................................
 
 _FETCH_COUNT = 100
-'''How many entries to get at one time from caltech.tind.io.  Smaller batches
-make it possible to write out results more reliably as we run, at the cost of
-some speed.'''
+'''How many entries to get at one time from caltech.tind.io when starting out.
+Smaller batches make it possible to write out results more reliably as we
+run, at the cost of some speed.  The number is adjusted as we go along,
+within the bounds set by FetchSettings, depending on how the server responds.'''
+
+_FETCH_DELAY = 0.5
+'''How long to pause between requests to caltech.tind.io when starting out.
+Like the page size, this is adjusted as we go along.'''
 
 _NETWORK_TIMEOUT = 15
 '''How long to wait on a network connection attempt.'''
@@ -71,6 +102,29 @@ something is going wrong.'''
 _SESSION_COOKIE = 'EBSESSIONID=92991f926e3b4796a115da4505a01cfc'
 '''Session cookie needed by EDS online API.'''
 
+_FILE_FORMATS = {'.xml': 'xml', '.mrc': 'marc21', '.marc': 'marc21'}
+'''Formats of input files, by name extension.'''
+
+_DECOMPRESSORS = {'.gz': gzip.open, '.xz': lzma.open}
+'''Functions for opening compressed input files, by name extension.'''
+
+_SLIM_FIELDS = '001,856'
+'''The only MARC fields we need: the record id and the URLs.  In slim mode,
+only these are requested from the server.'''
+
+# Setting the user agent is because Proquest.com returns a 403 otherwise,
+# possibly as an attempt to block automated scraping.  Changing the user
+# agent to a browser name seems to solve it.
+_URL_HEADERS = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X x.y; rv:42.0)'}
+'''HTTP headers sent when dereferencing URLs.'''
+
+# This next thing is a hack that makes ebscohost think we're logged in.  It's
+# the only way I found so far to avoid the occasional "upcoming maintenance"
+# announcement click-through pages.
+_URL_COOKIES = {'EBSESSIONID': '79e365c204f844af99f26dd45fedf6e1',
+                'EBUQUSER': '79e365c204f844af99f26dd45fedf6e1'}
+'''Cookies sent when dereferencing URLs.'''
+
 #_EDS_ROOT_URL = 'http://web.b.ebscohost.com/pfi/detail/detail?vid=4&bdata=JnNjb3BlPXNpdGU%3d#'
 _EDS_ROOT_URL = 'http://eds.a.ebscohost.com/eds/detail/detail?vid=0&bdata=JnNpdGU9ZWRzLWxpdmUmc2NvcGU9c2l0ZQ%3d%3d#'
 
@@ -81,12 +135,20 @@ _EDS_ROOT_URL = 'http://eds.a.ebscohost.com/eds/detail/detail?vid=0&bdata=JnNpdG
 # field 001 is the tind record number
 # field 856 is a URL, if there is one
 
-def entries_from_search(search, max_records, start_index, proxyinfo, uisettings):
-    # Get results in batches of a certain number of records.
-    if max_records and max_records < _FETCH_COUNT:
-        search = substituted(search, '&rg=', '&rg=' + str(max_records))
-    else:
-        search = substituted(search, '&rg=', '&rg=' + str(_FETCH_COUNT))
+def entries_from_search(search, max_records, start_index, proxyinfo, uisettings,
+                        fetchsettings = None, checkpoint = None, checksettings = None):
+    # If given a Checkpoint object, our progress is recorded in it as we go.
+    # If the checkpoint comes from an earlier run, the records it has seen
+    # are taken into account.
+    fetchsettings = fetchsettings or FetchSettings()
+    checksettings = checksettings or CheckSettings()
+    # Get results in batches of a certain number of records.  The number is
+    # adjusted as we go, as is the pause between requests.
+    (min_size, max_size) = fetchsettings.page_sizes
+    if max_records and max_records < max_size:
+        max_size = max(min_size, max_records)
+    pacer = AdaptivePacer(_FETCH_COUNT, _FETCH_DELAY, (min_size, max_size),
+                          fetchsettings.delays)
     # Substitute the output format to be MARCXML.
     search = substituted(search, '&of=', '&of=xm')
     # Remove any 'ot' field because it screws up results.
@@ -100,24 +162,68 @@ def entries_from_search(search, max_records, start_index, proxyinfo, uisettings)
     # The tind.io output doesn't include the number of records available.  So,
     # when iterating over all results, we must do something ourselves to avoid
     # fetching the last page over and over.  We watch for entries we've seen.
-    seen = set()
+    seen = checkpoint.seen if checkpoint else set()
     # Sometimes the server stops returning values.  Unclear why, but when it
     # happens we may as well stop.  We track it using this variable:
     consecutive_nulls = 0
-    while 0 < current < stop and consecutive_nulls < _MAX_NULLS:
+    # Reuse the same connection(s) to the server for every page we fetch, and
+    # fetch the next pages in the background while we work on the current one.
+    # Requests that fail for reasons that may be temporary are tried again,
+    # within limits, instead of ending the whole run.
+    pool = ConnectionPool(timeout = _NETWORK_TIMEOUT)
+    retrier = Retrier(budget = fetchsettings.retries)
+    partition_size = fetchsettings.partition_size
+    cache = None
+    if fetchsettings.cache_ttl is not None:
+        cache = PageCache(ttl = fetchsettings.cache_ttl, refresh = fetchsettings.refresh)
+    # The URLs of several records are checked at the same time, possibly
+    # spanning pages, but we get the results back in the original order.
+    (checker, check, hosts, breaker, dedup, redirects, timer, rewrites,
+     url_cache, session) = _record_checker(
+        checksettings, proxyinfo, lambda item: item[1])
+    prefetcher = None
+    interrupted = False
+    try:
         try:
-            marcxml = tind_records(search, current, proxyinfo)
-            if not marcxml:
-                if __debug__: log('no records received')
-                current = -1
-                consecutive_nulls += 1
-                break
-            if __debug__: log('looping over {} TIND records', len(marcxml))
-            for data in _extracted_data(marcxml, proxyinfo):
+            if fetchsettings.slim:
+                # Only ask for the fields we use, but make sure that gives the
+                # same results.  (The server's handling of 'ot' has been
+                # unreliable.)
+                slim_search = substituted(search, '&ot=', '&ot=' + _SLIM_FIELDS)
+                if _same_results(search, slim_search, current, pacer.page_size,
+                                 proxyinfo, pool):
+                    if __debug__: log('using slim query string: {}', slim_search)
+                    search = slim_search
+                else:
+                    msg('Fetching only fields {} gives different results -- '
+                        'fetching whole records'.format(_SLIM_FIELDS),
+                        'warn', uisettings.colorize)
+            if partition_size:
+                # Fetch ranges of record ids separately, each from its
+                # beginning, so that the server never has to skip to a deep
+                # offset in the results.
+                highest = retrier.call(_highest_recid, search, proxyinfo, pool)
+                if __debug__: log('highest record id is {}', highest)
+                fetch = lambda query, start, size: _fetched_page(
+                    query, start, proxyinfo, pool, pacer, cache, size, retrier)
+                partitions = partitioned(search, highest, partition_size)
+                prefetcher = PartitionFetcher(fetch, partitions,
+                                              lambda: pacer.page_size, current,
+                                              depth = fetchsettings.prefetch,
+                                              delay = pacer.pause)
+            else:
+                fetch = lambda start: _fetched_page(search, start, proxyinfo, pool, pacer,
+                                                    cache, retrier = retrier)
+                prefetcher = PagePrefetcher(fetch, len, current,
+                                            depth = fetchsettings.prefetch,
+                                            delay = pacer.pause)
+            pages = prefetcher.pages()
+            numbered = _numbered_records(pages)
+            for ((current, record, first), data) in checker.map(check, numbered):
+                if first and consecutive_nulls >= _MAX_NULLS:
+                    break
                 if data.id in seen:
                     stop = 0
-                else:
-                    seen.add(data.id)
                 if not data.url_data:
                     consecutive_nulls += 1
                 else:
@@ -125,36 +231,103 @@ def entries_from_search(search, max_records, start_index, proxyinfo, uisettings)
                 if not uisettings.quiet:
                     print_record(current, data, uisettings.colorize)
                 yield data
+                # Only now has the consumer written out the results for this
+                # record, so only now may it count as done in the checkpoint.
+                if checkpoint:
+                    checkpoint.update(current + 1, data.id)
+                else:
+                    seen.add(data.id)
                 if current >= stop:
                     break
                 current += 1
-                if proxyinfo.reset:
-                    # Don't keep resetting the credentials.
-                    proxyinfo.reset = False
+            else:
+                if partition_size:
+                    if __debug__: log('all partitions done')
+                    stop = 0
+                else:
+                    if __debug__: log('no records received')
+                    current = -1
+                    consecutive_nulls += 1
         except KeyboardInterrupt:
             msg('Stopped', 'warn', uisettings.colorize)
             current = -1
+            interrupted = True
         except Exception as err:
             msg('Error: {}'.format(err), 'error', uisettings.colorize)
             current = -1
-        sleep(0.5)                      # Be nice to the server.
-    if current >= stop and consecutive_nulls < _MAX_NULLS:
+            interrupted = True
+    finally:
+        retrier.cancel()
+        if prefetcher:
+            prefetcher.stop()
+        pool.close()
+        if checkpoint:
+            checkpoint.save()
+        if __debug__ and prefetcher: log(prefetcher.summary())
+        if __debug__: log(checker.summary())
+        if __debug__: log(hosts.summary())
+        if __debug__: log(breaker.summary())
+        if __debug__: log(dedup.summary())
+        if __debug__: log(redirects.summary())
+        if __debug__: log(timer.summary())
+        if __debug__: log(rewrites.summary())
+        if __debug__: log('rewrite rule hits: {}', rewrites.hits())
+        if checksettings.rules_file:
+            redirects.save(checksettings.rules_file)
+        session.close()
+        if __debug__: log(session.summary())
+        if __debug__ and checksettings.head_first: log(checker.engine.summary())
+        if url_cache:
+            url_cache.close()
+            if __debug__: log(url_cache.summary())
+        if __debug__: log(pacer.summary())
+        if __debug__: log(retrier.summary())
+        if __debug__: log(pool.summary())
+        if __debug__: log(pool.transfer.summary())
+        if __debug__ and cache: log(cache.summary())
+    if current >= stop:
         if __debug__: log('stopping point reached')
-        if not uisettings.quiet:
-            msg('Processed {} entries'.format(len(seen)), 'info', uisettings.colorize)
-    elif consecutive_nulls >= _MAX_NULLS:
+    if not interrupted and not uisettings.quiet:
+        # The search ended by itself: report what it took, however it ended.
+        msg('Processed {} entries'.format(len(seen)), 'info', uisettings.colorize)
+        if prefetcher:
+            msg(prefetcher.summary(), 'info', uisettings.colorize)
+        _report_checks(uisettings, checksettings, checker, hosts, breaker, dedup,
+                       redirects, timer, rewrites, url_cache, session)
+        msg(pacer.summary(), 'info', uisettings.colorize)
+        msg(retrier.summary(), 'info', uisettings.colorize)
+        msg(pool.summary(), 'info', uisettings.colorize)
+        msg(pool.transfer.summary(), 'info', uisettings.colorize)
+        if cache:
+            msg(cache.summary(), 'info', uisettings.colorize)
+    if consecutive_nulls >= _MAX_NULLS:
         if not uisettings.quiet:
             msg('Too many consecutive null responses -- something is wrong',
                 'error', uisettings.colorize)
+    if checkpoint and (interrupted or consecutive_nulls >= _MAX_NULLS):
+        msg('Progress saved -- use the resume option to continue from record {}'
+            .format(checkpoint.offset), 'warn', uisettings.colorize)
+    elif checkpoint:
+        checkpoint.remove()
     yield None
 
 
-def entries_from_file(file, max_records, start_index, proxyinfo, uisettings):
-    xmlfile = open(file, 'r')
-    if __debug__: log('parsing XML file {}', file)
+def entries_from_file(file, max_records, start_index, proxyinfo, uisettings,
+                      checksettings = None, processes = 1):
+    # The records are read as they are needed, so that memory use does not
+    # depend on the size of the file.  Records before 'start_index' are
+    # parsed (to find where the next one begins) but not otherwise used.
+    # The file can contain MARC XML or binary MARC, possibly compressed;
+    # see file_format().  If 'processes' is more than 1, uncompressed files
+    # are parsed in that many processes (see chunks.py).
+    checksettings = checksettings or CheckSettings()
+    if __debug__: log('reading file {}', file)
+    source = _file_records(file, processes)
     try:
-        xmlcontent = ElementTree.parse(xmlfile)
-        for data in _extracted_data(xmlcontent):
+        start = max(start_index - 1, 0) if start_index else 0
+        stop = (start + max_records) if max_records else None
+        records = islice(source, start, stop)
+        for data in _extracted_data(records, proxyinfo, uisettings, checksettings):
             yield data
     except KeyboardInterrupt:
         msg('Stopped', 'warn', uisettings.colorize)
@@ -163,17 +336,61 @@ def entries_from_file(file, max_records, start_index, proxyinfo, uisettings):
         msg('Error: {}'.format(err), 'error', uisettings.colorize)
         yield None
     finally:
-        xmlfile.close()
+        source.close()
+
+
+def file_format(file):
+    '''Return a tuple of (format, compression) for the file named 'file',
+    based on its name extensions.  The format is "xml" for MARC XML (.xml),
+    "marc21" for binary MARC (.mrc or .marc), or None if not recognized, and
+    the compression is ".gz", ".xz" or None.'''
+    (name, extension) = os.path.splitext(file.lower())
+    compression = None
+    if extension in _DECOMPRESSORS:
+        compression = extension
+        (name, extension) = os.path.splitext(name)
+    return (_FILE_FORMATS.get(extension), compression)
+
+
+def _file_records(file, processes = 1):
+    # Generator producing TindRecord objects for the records in 'file'.
+    (kind, compression) = file_format(file)
+    if compression:
+        if __debug__ and processes > 1: log('compressed files are read in one process')
+        with _DECOMPRESSORS[compression](file, 'rb') as input:
+            yield from _records_in(kind, input)
+    elif processes > 1:
+        yield from parsed_in_parallel(file, kind, partial(_records_in, kind), processes)
+    elif kind == 'marc21':
+        yield from _marc21_tind_records(mapped_marc21_records(file))
+    else:
+        with open(file, 'rb') as input:
+            yield from _records_in(kind, input)
 
 
-def _extracted_data(marcxml, proxyinfo):
-    # Generator producing a list of TindData named tuples. The url_data field
-    # is a list of UrlData structures retured by Urlup for each URL found in
-    # field 856 (if any are found) for the MARC XML record.
+def _records_in(kind, stream):
+    # Returns a generator producing TindRecord objects for the records in
+    # the binary file-like object 'stream', in the format 'kind'.
+    if kind == 'marc21':
+        return _marc21_tind_records(marc21_records(stream))
+    return _tind_records(marc_records(stream))
 
-    for e in marcxml.findall('{http://www.loc.gov/MARC21/slim}record'):
+
+def _marc21_tind_records(records):
+    # Like _tind_records(), but for (id, urls) tuples read from binary MARC.
+    for (id, urls) in records:
+        if not id:
+            if __debug__: log('skipping entry without id')
+            continue
+        yield TindRecord(id, [eds_url(url) for url in urls])
+
+
+def _tind_records(elements):
+    # Generator producing TindRecord objects for MARC XML record elements.
+    # The urls field is the list of URLs found in field 856 (if any).
+
+    for e in elements:
         id = ''
-        final_urls = []
         original_urls = []
         # Look through this record, searching for field 856.
         # If found, gather up all URLs (datafield code 'u') into original_urls
@@ -192,77 +409,373 @@ def _extracted_data(marcxml, proxyinfo):
         if not id:
             if __debug__: log('skipping entry without id')
             continue
-        if len(original_urls) == 0:
-            if __debug__: log('no URLs in record for {}', id)
-            yield TindData(id, [])
-            continue
+        yield TindRecord(id, original_urls)
 
-        # Setting the user agent is because Proquest.com returns a 403
-        # otherwise, possibly as an attempt to block automated scraping.
-        # Changing the user agent to a browser name seems to solve it.
-        headers = {'User-Agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X x.y; rv:42.0)'}
-        # This next thing is a hack that makes ebscohost think we're logged in.
-        # It's the only way I found so far to avoid the occasional "upcoming
-        # maintenance" announcement click-through pages.
-        cookies = {'EBSESSIONID': '79e365c204f844af99f26dd45fedf6e1',
-                   'EBUQUSER': '79e365c204f844af99f26dd45fedf6e1'}
-        if __debug__: log('calling urlup on record ' + id)
-        url_data_list = updated_urls(original_urls, cookies, headers,
-                                     proxyinfo.user, proxyinfo.password,
-                                     proxyinfo.use_keyring, proxyinfo.reset)
-        if __debug__: log('got {} URLs for {}', len(url_data_list), id)
-        url_data_list = list(map(rewrite_url, url_data_list))
-        yield TindData(id, url_data_list)
-
-
-def tind_records(query, start, proxyinfo):
-    query = substituted(query, '&jrec=', '&jrec=' + str(start))
-    parts = urlsplit(query)
-    if parts.scheme == 'https':
-        conn = http.client.HTTPSConnection(parts.netloc, timeout=_NETWORK_TIMEOUT)
+
+def _extracted_data(records, proxyinfo, uisettings, checksettings):
+    # Generator producing a list of TindData named tuples. The url_data field
+    # is a list of UrlData structures retured by Urlup for each URL found in
+    # field 856 (if any are found) for the MARC XML record.  The URLs of
+    # several records are checked at the same time.
+    (checker, check, hosts, breaker, dedup, redirects, timer, rewrites,
+     url_cache, session) = _record_checker(
+        checksettings, proxyinfo)
+    count = 0
+    try:
+        for (record, data) in checker.map(check, records):
+            count += 1
+            yield data
+    finally:
+        if checksettings.rules_file:
+            redirects.save(checksettings.rules_file)
+        session.close()
+        if url_cache:
+            url_cache.close()
+    if not uisettings.quiet:
+        msg('Processed {} entries'.format(count), 'info', uisettings.colorize)
+        _report_checks(uisettings, checksettings, checker, hosts, breaker, dedup,
+                       redirects, timer, rewrites, url_cache, session)
+
+
+def _report_checks(uisettings, checksettings, checker, hosts, breaker, dedup,
+                   redirects, timer, rewrites, url_cache, session):
+    # Prints the summaries of the objects made by _record_checker().
+    msg(checker.summary(), 'info', uisettings.colorize)
+    msg(hosts.summary(), 'info', uisettings.colorize)
+    msg(breaker.summary(), 'info', uisettings.colorize)
+    msg(dedup.summary(), 'info', uisettings.colorize)
+    msg(redirects.summary(), 'info', uisettings.colorize)
+    msg(timer.summary(), 'info', uisettings.colorize)
+    msg(rewrites.summary(), 'info', uisettings.colorize)
+    if session.requests:
+        msg(session.summary(), 'info', uisettings.colorize)
+    if checksettings.head_first:
+        msg(checker.engine.summary(), 'info', uisettings.colorize)
+    if url_cache:
+        msg(url_cache.summary(), 'info', uisettings.colorize)
+
+
+def _record_checker(checksettings, proxyinfo, record_of = lambda item: item):
+    # Returns a UrlChecker, the function it should be given to check the URLs
+    # of items, where 'record_of' returns the TindRecord of an item, the
+    # HostScheduler used to keep from overloading any one host, the
+    # CircuitBreaker used to skip hosts that are down, the UrlDeduplicator
+    # used to check each URL only once, the RedirectLearner used to learn
+    # (and maybe predict) redirections, the CheckTimer used to limit (and
+    # maybe hedge) slow checks, the RewriteRules applied to the results, the
+    # UrlCache used to avoid checking URLs checked in earlier runs (or None),
+    # and the ProxySession used for URLs that go through a proxy.
+    hosts = HostScheduler(checksettings.host_limit)
+    breaker = CircuitBreaker()
+    dedup = UrlDeduplicator(canonical_url)
+    redirects = RedirectLearner()
+    predict = checksettings.predict
+    timer = CheckTimer(checksettings.url_deadline, checksettings.record_deadline,
+                       checksettings.hedge)
+    rewrites = RewriteRules.load(checksettings.rewrite_file)
+    session = ProxySession(proxyinfo, _URL_HEADERS, _URL_COOKIES,
+                           session_file() if proxyinfo.keep_session else None)
+    cache = None
+    if checksettings.url_cache:
+        cache = UrlCache(refresh = checksettings.refresh)
+    if checksettings.engine == 'async':
+        engine = AsyncUrlEngine(_URL_HEADERS, _URL_COOKIES,
+                                head_first = checksettings.head_first)
+        checker = AsyncUrlChecker(engine, checksettings.workers)
+        check = lambda item: _async_tind_data(record_of(item), session, hosts,
+                                              breaker, dedup, redirects, predict,
+                                              timer, rewrites, engine, cache)
+    elif checksettings.head_first:
+        # Urlup always does GET requests, so the threads use our own code
+        # for URLs that don't go through a proxy.
+        engine = AsyncUrlEngine(_URL_HEADERS, _URL_COOKIES, head_first = True)
+        checker = ThreadedEngineChecker(engine, checksettings.workers)
+        check = lambda item: _tind_data(record_of(item), session, hosts, breaker,
+                                        dedup, redirects, predict, timer, rewrites,
+                                        cache, engine)
     else:
-        conn = http.client.HTTPConnection(parts.netloc, timeout=_NETWORK_TIMEOUT)
-    if __debug__: log('connecting to {} using url {}', parts.netloc, query)
+        checker = UrlChecker(checksettings.workers)
+        check = lambda item: _tind_data(record_of(item), session, hosts, breaker,
+                                        dedup, redirects, predict, timer, rewrites,
+                                        cache)
+    return (checker, check, hosts, breaker, dedup, redirects, timer, rewrites, cache,
+            session)
+
+
+def _numbered_records(pages):
+    # Generator turning (start, records) pages into tuples of (number,
+    # record, first), where 'first' is True for the first record of a page.
+    # Stops at a page of None.
+    for (start, records) in pages:
+        if records is None:
+            return
+        if __debug__: log('looping over {} TIND records', len(records))
+        for (offset, record) in enumerate(records):
+            yield (start + offset, record, offset == 0)
+
+
+def _tind_data(record, session, hosts, breaker, dedup, redirects, predict,
+               timer, rewrites, cache = None, engine = None):
+    # Returns a TindData named tuple for the TindRecord 'record', with the
+    # final URLs rewritten using the RewriteRules 'rewrites'.
+    id = record.id
+    # Blank URLs (such as an empty 856 $u) are left out, as Urlup has no
+    # result for them.
+    original_urls = [url for url in record.urls if url.strip()]
+    if len(original_urls) == 0:
+        if __debug__: log('no URLs in record for {}', id)
+        return TindData(id, [])
+    if __debug__: log('calling urlup on record ' + id)
+    url_data_list = _urlup_data(original_urls, session, hosts, breaker, dedup,
+                                redirects, predict, timer, cache, engine)
+    if __debug__: log('got {} URLs for {}', len(url_data_list), id)
+    url_data_list = [rewrite_url(url_data, rewrites) for url_data in url_data_list]
+    return TindData(id, url_data_list)
+
+
+async def _async_tind_data(record, session, hosts, breaker, dedup, redirects,
+                           predict, timer, rewrites, engine, cache = None):
+    # Like _tind_data(), but for use with an AsyncUrlEngine.  URLs that go
+    # through a proxy are given to the ProxySession, in a separate thread.
+    record_began = time()
+
+    async def attempt(url):
+        async with hosts.async_slot(url):
+            probe = breaker.check(url)
+            url_data = None
+            try:
+                url_data = await timer.async_timed(url, engine.checked_url,
+                                                   record_began)
+            finally:
+                breaker.record(url, url_data, probe)
+        return url_data
+
+    async def checked(url):
+        url_data = cache.get(url.strip()) if cache else None
+        if url_data is None and predict:
+            url_data = redirects.predicted(url)
+            if url_data:
+                return url_data
+        if url_data is None:
+            url_data = await timer.async_hedged(url, attempt)
+            if cache and url_data.error != DEADLINE_EXCEEDED:
+                cache.put(url_data)
+        redirects.observe(url_data)
+        return url_data
+
+    async def result(url):
+        while True:
+            try:
+                return await dedup.async_result(url, checked)
+            except HostUnavailable:
+                return UrlData(url.strip(), None, None, HOST_UNAVAILABLE)
+            except RecordDeadline:
+                # If it was another record that ran out of time, this one
+                # still needs a result, so try again.
+                if timer.out_of_time(record_began):
+                    return UrlData(url.strip(), None, None, DEADLINE_EXCEEDED)
+
+    id = record.id
+    # Blank URLs are left out, as in _tind_data().
+    urls = [url for url in record.urls if url.strip()]
+    if len(urls) == 0:
+        if __debug__: log('no URLs in record for {}', id)
+        return TindData(id, [])
+    proxied = [url for url in urls if 'proxy' in url]
+    direct = [url for url in urls if 'proxy' not in url]
+    results = await asyncio.gather(*[result(url) for url in direct])
+    results = dict(zip(direct, results))
+    if proxied:
+        loop = asyncio.get_running_loop()
+        proxied_results = await loop.run_in_executor(None, _urlup_data, proxied,
+                                                     session, hosts, breaker,
+                                                     dedup, redirects, predict,
+                                                     timer, cache, None,
+                                                     record_began)
+        results.update(zip(proxied, proxied_results))
+    url_data_list = [rewrite_url(results[url], rewrites) for url in urls]
+    if __debug__: log('got {} URLs for {}', len(url_data_list), id)
+    return TindData(id, url_data_list)
+
+
+def _urlup_data(urls, session, hosts, breaker, dedup, redirects, predict,
+                timer, cache = None, engine = None, record_began = None):
+    # Returns a list of UrlData named tuples for 'urls', obtained by Urlup,
+    # or by the ProxySession 'session' for URLs that go through a proxy.
+    # Each URL is given to Urlup separately, once its host is free, unless
+    # the same URL has already been seen in this run or its host has been
+    # failing.  The results are given to the RedirectLearner 'redirects',
+    # and if 'predict' is True, URLs it has a rule for are not dereferenced.
+    # The CheckTimer 'timer' puts time limits on each URL and on the record
+    # as a whole (taken to have started at 'record_began', or now), and
+    # hedges slow checks if asked to.  If given a UrlCache, results found in
+    # it are used instead, and new results are stored in it.  If given an
+    # AsyncUrlEngine, it is used instead of Urlup for URLs that don't go
+    # through a proxy.
+    record_began = record_began or time()
+
+    def dereferenced(url):
+        if 'proxy' in url:
+            return session.checked_url(url)
+        elif engine and url.strip():
+            return engine.checked_url_from_thread(url)
+        else:
+            return _urlup_url_data(url)
+
+    def attempt(url):
+        # The host slot is released when the check is over, even if it goes
+        # on in the background after being given up on.  A check abandoned
+        # because the record ran out of time is not held against the host.
+        with ExitStack() as stack:
+            stack.enter_context(hosts.slot(url))
+            probe = breaker.check(url)
+            url_data = None
+            try:
+                url_data = timer.timed(url, dereferenced, record_began,
+                                       stack.pop_all().close)
+            finally:
+                breaker.record(url, url_data, probe)
+        return url_data
+
+    def checked(url):
+        url_data = cache.get(url.strip()) if cache else None
+        if url_data is None and predict:
+            url_data = redirects.predicted(url)
+            if url_data:
+                return url_data
+        if url_data is None:
+            url_data = timer.hedged(url, attempt)
+            if cache and url_data and url_data.error != DEADLINE_EXCEEDED:
+                cache.put(url_data)
+        redirects.observe(url_data)
+        return url_data
+
+    def result(url):
+        while True:
+            try:
+                return dedup.result(url, checked)
+            except HostUnavailable:
+                return UrlData(url.strip(), None, None, HOST_UNAVAILABLE)
+            except RecordDeadline:
+                # As in _async_tind_data(), retry if another record ran out.
+                if timer.out_of_time(record_began):
+                    return UrlData(url.strip(), None, None, DEADLINE_EXCEEDED)
+
+    return [result(url) for url in urls]
+
+
+def _urlup_url_data(url):
+    # Urlup needs no proxy credentials for URLs that don't go through a proxy.
+    return updated_urls([url], _URL_COOKIES, _URL_HEADERS)[0]
+
+
+def _fetched_page(query, start, proxyinfo, pool, pacer, cache = None, size = None,
+                  retrier = None):
+    # Like tind_records(), but returns None for a page without records, and
+    # asks for 'size' records or else the number the pacer recommends.  If
+    # given a Retrier, failed requests are retried with it.
+    if retrier:
+        return retrier.call(_fetched_page, query, start, proxyinfo, pool, pacer,
+                            cache, size)
+    query = substituted(query, '&rg=', '&rg=' + str(size or pacer.page_size))
+    if cache:
+        records = _cached_records(query, start, cache)
+        if records is not None:
+            pacer.record_cached()
+            return records or None
+    began = time()
+    try:
+        records = tind_records(query, start, proxyinfo, pool, cache)
+    except ServerError as err:
+        pacer.record(time() - began, status = err.status)
+        raise
+    except Exception:
+        pacer.record(time() - began, error = True)
+        raise
+    count = 0 if records is None else len(records)
+    pacer.record(time() - began, records = count)
+    return records if count > 0 else None
+
+
+def _highest_recid(query, proxyinfo, pool):
+    # Returns the highest record id in the results of the search 'query'.
+    query = substituted(query, '&sf=', '')
+    query = substituted(query, '&so=', '&so=d')
+    query = substituted(query, '&rg=', '&rg=1')
+    records = tind_records(query, 1, proxyinfo, pool)
+    if not records:
+        return 0
+    return int(records[0].id)
+
+
+def _same_results(query, other_query, start, page_size, proxyinfo, pool):
+    # Returns True if both queries produce the same record ids and URLs for
+    # the page of results beginning at 'start'.
+    def contents(query):
+        query = substituted(query, '&rg=', '&rg=' + str(page_size))
+        records = tind_records(query, start, proxyinfo, pool) or []
+        return [(record.id, record.urls) for record in records]
+    return contents(query) == contents(other_query)
+
+
+def _cached_records(query, start, cache):
+    # Returns a list of TindRecord objects, or None if the page isn't cached.
+    cached = cache.get(substituted(query, '&jrec=', '&jrec=' + str(start)))
+    if cached is None:
+        return None
+    with cached:
+        return list(_tind_records(marc_records(cached)))
+
+
+def tind_records(query, start, proxyinfo, pool = None, cache = None):
+    # Returns a list of TindRecord objects.  The response is parsed as it
+    # arrives, and each record's XML is discarded once its id and URLs have
+    # been extracted, so we never hold a whole page of XML in memory.
+    # If not given a connection pool, use a throwaway one for this call.
+    # If given a PageCache, the content received is stored in it.
+    if pool is None:
+        with ConnectionPool(timeout = _NETWORK_TIMEOUT) as pool:
+            return tind_records(query, start, proxyinfo, pool, cache)
+    query = substituted(query, '&jrec=', '&jrec=' + str(start))
+    if __debug__: log('fetching {}', query)
     headers = { 'Cookie': _SESSION_COOKIE }
-    conn.request("GET", query, headers = headers)
-    response = conn.getresponse()
-    if __debug__: log('got response code {}', response.status)
-    if response.status in [200, 202]:
-        body = response.read().decode("utf-8")
-        return ElementTree.fromstring(body)
-    elif response.status in [301, 302, 303, 308]:
-        raise Exception('Server returned code {} -- unable to continue'.format(response.status))
+    with pool.response(query, headers, compressed = True) as response:
+        if __debug__: log('got response code {}', response.status)
+        if response.status in [200, 202] and cache:
+            with cache.storing(query) as copy:
+                return list(_tind_records(marc_records(CopyingReader(response, copy))))
+        elif response.status in [200, 202]:
+            return list(_tind_records(marc_records(response)))
+        # Always read the body, so that the connection can be reused.
+        response.read()
+    if response.status in [301, 302, 303, 308, 429] or response.status >= 500:
+        raise ServerError(response.status, retry_after = _seconds(response.getheader('Retry-After')))
     return None
 
 
-def num_records(marcxml):
-    return len(marcxml.findall('{http://www.loc.gov/MARC21/slim}record'))
+def _seconds(retry_after):
+    # Only the number-of-seconds form of Retry-After is understood.
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return None
 
 
-# This is a start.  Probabaly will have to create an objection and better
-# organization if more URLs are needed in the future.
+def num_records(marcxml):
+    return len(marcxml.findall(MARC_RECORD))
 
-_recognized_patterns = [
-    r'https://ebookcentral.proquest.com/auth/lib/caltech-ebooks/maintenance.action\?returnURL=(http.*)$',
-]
 
-def rewrite_url(url_data):
-    for pat in _recognized_patterns:
-        if not url_data.final:
-            continue
-        content_match = re.match(pat, url_data.final)
-        if content_match:
-            real_destination = decoded_html(content_match.group(1))
-            return UrlData(url_data.original, real_destination,
-                           url_data.status, url_data.error)
-    return url_data
+def rewrite_url(url_data, rules = None):
+    # Returns 'url_data' rewritten using the RewriteRules 'rules', or the
+    # rules shipped with Turf if not given any.
+    return (rules or shipped_rules()).rewritten(url_data)
 
 
-def recognized_url(url):
-    return any(re.match(case[0], url) for case in _rewritable_urls)
+def recognized_url(url, rules = None):
+    # Returns True if 'rules' (as for rewrite_url()) would rewrite 'url'.
+    return (rules or shipped_rules()).recognized(url)
 
 
-
 # Miscellaneous utilities.
 # .............................................................................
 
@@ -297,26 +810,45 @@ def eds_url(url):
         import pdb; pdb.set_trace()
 
 
-htmlCodes = (
-    (r'&amp;', '&'),
-    (r'&#39;', "'"),
-    (r'&quot;', '"'),
-    (r'&gt;', '>'),
-    (r'&lt;', '<'),
-    (r'%2B', '+'),
-    (r'%2C', ','),
-    (r'%2F', '/'),
-    (r'%20', ' '),
-    (r'%3A', ':'),
-    (r'%3D', '='),
-    (r'%3F', '?'),
-)
-
-
-def decoded_html(s):
-    for code in htmlCodes:
-        s = s.replace(code[0], code[1])
-    return s
+_UNRESERVED = frozenset('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-._~')
+'''Characters that mean the same in a URL whether percent-encoded or not.'''
+
+def canonical_url(url):
+    # Returns a form of 'url' that is the same for URLs that differ only in
+    # ways that can't change where they lead: HTML character entities left
+    # in the URL, the case of the scheme and host name, a default port
+    # number, a missing slash after the host name, and percent-encoding of
+    # characters that don't need it (or in lower case).  Other characters
+    # in decoded_html()'s list are left encoded, because decoding them can
+    # change the meaning of a URL.
+    url = url.strip()
+    for (code, char) in htmlCodes:
+        if code.startswith('&'):
+            url = url.replace(code, char)
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        # Malformed, and checking it will say so; leave it as it is.
+        return url
+    if not parts.scheme or not parts.netloc:
+        return url
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.rpartition('@')[2].lower()
+    if parts.username is not None:
+        netloc = parts.netloc.rpartition('@')[0] + '@' + netloc
+    default_port = {'http': ':80', 'https': ':443'}.get(scheme)
+    if default_port and netloc.endswith(default_port):
+        netloc = netloc[: -len(default_port)]
+    path = _normalized_escapes(parts.path) or '/'
+    query = _normalized_escapes(parts.query)
+    return urlunsplit((scheme, netloc, path, query, parts.fragment))
+
+
+def _normalized_escapes(text):
+    def normalized(match):
+        char = chr(int(match.group(1), 16))
+        return char if char in _UNRESERVED else match.group(0).upper()
+    return re.sub(r'%([0-9A-Fa-f]{2})', normalized, text)
 
 
 def substituted(query, cmd, replacement):
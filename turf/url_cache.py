@@ -0,0 +1,187 @@
+'''
+url_cache.py: on-disk cache of the results of dereferencing URLs in Turf.
+
+Authors
+-------
+
+Michael Hucka <mhucka@caltech.edu> -- Caltech Library
+
+Copyright
+---------
+
+Copyright (c) 2018 by the California Institute of Technology.  This code is
+open-source software released under a 3-clause BSD license.  Please see the
+file "LICENSE" for more information.
+'''
+
+import os
+from   os import path
+import sqlite3
+import sys
+from   threading import Lock
+from   time import time
+
+try:
+    thisdir = os.path.dirname(os.path.abspath(__file__))
+    sys.path.append(os.path.join(thisdir, '../..'))
+except:
+    sys.path.append('../..')
+
+from urlup import UrlData
+
+import turf
+from turf.page_cache import cache_dir
+
+# NOTE: to turn on debugging, make sure python -O was *not* used to start
+# python, then set the logging level to DEBUG *before* loading this module.
+# Conversely, to optimize out all the debugging code, use python -O or -OO
+# and everything inside "if __debug__" blocks will be entirely compiled out.
+if __debug__:
+    import logging
+    logging.basicConfig(level = logging.INFO)
+    logger = logging.getLogger('turf')
+    def log(s, *other_args): logger.debug('url_cache: ' + s.format(*other_args))
+
+
+# Global constants.
+# .............................................................................
+
+_DAY = 24 * 60 * 60
+
+_TTL = {
+    'unchanged'   : 30 * _DAY,
+    'redirected'  : 30 * _DAY,
+    'http error'  : 3 * _DAY,
+    'other error' : _DAY / 4,
+}
+'''How long (in seconds) results are reused, by kind of outcome.  URLs that
+work rarely change from one week to the next.  HTTP errors (such as 404) are
+worth checking again sooner, and errors without an HTTP status code (such as
+timeouts) are often temporary, so they are only kept for a few hours.'''
+
+_MAX_ENTRIES = 1000000
+'''Upper limit on the number of results kept in the cache.'''
+
+_COMMIT_INTERVAL = 200
+'''Number of new results stored between commits to the database.'''
+
+
+# Class definitions.
+# .............................................................................
+
+class UrlCache():
+    '''Cache of UrlData results, keyed by the original URL, kept in an SQLite
+    database in the file 'file'.
+
+    Each result is reused until it is older than the time to live for its
+    kind of outcome (see _TTL).  When there are more than 'max_entries'
+    results, the least recently used ones are deleted.  If 'refresh' is True,
+    nothing is read from the cache, but new results are still stored.  The
+    object can be used from several threads.  Call close() when done.
+    '''
+
+    def __init__(self, file = None, ttl = _TTL, max_entries = _MAX_ENTRIES,
+                 refresh = False):
+        if not file:
+            os.makedirs(cache_dir(), exist_ok = True)
+            file = path.join(cache_dir(), 'urls.sqlite')
+        self.file = file
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._uncommitted = 0
+        self._lock = Lock()
+        self._db = sqlite3.connect(file, check_same_thread = False)
+        self._db.execute('''create table if not exists urls (
+                              url     text primary key,
+                              final   text,
+                              status  integer,
+                              error   text,
+                              checked real,
+                              used    real)''')
+        self._db.execute('create index if not exists urls_used on urls (used)')
+        self._db.commit()
+
+
+    def get(self, url):
+        '''Return the UrlData result cached for 'url', or None if there is
+        no fresh result for it.'''
+        with self._lock:
+            row = None
+            if not self.refresh and self._db:
+                row = self._db.execute('select final, status, error, checked from urls'
+                                       ' where url = ?', (url,)).fetchone()
+            if row:
+                (final, status, error, checked) = row
+                data = UrlData(url, final, status, error)
+                if time() - checked <= self.ttl[_outcome(data)]:
+                    self.hits += 1
+                    self._db.execute('update urls set used = ? where url = ?', (time(), url))
+                    self._note_change()
+                    return data
+            self.misses += 1
+            return None
+
+
+    def put(self, data):
+        '''Store the UrlData result 'data'.'''
+        now = time()
+        with self._lock:
+            if not self._db:
+                # Checks still running when the cache was closed end up here.
+                return
+            self._db.execute('insert or replace into urls values (?, ?, ?, ?, ?, ?)',
+                             (data.original, data.final, data.status, data.error,
+                              now, now))
+            self._note_change()
+
+
+    def close(self):
+        '''Save any uncommitted changes and close the database.'''
+        with self._lock:
+            if self._db:
+                self._evict()
+                self._db.commit()
+                self._db.close()
+                self._db = None
+
+
+    def summary(self):
+        '''Return a short text summary of how the cache was used.'''
+        return 'Used cached results for {} URLs out of {}'.format(
+            self.hits, self.hits + self.misses)
+
+
+    def _note_change(self):
+        self._uncommitted += 1
+        if self._uncommitted >= _COMMIT_INTERVAL:
+            self._evict()
+            self._db.commit()
+            self._uncommitted = 0
+
+
+    def _evict(self):
+        (count,) = self._db.execute('select count(*) from urls').fetchone()
+        if count > self.max_entries:
+            if __debug__: log('evicting {} entries', count - self.max_entries)
+            self._db.execute('delete from urls where url in (select url from urls'
+                             ' order by used limit ?)', (count - self.max_entries,))
+
+
+# Miscellaneous utilities.
+# .............................................................................
+
+def _outcome(data):
+    if data.error or not data.final:
+        return 'http error' if data.status else 'other error'
+    return 'unchanged' if data.final == data.original else 'redirected'
+
+
+# Please leave the following for Emacs users.
+# ......................................................................
+# Local Variables:
+# mode: python
+# python-indent-offset: 4
+# End:
@@ -15,6 +15,7 @@ file "LICENSE" for more information.
 '''
 
 import csv
+from   itertools import chain
 import os
 import openpyxl
 from   openpyxl.styles import Font
@@ -55,17 +56,21 @@ _NUM_URLS = 5
 #   (id, [UrlData, UrlData, ...])
 # where "UrlData" is the UrlData structure retured by urlup for each
 # URL found in field 856 (if any are found) for the MARC XML record.
+#
+# If given a Checkpoint object, the writers first write out again the rows
+# recorded in it by an earlier run, and then record in it each row written.
 
-def write_results(filename, results, include_unchanged, all):
+def write_results(filename, results, include_unchanged, all, checkpoint = None):
     # Call on appropriate functions for the desired output format.
     name, extension = os.path.splitext(filename)
     if extension.lower() == '.csv':
-        write_csv(filename, results, include_unchanged, all)
+        write_csv(filename, results, include_unchanged, all, checkpoint)
     else:
-        write_xls(filename, results, include_unchanged, all)
+        write_xls(filename, results, include_unchanged, all, checkpoint)
 
 
-def write_csv(filename, tind_results, include_unchanged, all):
+def write_csv(filename, tind_results, include_unchanged, all, checkpoint = None):
+    previous = checkpoint.take_rows() if checkpoint else []
     file = open(filename, 'w', newline='')
 
     # Write the header row.
@@ -75,7 +80,7 @@ def write_csv(filename, tind_results, include_unchanged, all):
     file.write(text + '\n')
     csvwriter = csv.writer(file, delimiter=',')
     try:
-        for item in tind_results:
+        for item in chain(previous, tind_results):
             if not item:
                 if __debug__: log('no data -- stopping')
                 break
@@ -96,6 +101,8 @@ def write_csv(filename, tind_results, include_unchanged, all):
             if item.url_data or all:
                 csvwriter.writerow(row)
                 file.flush()
+                if checkpoint:
+                    checkpoint.add_row(item)
     except KeyboardInterrupt:
         msg('Interrupted -- closing "{}" and exiting'.format(filename))
     except Exception:
@@ -104,7 +111,9 @@ def write_csv(filename, tind_results, include_unchanged, all):
         file.close()
 
 
-def write_xls(filename, tind_results, include_unchanged, all):
+def write_xls(filename, tind_results, include_unchanged, all, checkpoint = None):
+    previous = checkpoint.take_rows() if checkpoint else []
+
     # Create some things we reuse below.
     bold_style = Font(bold = True, underline = "single")
     hyperlink_style = Font(underline='single', color='0563C1')
@@ -140,7 +149,7 @@ def write_xls(filename, tind_results, include_unchanged, all):
 
     # Now create the data rows.
     try:
-        for row_number, item in enumerate(tind_results, 2):
+        for row_number, item in enumerate(chain(previous, tind_results), 2):
             if not item:
                 if __debug__: log('no data -- stopping')
                 break
@@ -169,6 +178,8 @@ def write_xls(filename, tind_results, include_unchanged, all):
                     cell.font = hyperlink_style
                 row.append(cell)
             sheet.append(row)
+            if checkpoint:
+                checkpoint.add_row(item)
     except KeyboardInterrupt:
         msg('Interrupted -- closing "{}" and exiting'.format(filename))
     except Exception: